@@ -390,7 +390,8 @@ E const char *const monexplain[], invisexplain[], *const oclass_names[];
 #define FQN_MAX_FILENAME 512
 #endif
 
-#if defined(NOCWD_ASSUMPTIONS) || defined(VAR_PLAYGROUND)
+#if defined(NOCWD_ASSUMPTIONS) || defined(VAR_PLAYGROUND) \
+    || defined(NLE_PLAYGROUND)
 /* the bare-bones stuff is unconditional above to simplify coding; for
  * ports that actually use prefixes, add some more localized things
  */
@@ -86,6 +86,11 @@ char *FDECL(dlb_fgets, (char *, int, DLB_P));
 int FDECL(dlb_fgetc, (DLB_P));
 long FDECL(dlb_ftell, (DLB_P));
 
+/* NLE: For nle_restore in nle.c. MAX_LIBS used to be in dlb.c. */
+#define MAX_LIBS 4
+void FDECL(dlb_take_files, (FILE **));
+void FDECL(dlb_give_files, (FILE **));
+
 /* Resource DLB entry points */
 #ifdef DLBRSRC
 boolean rsrc_dlb_init(void);
@@ -106,6 +111,10 @@ long rsrc_dlb_ftell(dlb *dp);
 #define dlb_init()
 #define dlb_cleanup()
 
+#define MAX_LIBS 1
+#define dlb_take_files(files)
+#define dlb_give_files(files)
+
 #define dlb_fopen fopen
 #define dlb_fclose fclose
 #define dlb_fread fread
@@ -1,8 +1,6 @@
 #ifndef NLE_H
 #define NLE_H
 
-#define NLE_BZ2_TTYRECS
-
 #include <stdio.h>
 
 #include <fcontext/fcontext.h>
@@ -15,6 +13,32 @@
 
 typedef struct TMT TMT;
 
+#define NLE_MAX_SEGMENTS 4
+
+/* A writable part of this library's memory, and its state after loading. */
+typedef struct nle_segment {
+    char *start;
+    size_t size;
+    char *pristine;
+} nle_segment_t;
+
+#define NLE_ARENA_CLASSES 48
+
+/*
+ * Where the game's heap lives while it runs, so that nle_snapshot can copy
+ * it. A bump allocator with free lists per size class. See nle.c.
+ */
+typedef struct nle_arena {
+    char *base;
+    char *top;
+    char *end;
+    void *free_lists[NLE_ARENA_CLASSES];
+    boolean active; /* Only allocate here while the game runs. */
+} nle_arena_t;
+
+/* The state of a running game. See nle_snapshot in nle.c. */
+typedef struct nle_snapshot nle_snapshot_t;
+
 typedef struct nle_globals {
     fcontext_stack_t stack;
     fcontext_t returncontext;
@@ -22,28 +46,58 @@ typedef struct nle_globals {
 
     FILE *ttyrec;
     TMT *vterminal;
+    long tty_changed; /* NLE_CHANGED_TTY_* since the last nle_yield. */
     char outbuf[BUFSIZ];
     char *outbuf_write_ptr;
     char *outbuf_write_end;
 
-#ifdef NLE_BZ2_TTYRECS
-    void *ttyrec_bz2;
-#endif
+    char ttyrec_codec; /* NLE_TTYREC_*, from when ttyrec was opened. */
+    struct nle_ttyrec *ttyrec_out; /* See nle.c. */
+    /* What the game wrote to the ttyrec and hasn't been compressed and
+       written out yet. That happens outside of the game, on the caller's
+       stack or by ttyrec_writer. */
+    char *ttyrec_buf;
+    size_t ttyrec_buf_size;
+    size_t ttyrec_buf_capacity;
+    int ttyrec_buf_frames;
+    int (*ttyrec_writer)(void *, nle_ttyrec_chunk *);
+    void *ttyrec_writer_arg;
 
     boolean done;
     nle_obs *observation;
+    nle_seeds_init_t *seeds_init;
+
+    /* For nle_reset. Empty if not supported on this platform. */
+    nle_segment_t segments[NLE_MAX_SEGMENTS];
+    int num_segments;
+
+    /* For nle_snapshot. Empty (base == NULL) if not supported. */
+    nle_arena_t arena;
+
+    /* For nle_reset, see nle_fork_point. */
+    boolean fork_startup;
+    nle_snapshot_t *startup;
 } nle_ctx_t;
 
 /*
- * Would like to annotate this with __thread, but that causes
- * the MacOS dynamic linker to not unload the library on dlclose().
+ * Each game loads its own copy of this library, so this is per game.
+ * Different games can be stepped from different threads concurrently.
+ * It can't be __thread: A game may be resumed on another thread than the
+ * one it was suspended on. (Also, __thread causes the MacOS dynamic linker
+ * to not unload the library on dlclose().)
  */
 nle_ctx_t *current_nle_ctx;
 
 nle_ctx_t *nle_start(nle_obs *, FILE *, nle_seeds_init_t *);
 nle_ctx_t *nle_step(nle_ctx_t *, nle_obs *);
+nle_ctx_t *nle_reset(nle_ctx_t *, nle_obs *, FILE *, nle_seeds_init_t *);
 void nle_end(nle_ctx_t *);
 
+nle_snapshot_t *nle_snapshot(nle_ctx_t *);
+nle_ctx_t *nle_restore(nle_ctx_t *, nle_obs *, nle_snapshot_t *);
+void nle_free_snapshot(nle_ctx_t *, nle_snapshot_t *);
+boolean nle_set_fork_startup(nle_ctx_t *, boolean);
+
 void nle_set_seed(nle_ctx_t *, unsigned long, unsigned long, boolean);
 void nle_get_seed(nle_ctx_t *, unsigned long *, unsigned long *, boolean *);
 
@@ -16,14 +16,44 @@ typedef struct nledl_ctx {
     void *nle_ctx;
     void *(*step)(void *, nle_obs *);
     FILE *ttyrec;
+    int use_dlmopen;
+    /* Only set if use_dlmopen. */
+    long lmid;                  /* Lmid_t of the linker namespace. */
+    char ***environ;            /* The namespace's environ. */
+    void *(*uselocale)(void *); /* The namespace's uselocale. */
 } nle_ctx_t;
 
 nle_ctx_t *nle_start(const char *, nle_obs *, FILE *, nle_seeds_init_t *);
+
+/*
+ * Loads the library into its own linker namespace via dlmopen. All
+ * instances can then use the same file and share its text pages. Returns
+ * NULL if that's not possible, e.g. without glibc or when the process
+ * ran out of namespaces. Start the game with nle_reset.
+ */
+nle_ctx_t *nle_load_dlmopen(const char *, FILE *);
 nle_ctx_t *nle_step(nle_ctx_t *, nle_obs *);
 
 void nle_reset(nle_ctx_t *, nle_obs *, FILE *, nle_seeds_init_t *);
 void nle_end(nle_ctx_t *);
 
+/*
+ * Snapshots of a running game (see nle.c). nle_snapshot returns NULL if
+ * that's not supported. A snapshot can only be restored into the game it
+ * was taken from and must be freed before that game ends. nle_restore
+ * returns 0 on failure.
+ */
+void *nle_snapshot(nle_ctx_t *);
+int nle_restore(nle_ctx_t *, nle_obs *, void *);
+void nle_free_snapshot(nle_ctx_t *, void *);
+
+/*
+ * Whether later nle_resets start from a snapshot taken just before the
+ * dungeon is generated (see nle_fork_point in nle.c). Returns 0 if that's
+ * not supported. Needs to be set again if nle_reset reloads the library.
+ */
+int nle_set_fork_startup(nle_ctx_t *, char);
+
 void nle_set_seed(nle_ctx_t *, unsigned long, unsigned long, char);
 void nle_get_seed(nle_ctx_t *, unsigned long *, unsigned long *, char *);
 
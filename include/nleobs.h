@@ -11,16 +11,86 @@
 #define NLE_SCREEN_DESCRIPTION_LENGTH 80
 #define NLE_TERM_CO 80
 #define NLE_TERM_LI 24
+#define NLE_DIRTY_CELLS_SIZE 256
+#define NLE_ALL_CELLS_DIRTY -2 /* First entry of dirty_cells on overflow. */
+#define NLE_CROP_RADIUS 4 /* Default crop_radius, see nle_obs. */
+
+/* Bits of changed_keys, in the order of CHANGED_KEYS in nethack.py. */
+#define NLE_CHANGED_GLYPHS (1L << 0)
+#define NLE_CHANGED_CHARS (1L << 1)
+#define NLE_CHANGED_COLORS (1L << 2)
+#define NLE_CHANGED_SPECIALS (1L << 3)
+#define NLE_CHANGED_BLSTATS (1L << 4)
+#define NLE_CHANGED_MESSAGE (1L << 5)
+#define NLE_CHANGED_PROGRAM_STATE (1L << 6)
+#define NLE_CHANGED_INTERNAL (1L << 7)
+#define NLE_CHANGED_INV_GLYPHS (1L << 8)
+#define NLE_CHANGED_INV_LETTERS (1L << 9)
+#define NLE_CHANGED_INV_OCLASSES (1L << 10)
+#define NLE_CHANGED_INV_STRS (1L << 11)
+#define NLE_CHANGED_SCREEN_DESCRIPTIONS (1L << 12)
+#define NLE_CHANGED_TTY_CHARS (1L << 13)
+#define NLE_CHANGED_TTY_COLORS (1L << 14)
+#define NLE_CHANGED_TTY_CURSOR (1L << 15)
+#define NLE_CHANGED_SCREEN_DESCRIPTION_IDS (1L << 16)
+#define NLE_CHANGED_INV_STR_IDS (1L << 17)
+#define NLE_CHANGED_ALL ((1L << 18) - 1)
+
+/* Values of buffers_state. */
+#define NLE_BUFFERS_UNKNOWN 0 /* Anything may be in them. */
+#define NLE_BUFFERS_ZEROED 1  /* Zeroed as outside of a normal game. */
+#define NLE_BUFFERS_MAP 2     /* The map as winrl.cc drew it last. */
+
+/* Values of ttyrec_codec. */
+#define NLE_TTYREC_BZ2 0  /* bzip2, the default. */
+#define NLE_TTYREC_NONE 1 /* Don't write a ttyrec. */
+#define NLE_TTYREC_RAW 2  /* Uncompressed. */
+#define NLE_TTYREC_ZSTD 3 /* Only if built with NLE_ZSTD_TTYRECS. */
+#define NLE_TTYREC_KEYS 4 /* Only the keys (channel 1), a byte each. */
+
+/*
+ * ttyrec data a game hands to a ttyrec_writer (see nle_obs), one or more
+ * whole frames.
+ */
+typedef struct nle_ttyrec_chunk {
+    int frames; /* Number of frames in data. */
+    char last;  /* Bool: The ttyrec ends after this chunk. */
+    /* Writes the data into the ttyrec (and finishes it if last) and frees
+       the chunk. Can be called from any thread, but needs to be called in
+       the order the game handed out the chunks. */
+    void (*write)(struct nle_ttyrec_chunk *);
+    void *ttyrec; /* The rest is for write. */
+    char *data;
+    unsigned long size;
+} nle_ttyrec_chunk;
+
+/*
+ * Prompts that nle_step answers by itself instead of returning, like
+ * NLE._perform_known_steps in nle/env/base.py. See winrl.cc.
+ */
+typedef struct {
+    char press_more;            /* Bool: Press space at --More--. */
+    char escape_getlin;         /* Bool: Escape from text prompts. */
+    char escape_yn;             /* Bool: Escape from y/n questions, ... */
+    const char **yn_exceptions; /* ... except these. NULL-terminated. */
+} nle_prompt_policy;
 
 typedef struct nle_observation {
     int action;
     int done;
     char in_normal_game;     /* Bool indicating if other obs are set. */
+    nle_prompt_policy *prompt_policy; /* NULL after declining a question. */
+    const int *queued_actions; /* Keys to use after action, see winrl.cc. */
+    int num_queued_actions;    /* Decremented as they get used. */
+    int num_repeats;           /* Times to repeat action, decremented too. */
+    int num_repeated;          /* Times action was repeated, incremented. */
+    long score_delta;          /* Change of blstats' score since action. */
     short *glyphs;           /* Size ROWNO * (COLNO - 1) */
     unsigned char *chars;    /* Size ROWNO * (COLNO - 1) */
     unsigned char *colors;   /* Size ROWNO * (COLNO - 1) */
     unsigned char *specials; /* Size ROWNO * (COLNO - 1) */
     long *blstats;           /* Size NLE_BLSTATS_SIZE */
+    int *blstats_int32;      /* Like blstats, but half the size. */
     unsigned char *message;  /* Size NLE_MESSAGE_SIZE */
     int *program_state;      /* Size NLE_PROGRAM_STATE_SIZE */
     int *internal;           /* Size NLE_INTERNAL_SIZE */
@@ -34,6 +104,38 @@ typedef struct nle_observation {
     unsigned char *tty_chars;           /* Size NLE_TERM_LI * NLE_TERM_CO */
     signed char *tty_colors;            /* Size NLE_TERM_LI * NLE_TERM_CO */
     unsigned char *tty_cursor;          /* Size 2 */
+    int *screen_description_ids;        /* Size ROWNO * (COLNO - 1) */
+    int *inv_str_ids;                   /* Size NLE_INVENTORY_SIZE */
+    int crop_radius;            /* The *_crop observations are the map
+                                   cells at most this far from the hero. */
+    short *glyphs_crop;         /* Size (2 * crop_radius + 1)^2 */
+    unsigned char *chars_crop;  /* Size (2 * crop_radius + 1)^2 */
+    unsigned char *colors_crop; /* Size (2 * crop_radius + 1)^2 */
+    /* Returns the ID of a string for the *_ids observations above. IDs
+       index a table that outlives the game, see pynethack.cc. */
+    int (*intern_string)(const char *str, unsigned long len);
+    long *changed_keys; /* Size 1. NLE_CHANGED_* bits of the observations
+                           that changed since the agent's last step. */
+    short *dirty_cells; /* Size NLE_DIRTY_CELLS_SIZE. Indices into glyphs
+                           etc. of the cells that changed, then -1s. */
+    char direct_write;  /* Bool: Update the map observations as the game
+                           draws instead of copying them each step. Only
+                           if nobody else writes to these buffers. */
+    char buffers_state; /* NLE_BUFFERS_*. Set to NLE_BUFFERS_UNKNOWN when
+                           changing buffers. */
+    char tty_drawn;     /* Bool: The tty_* buffers hold the whole terminal,
+                           which otherwise only writes changed lines. Clear
+                           when changing these buffers. */
+    char ttyrec_codec;  /* NLE_TTYREC_*. Used from the next reset on. */
+    int ttyrec_level;   /* Compression level, 0 for the codec's default. */
+    /* If set, the game hands its ttyrec data to this function instead of
+       compressing and writing it in nle_step. Returns 0 to drop the
+       chunk, which the game keeps, or 1 if it takes the chunk to write
+       it later. Last chunks can't be dropped. A NULL chunk asks to return
+       only once all chunks it took are written, which nle_end needs.
+       Used from the next reset on. */
+    int (*ttyrec_writer)(void *arg, nle_ttyrec_chunk *chunk);
+    void *ttyrec_writer_arg;
 } nle_obs;
 
 typedef struct {
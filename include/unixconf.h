@@ -108,6 +108,13 @@
  */
 /* #define VAR_PLAYGROUND "/var/lib/games/nethack" */
 
+/*
+ * NLE: Several games may run in the same process and therefore share its
+ * working directory. Qualify the variable parts of the playground with the
+ * game's own directory instead (see chdirx() in unixmain.c).
+ */
+#define NLE_PLAYGROUND
+
 /*
  * Define DEF_PAGER as your default pager, e.g. "/bin/cat" or "/usr/ucb/more"
  * If defined, it can be overridden by the environment variable PAGER.
@@ -74,6 +74,12 @@ parser.add_argument("--disable_cuda", action="store_true",
                     help="Disable CUDA.")
 parser.add_argument("--use_lstm", action="store_true",
                     help="Use LSTM in agent model.")
+parser.add_argument("--rollout_storage", action="store_true",
+                    help="Let NLE write observations straight into the "
+                    "shared-memory rollout buffers.")
+parser.add_argument("--native_crop", action="store_true",
+                    help="Let NLE cut the glyphs around the hero instead "
+                    "of the model.")
 
 # Loss settings.
 parser.add_argument("--entropy_cost", default=0.0006,
@@ -138,8 +144,11 @@ def compute_policy_gradient_loss(logits, actions, advantages):
     return torch.sum(cross_entropy * advantages.detach())
 
 
-def create_env(name, *args, **kwargs):
-    return gym.make(name, observation_keys=("glyphs", "blstats"), *args, **kwargs)
+def create_env(name, *args, native_crop=False, **kwargs):
+    observation_keys = ("glyphs", "blstats")
+    if native_crop:
+        observation_keys += ("glyphs_crop",)
+    return gym.make(name, observation_keys=observation_keys, *args, **kwargs)
 
 
 def act(
@@ -154,18 +163,32 @@ def act(
     try:
         logging.info("Actor %i started.", actor_index)
 
-        gym_env = create_env(flags.env, savedir=flags.rundir)
+        gym_env = create_env(
+            flags.env, savedir=flags.rundir, native_crop=flags.native_crop
+        )
         env = ResettingEnvironment(gym_env)
         env_output = env.initial()
         agent_state = model.initial_state(batch_size=1)
         agent_output, unused_state = model(env_output, agent_state)
+
+        # Observations NLE writes into the rollout buffers itself.
+        direct_keys = ()
+        if flags.rollout_storage:
+            direct_keys = tuple(gym_env.observation_space.spaces)
+            spare = {key: buffers[key][0][:1].clone() for key in direct_keys}
         while True:
             index = free_queue.get()
             if index is None:
                 break
 
             # Write old rollout end.
+            if direct_keys:
+                rollout_end = {key: buffers[key][index][:1] for key in direct_keys}
+                env.set_buffers(rollout_end, copy=True)
             for key in env_output:
+                if key in direct_keys:
+                    env_output[key] = buffers[key][index][:1].unsqueeze(1)
+                    continue
                 buffers[key][index][0, ...] = env_output[key]
             for key in agent_output:
                 buffers[key][index][0, ...] = agent_output[key]
@@ -177,13 +200,24 @@ def act(
                 with torch.no_grad():
                     agent_output, agent_state = model(env_output, agent_state)
 
+                if direct_keys:
+                    env.set_buffers(
+                        {key: buffers[key][index][t + 1 : t + 2] for key in direct_keys}
+                    )
                 env_output = env.step(agent_output["action"])
 
                 for key in env_output:
-                    buffers[key][index][t + 1, ...] = env_output[key]
+                    if key not in direct_keys:
+                        buffers[key][index][t + 1, ...] = env_output[key]
                 for key in agent_output:
                     buffers[key][index][t + 1, ...] = agent_output[key]
 
+            if direct_keys:
+                # The learner is about to get this rollout, so keep the last
+                # observation elsewhere.
+                env.set_buffers(spare, copy=True)
+                for key in direct_keys:
+                    env_output[key] = spare[key].unsqueeze(1)
             full_queue.put(index)
 
     except KeyboardInterrupt:
@@ -321,10 +355,9 @@ def create_buffers(flags, observation_space, num_actions, num_overlapping_steps=
     return buffers
 
 
-def _format_observations(observation, keys=("glyphs", "blstats")):
+def _format_observations(observation):
     observations = {}
-    for key in keys:
-        entry = observation[key]
+    for key, entry in observation.items():
         entry = torch.from_numpy(entry)
         entry = entry.view((1, 1) + entry.shape)  # (...) -> (T,B,...).
         observations[key] = entry
@@ -382,6 +415,12 @@ class ResettingEnvironment:
         )
         return result
 
+    def set_buffers(self, buffers, copy=False):
+        """Points observations at tensors of shape (1, ...), see NLE.set_buffers."""
+        self.gym_env.set_buffers(
+            copy=copy, **{key: tensor[0].numpy() for key, tensor in buffers.items()}
+        )
+
     def close(self):
         self.gym_env.close()
 
@@ -430,7 +469,7 @@ def train(flags):  # pylint: disable=too-many-branches, too-many-statements
         logging.info("Not using CUDA.")
         flags.device = torch.device("cpu")
 
-    env = create_env(flags.env, archivefile=None)
+    env = create_env(flags.env, archivefile=None, native_crop=flags.native_crop)
     observation_space = env.observation_space
     action_space = env.action_space
     del env  # End this before forking.
@@ -592,7 +631,7 @@ def test(flags, num_episodes=10):
     flags.savedir = os.path.expandvars(os.path.expanduser(flags.savedir))
     checkpointpath = os.path.join(flags.savedir, "latest", "model.tar")
 
-    gym_env = create_env(flags.env, archivefile=None)
+    gym_env = create_env(flags.env, archivefile=None, native_crop=flags.native_crop)
     env = ResettingEnvironment(gym_env)
     model = Net(gym_env.observation_space, gym_env.action_space.n, flags.use_lstm)
     model.eval()
@@ -737,6 +776,9 @@ class NetHackNet(nn.Module):
         self.h_dim = 512
 
         self.crop_dim = crop_dim
+        if "glyphs_crop" in observation_shape.spaces:
+            # Cut by NLE, see forward().
+            self.crop_dim = observation_shape["glyphs_crop"].shape[0]
 
         self.crop = Crop(self.H, self.W, self.crop_dim, self.crop_dim)
 
@@ -863,7 +905,10 @@ class NetHackNet(nn.Module):
         reps = [blstats_emb]
 
         # -- [B x H' x W']
-        crop = self.crop(glyphs, coordinates)
+        if "glyphs_crop" in env_outputs:
+            crop = torch.flatten(env_outputs["glyphs_crop"], 0, 1).long()
+        else:
+            crop = self.crop(glyphs, coordinates)
 
         # print("crop", crop)
         # print("at_xy", glyphs[:, coordinates[:, 1].long(), coordinates[:, 0].long()])
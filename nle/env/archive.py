@@ -0,0 +1,114 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+import json
+import os
+import shutil
+import threading
+import time
+import zipfile
+
+
+class EpisodeArchive:
+    """Collects the ttyrecs of an NLE process into rolling zip archives.
+
+    Each game still writes its current episode into a ttyrec file of its own.
+    Once the game starts its next episode or gets closed, that file is added
+    to the current archive and deleted, so only a few ttyrecs are ever left in
+    the directory. The ttyrecs are compressed already and get stored as is.
+
+    Every entry has a JSON comment with the seeds, steps and end status of its
+    episode, which `read_episodes` gets without decompressing anything. Note
+    that an archive is only readable once it got rotated or closed.
+    """
+
+    def __init__(self, savedir, archivefile, archive_size=None):
+        """Constructs an archive writer.
+
+        Args:
+            savedir (str): directory to put the archives into.
+            archivefile (str): filename pattern of the archives, formatted
+                with "pid" and "time" keys. A number goes before the extension
+                if that file exists already.
+            archive_size (int): start a new archive once the current one holds
+                this many bytes. If None, use a single archive.
+        """
+        self._pattern = os.path.join(savedir, archivefile)
+        self._archive_size = archive_size
+        self._zipfile = None
+        self._size = 0
+        # Game -> (ttyrec, metadata) of the episode it is playing.
+        self._episodes = {}
+        self._lock = threading.Lock()
+
+    def start(self, game, ttyrec, seeds):
+        """Archives the previous episode of game, which must have closed its
+        ttyrec already, and registers the one it just started."""
+        with self._lock:
+            episode = self._episodes.pop(game, None)
+            if episode is not None:
+                self._add(*episode)
+            self._episodes[game] = (
+                ttyrec,
+                {"seeds": list(seeds), "steps": 0, "end_status": None},
+            )
+
+    def end(self, game, steps, end_status):
+        """Records how the episode of game went."""
+        with self._lock:
+            if game in self._episodes:
+                metadata = self._episodes[game][1]
+                metadata["steps"] = steps
+                metadata["end_status"] = int(end_status)
+
+    def close(self):
+        """Archives the episodes of all games, which must be closed already,
+        and finishes the archive."""
+        with self._lock:
+            for episode in self._episodes.values():
+                self._add(*episode)
+            self._episodes.clear()
+            self._rotate()
+
+    def _add(self, ttyrec, metadata):
+        if not os.path.exists(ttyrec):
+            return
+        if self._zipfile is None:
+            self._open()
+        info = zipfile.ZipInfo.from_file(ttyrec, os.path.basename(ttyrec))
+        info.comment = json.dumps(metadata).encode("ascii")
+        with open(ttyrec, "rb") as src, self._zipfile.open(info, "w") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(ttyrec)
+        self._size += info.file_size
+        if self._archive_size is not None and self._size >= self._archive_size:
+            self._rotate()
+
+    def _open(self):
+        filename = self._pattern % {
+            "pid": os.getpid(),
+            "time": time.strftime("%Y%m%d-%H%M%S"),
+        }
+        root, ext = os.path.splitext(filename)
+        for i in range(1, 1000):
+            if not os.path.exists(filename):
+                break
+            filename = "%s.%i%s" % (root, i, ext)
+        self._zipfile = zipfile.ZipFile(filename, "x")
+        self._size = 0
+
+    def _rotate(self):
+        if self._zipfile is not None:
+            self._zipfile.close()
+            self._zipfile = None
+
+
+def read_episodes(filename):
+    """Lists the episodes in an archive written by `EpisodeArchive`.
+
+    Returns:
+        (list): (ttyrec name, metadata dict) for each episode, in the order
+            they were added.
+    """
+    with zipfile.ZipFile(filename) as archive:
+        return [
+            (info.filename, json.loads(info.comment)) for info in archive.infolist()
+        ]
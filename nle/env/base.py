@@ -1,7 +1,9 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
 import collections
+import concurrent.futures
 import csv
 import enum
+import itertools
 import logging
 import os
 import random
@@ -15,6 +17,7 @@ import gym
 import numpy as np
 
 from nle import nethack
+from nle.env.archive import EpisodeArchive
 
 
 logger = logging.getLogger(__name__)
@@ -35,6 +38,13 @@ FULL_ACTIONS = nethack.USEFUL_ACTIONS
 
 BLSTATS_SCORE_INDEX = 9
 
+TTYREC_SUFFIXES = {
+    "bz2": ".ttyrec.bz2",
+    "raw": ".ttyrec",
+    "zstd": ".ttyrec.zst",
+    "keys": ".keys",
+}
+
 SKIP_EXCEPTIONS = (b"eat", b"attack", b"direction?", b"pray")
 
 NLE_SPACE_ITEMS = (
@@ -128,6 +138,52 @@ NLE_SPACE_ITEMS = (
         "tty_cursor",
         gym.spaces.Box(low=0, high=255, **nethack.OBSERVATION_DESC["tty_cursor"]),
     ),
+    (
+        "screen_description_ids",
+        gym.spaces.Box(
+            low=0,
+            high=np.iinfo(np.int32).max,
+            **nethack.OBSERVATION_DESC["screen_description_ids"],
+        ),
+    ),
+    (
+        "inv_str_ids",
+        gym.spaces.Box(
+            low=0,
+            high=np.iinfo(np.int32).max,
+            **nethack.OBSERVATION_DESC["inv_str_ids"],
+        ),
+    ),
+    (
+        "changed_keys",
+        gym.spaces.Box(
+            low=0,
+            high=np.iinfo(np.int64).max,
+            **nethack.OBSERVATION_DESC["changed_keys"],
+        ),
+    ),
+    (
+        "dirty_cells",
+        gym.spaces.Box(
+            low=nethack.NLE_ALL_CELLS_DIRTY,
+            high=np.prod(nethack.DUNGEON_SHAPE) - 1,
+            **nethack.OBSERVATION_DESC["dirty_cells"],
+        ),
+    ),
+    (
+        "glyphs_crop",
+        gym.spaces.Box(
+            low=0, high=nethack.MAX_GLYPH, **nethack.OBSERVATION_DESC["glyphs_crop"]
+        ),
+    ),
+    (
+        "chars_crop",
+        gym.spaces.Box(low=0, high=255, **nethack.OBSERVATION_DESC["chars_crop"]),
+    ),
+    (
+        "colors_crop",
+        gym.spaces.Box(low=0, high=15, **nethack.OBSERVATION_DESC["colors_crop"]),
+    ),
 )
 
 
@@ -185,7 +241,7 @@ class NLE(gym.Env):
     def __init__(
         self,
         savedir="",
-        archivefile="nethack.%(pid)i.%(time)s.zip",
+        archivefile=None,
         character="mon-hum-neu-mal",
         max_episode_steps=5000,
         observation_keys=(
@@ -209,6 +265,15 @@ class NLE(gym.Env):
         wizard=False,
         allow_all_yn_questions=False,
         space_dict=None,
+        reset_pool_size=0,
+        reset_pool_seeds=None,
+        action_repeat=1,
+        observation_profile="default",
+        crop_radius=nethack.CROP_RADIUS,
+        ttyrec_codec="bz2",
+        ttyrec_level=None,
+        ttyrec_async=False,
+        archive_size=None,
     ):
         """Constructs a new NLE environment.
 
@@ -217,6 +282,11 @@ class NLE(gym.Env):
                 Defaults to "" (empty string), which makes NLE chose the
                 directory name. If None, don't save any data. Otherwise,
                 interpreted as a path to a new or existing directory.
+            archivefile (str or None): if given, collect the ttyrecs in zip
+                archives in savedir instead of leaving one file per episode,
+                see ``nle.env.archive.EpisodeArchive``. A filename pattern
+                with "pid" and "time" keys, e.g. "nethack.%(pid)i.%(time)s.zip".
+                Archives are complete after close(). Defaults to None.
             character (str): name of character. Defaults to "mon-hum-neu-mal".
             max_episode_steps (int): maximum amount of steps allowed before the
                 game is forcefully quit. In such cases, ``info["end_status"]``
@@ -233,11 +303,45 @@ class NLE(gym.Env):
                 If set to True, no y/n questions in step() are declined.
                 If set to False, only elements of SKIP_EXCEPTIONS are not declined.
                 Defaults to False.
+            reset_pool_size (int): number of extra games to start in the
+                background, so that reset() can swap in a game that is ready to
+                be acted upon. Defaults to 0 (no pool). With a pool, ttyrecs are
+                numbered in the order the games start, and a reset game's old
+                observation arrays get overwritten in the background.
+            reset_pool_seeds (callable): returns the (core, disp, reseed) seeds
+                for each game the pool starts. If None, NetHack picks random
+                seeds. Seeds set with seed() still apply to the next reset(),
+                which then doesn't use the pool.
+            action_repeat (int): use each action up to this many times per
+                step(), as long as the game gets back to its command prompt
+                without a new message. The number of times is in
+                ``info["action_repeats"]``. Defaults to 1.
+            observation_profile (str): dtypes of the observations, see
+                ``nle.nethack.OBSERVATION_PROFILES``. "compact" halves blstats
+                and makes glyphs unsigned. Defaults to "default".
+            crop_radius (int): the ``*_crop`` observations are the map cells at
+                most this far from the hero. Defaults to
+                ``nle.nethack.CROP_RADIUS`` (4), i.e. 9x9 crops.
+            ttyrec_codec (str): how to write the ttyrecs into savedir, one of
+                ``nle.nethack.TTYREC_CODECS``. "raw" and "zstd" are cheaper
+                than "bz2" per step, "none" doesn't write any. "keys" only
+                writes the keys and seeds to replay the episodes with, see
+                ``nle.nethack.Nethack``. Defaults to "bz2". Without a
+                savedir, no ttyrecs are written either way.
+            ttyrec_level (int): compression level of ttyrec_codec. If None,
+                the codec's default (9 for bz2). Defaults to None.
+            ttyrec_async (bool): compress and write the ttyrecs on a
+                background thread instead of in step() and reset(), see
+                ``nle.nethack.set_ttyrec_writer``. Defaults to False.
+            archive_size (int): with archivefile, start a new archive once
+                the ttyrecs in the current one add up to this many bytes. If
+                None, use one archive. Defaults to None.
         """
 
         self.character = character
         self._max_episode_steps = max_episode_steps
         self._allow_all_yn_questions = allow_all_yn_questions
+        self._action_repeat = action_repeat
 
         if actions is None:
             actions = FULL_ACTIONS
@@ -297,30 +401,82 @@ class NLE(gym.Env):
             self._observation_keys.index(key) for key in observation_keys
         )
 
-        if self.savedir:
+        if ttyrec_codec not in nethack.TTYREC_CODECS:
+            raise ValueError("Unknown ttyrec_codec '%s'" % ttyrec_codec)
+        if not self.savedir:
+            ttyrec_codec = "none"
+        if ttyrec_codec != "none":
             self._ttyrec_pattern = os.path.join(
-                self.savedir, "nle.%i.%%i.ttyrec.bz2" % os.getpid()
+                self.savedir,
+                "nle.%i.%%i%s" % (os.getpid(), TTYREC_SUFFIXES[ttyrec_codec]),
             )
             ttyrec = self._ttyrec_pattern % 0
         else:
+            self._ttyrec_pattern = None
             ttyrec = "/dev/null"
+        self._ttyrec_numbers = itertools.count()
+        self._ttyrec_async = ttyrec_async
+
+        self._archive = None
+        if archivefile is not None and self._ttyrec_pattern is not None:
+            self._archive = EpisodeArchive(self.savedir, archivefile, archive_size)
+
+        games = [
+            nethack.Nethack(
+                observation_keys=self._observation_keys,
+                options=options,
+                playername="Agent-" + self.character,
+                ttyrec=ttyrec if i == 0 else "/dev/null",
+                wizard=wizard,
+                observation_profile=observation_profile,
+                crop_radius=crop_radius,
+                ttyrec_codec=ttyrec_codec,
+                ttyrec_level=ttyrec_level,
+                ttyrec_async=ttyrec_async,
+            )
+            for i in range(1 + reset_pool_size)
+        ]
+        self.env = games[0]
+        for game in games:
+            # Like _perform_known_steps, but without returning to Python.
+            game.set_prompt_policy(
+                more=True,
+                getlin=True,
+                yn=not allow_all_yn_questions,
+                yn_exceptions=SKIP_EXCEPTIONS,
+            )
 
-        self.env = nethack.Nethack(
-            observation_keys=self._observation_keys,
-            options=options,
-            playername="Agent-" + self.character,
-            ttyrec=ttyrec,
-            wizard=wizard,
+        # Games that reset() can swap in, each with a future that prepares it.
+        self._pool = collections.deque()
+        self._pool_seeds = reset_pool_seeds
+        self._pool_executor = None
+        if reset_pool_size:
+            self._pool_executor = concurrent.futures.ThreadPoolExecutor(1)
+        self._close_env = weakref.finalize(
+            self, _close_games, games, self._pool_executor, self._archive
         )
-        self._close_env = weakref.finalize(self, lambda e: e.close(), self.env)
+        for game in games[1:]:
+            self._pool.append((game, self._prepare_game(game)))
+        self._seeded = False
 
         self._random = random.SystemRandom()
 
         # -1 so that it's 0-based on first reset
         self._episode = -1
 
+        # Whether the arrays of the last set_buffers() call are the ones the
+        # game isn't writing to, None without set_buffers().
+        self._buffers_flipped = None
+
         if space_dict is None:
             space_dict = dict(NLE_SPACE_ITEMS)
+            desc = nethack.observation_desc(observation_profile, crop_radius)
+            for key, space in space_dict.items():
+                shape, dtype = desc[key]["shape"], desc[key]["dtype"]
+                if space.shape != shape or space.dtype != dtype:
+                    space_dict[key] = gym.spaces.Box(
+                        low=space.low.min(), high=space.high.max(), **desc[key]
+                    )
         self.observation_space = gym.spaces.Dict(
             {key: space_dict[key] for key in observation_keys}
         )
@@ -354,13 +510,17 @@ class NLE(gym.Env):
                   `end_status`, i.e. a status info -- death, task win, etc. --
                   for the terminal state).
         """
-        # Careful: By default we re-use Numpy arrays, so copy before!
-        last_observation = tuple(a.copy() for a in self.last_observation)
+        # The game writes into the other set of arrays, see reset().
+        last_observation = self.last_observation
 
-        observation, done = self.env.step(self._actions[action])
-        observation, done = self._perform_known_steps(
-            observation, done, exceptions=True
-        )
+        if self._action_repeat > 1:
+            observation, done, _, repeats = self.env.step_repeat(
+                self._actions[action], self._action_repeat, handle_prompts=True
+            )
+        else:
+            observation, done = self.env.step(
+                self._actions[action], handle_prompts=True
+            )
 
         self._steps += 1
 
@@ -371,12 +531,14 @@ class NLE(gym.Env):
         else:
             end_status = self._is_episode_end(observation)
         end_status = self.StepStatus(done or end_status)
+        self._end_status = end_status
 
         reward = float(self._reward_fn(last_observation, observation, end_status))
 
         if end_status and not done:
             # Try to end the game nicely.
-            self._quit_game(observation, done)
+            observation = self._quit_game(observation, done)
+            self.last_observation = observation
             done = True
 
         info = {}
@@ -390,7 +552,10 @@ class NLE(gym.Env):
             if self._stats_logger is not None:
                 self._stats_logger.writerow(stats)
         info["end_status"] = end_status
+        if self._action_repeat > 1:
+            info["action_repeats"] = repeats
 
+        self._flip_buffers()
         return self._get_observation(observation), reward, done, info
 
     def _collect_stats(self, message, end_status):
@@ -430,9 +595,26 @@ class NLE(gym.Env):
             [dict] Observation of the state as defined by
                 `self.observation_space`.
         """
+        self._end_episode()
         self._episode += 1
-        new_ttyrec = self._ttyrec_pattern % self._episode if self.savedir else None
-        self.last_observation = self.env.reset(new_ttyrec, wizkit_items=wizkit_items)
+        if self._buffers_flipped:
+            # E.g. after the step that ended the episode: Write the reset
+            # observation into the arrays set last, like a step would.
+            self._flip_buffers()
+        if self._pool and wizkit_items is None and not self._seeded:
+            game, future = self._pool.popleft()
+            observation = future.result()
+            self._pool.append((self.env, self._prepare_game(self.env)))
+            self.env = game
+        else:
+            observation = self._start_game(self.env, wizkit_items)
+        self._seeded = False
+        if observation is None:
+            return self.reset(wizkit_items=wizkit_items)
+        self.last_observation = observation
+        # Let the next step write into other arrays, so that the reward can
+        # compare with last_observation without copying it.
+        self._flip_buffers()
 
         # Only run on the first reset to initialize stats file
         if self._setup_statsfile:
@@ -450,27 +632,60 @@ class NLE(gym.Env):
         # self._killer_name = "UNK"
 
         self._steps = 0
+        self._end_status = self.StepStatus.RUNNING
+
+        return self._get_observation(self.last_observation)
+
+    def _end_episode(self):
+        """Records the current episode's steps and end status for its archive
+        entry."""
+        if self._archive is not None and self._episode >= 0:
+            self._archive.end(self.env, self._steps, self._end_status)
+
+    def _flip_buffers(self):
+        self.env.flip_buffers()
+        if self._buffers_flipped is not None:
+            self._buffers_flipped = not self._buffers_flipped
+
+    def _start_game(self, game, wizkit_items=None):
+        """Resets game and gets it to its first moveloop observation.
+
+        Returns None (after a warning) if that didn't work out.
+        """
+        new_ttyrec = None
+        if self._ttyrec_pattern is not None:
+            new_ttyrec = self._ttyrec_pattern % next(self._ttyrec_numbers)
+        observation = game.reset(new_ttyrec, wizkit_items=wizkit_items)
+        if self._archive is not None:
+            if self._ttyrec_async:
+                game.wait_ttyrec()  # Until the last episode's ttyrec is closed.
+            self._archive.start(game, new_ttyrec, game.get_current_seeds())
 
         for _ in range(1000):
             # Get past initial phase of game. This should make sure
             # all the observations are present.
-            if self._in_moveloop(self.last_observation):
-                break
+            if self._in_moveloop(observation):
+                return observation
             # This fails if the agent picks up a scroll of scare
             # monster at the 0th turn and gets asked to name it.
             # Hence the defensive iteration above.
             # TODO: Detect this 'in_getlin' situation and handle it.
-            self.last_observation, done = self.env.step(ASCII_SPACE)
+            observation, done = game.step(ASCII_SPACE)
             assert not done, "Game ended unexpectedly"
-        else:
-            warnings.warn(
-                "Not in moveloop after 1000 tries, aborting (ttyrec: %s)." % new_ttyrec
-            )
-            return self.reset(wizkit_items=wizkit_items)
 
-        return self._get_observation(self.last_observation)
+        warnings.warn(
+            "Not in moveloop after 1000 tries, aborting (ttyrec: %s)." % new_ttyrec
+        )
+        return None
+
+    def _prepare_game(self, game):
+        """Starts game in the background, returns a future of its observation."""
+        if self._pool_seeds is not None:
+            game.set_initial_seeds(*self._pool_seeds())
+        return self._pool_executor.submit(self._start_game, game)
 
     def close(self):
+        self._end_episode()
         self._close_env()
         super().close()
 
@@ -501,6 +716,7 @@ class NLE(gym.Env):
         if disp is None:
             disp = self._random.randrange(sys.maxsize)
         self.env.set_initial_seeds(core, disp, reseed)
+        self._seeded = True
         return (core, disp, reseed)
 
     def get_seeds(self):
@@ -511,6 +727,42 @@ class NLE(gym.Env):
         """
         return self.env.get_current_seeds()
 
+    def set_buffers(self, copy=False, **buffers):
+        """Makes the game write observations into the given arrays.
+
+        See `nle.nethack.Nethack.set_buffers`. Used e.g. to point the
+        observations at the next slot of a rollout before each step, so that
+        they need no copying afterwards. The observations returned by step()
+        and reset() are then these arrays.
+
+        Arguments:
+            copy [boolean]: Also copy the current observation into the arrays.
+                Otherwise they get the observation of the next step() or
+                reset(). reset() also writes into the arrays set last after
+                a step(), e.g. for the step that ended the episode.
+            buffers: Arrays for some of the observation keys.
+        """
+        if self._pool:
+            raise ValueError("set_buffers doesn't work with a reset pool")
+        for key in buffers:
+            if key not in self._observation_keys:
+                raise ValueError("Unknown observation '%s'" % key)
+        if not copy or self.last_observation is None:
+            self.env.set_buffers(**buffers)
+            self._buffers_flipped = False
+            return
+        for key, buffer in buffers.items():
+            buffer[...] = self.last_observation[self._observation_keys.index(key)]
+        self.last_observation = tuple(
+            buffers.get(key, observation)
+            for key, observation in zip(self._observation_keys, self.last_observation)
+        )
+        # The current observation is in the arrays the game isn't writing to.
+        self.env.flip_buffers()
+        self.env.set_buffers(**buffers)
+        self.env.flip_buffers()
+        self._buffers_flipped = True
+
     def render(self, mode="human"):
         """Renders the state of environment.
 
@@ -623,19 +875,18 @@ class NLE(gym.Env):
         return observation, done
 
     def _quit_game(self, observation, done):
-        """Smoothly quit a game."""
+        """Smoothly quit a game, returns the final observation."""
         # Get out of menus and windows.
         observation, done = self._perform_known_steps(
             observation, done, exceptions=False
         )
 
         if done:
-            return
+            return observation
 
         # Quit the game.
         actions = [0x80 | ord("q"), ord("y")]  # M-q y
-        for a in actions:
-            observation, done = self.env.step(a)
+        observation, done, _ = self.env.step_sequence(actions)
 
         # Answer final questions.
         observation, done = self._perform_known_steps(
@@ -645,3 +896,13 @@ class NLE(gym.Env):
         if not done:
             # Somehow, the above logic failed us.
             warnings.warn("Warning: smooth quitting of game failed, aborting.")
+        return observation
+
+
+def _close_games(games, executor, archive):
+    if executor is not None:
+        executor.shutdown()  # Let games that are starting finish first.
+    for game in games:
+        game.close()
+    if archive is not None:
+        archive.close()
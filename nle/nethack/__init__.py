@@ -3,6 +3,7 @@ from nle.nethack.actions import *  # noqa: F403
 from nle._pynethack.nethack import *  # noqa: F403
 from nle.nethack.nethack import (
     Nethack,
+    BatchedNethack,
     NETHACKOPTIONS,
     DUNGEON_SHAPE,
     BLSTATS_SHAPE,
@@ -10,4 +11,15 @@ from nle.nethack.nethack import (
     PROGRAM_STATE_SHAPE,
     INTERNAL_SHAPE,
     OBSERVATION_DESC,
+    COMPACT_OBSERVATION_DESC,
+    OBSERVATION_PROFILES,
+    CROP_RADIUS,
+    CROP_SHAPE,
+    CROP_KEYS,
+    observation_desc,
+    TTYREC_CODECS,
+    KEYLOG_MAGIC,
+    read_keylog,
+    set_ttyrec_writer,
+    CHANGED_KEYS,
 )
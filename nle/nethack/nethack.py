@@ -1,12 +1,18 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
+import json
 import os
 import pkg_resources
+import random
 import shutil
+import struct
+import sys
 import tempfile
+import threading
 
 import numpy as np
 
 from nle import _pynethack
+from nle.version import __version__
 
 
 DLPATH = os.path.join(os.path.dirname(_pynethack.__file__), "libnethack.so")
@@ -25,6 +31,9 @@ SCREEN_DESCRIPTIONS_SHAPE = DUNGEON_SHAPE + (
     _pynethack.nethack.NLE_SCREEN_DESCRIPTION_LENGTH,
 )
 TERMINAL_SHAPE = (_pynethack.nethack.NLE_TERM_LI, _pynethack.nethack.NLE_TERM_CO)
+DIRTY_CELLS_SHAPE = (_pynethack.nethack.NLE_DIRTY_CELLS_SIZE,)
+CROP_RADIUS = _pynethack.nethack.NLE_CROP_RADIUS
+CROP_SHAPE = (2 * CROP_RADIUS + 1, 2 * CROP_RADIUS + 1)
 
 OBSERVATION_DESC = {
     "glyphs": dict(shape=DUNGEON_SHAPE, dtype=np.int16),
@@ -43,8 +52,74 @@ OBSERVATION_DESC = {
     "tty_chars": dict(shape=TERMINAL_SHAPE, dtype=np.uint8),
     "tty_colors": dict(shape=TERMINAL_SHAPE, dtype=np.int8),
     "tty_cursor": dict(shape=(2,), dtype=np.uint8),
+    "screen_description_ids": dict(shape=DUNGEON_SHAPE, dtype=np.int32),
+    "inv_str_ids": dict(shape=INV_SIZE, dtype=np.int32),
+    "changed_keys": dict(shape=(1,), dtype=np.int64),
+    "dirty_cells": dict(shape=DIRTY_CELLS_SHAPE, dtype=np.int16),
+    "glyphs_crop": dict(shape=CROP_SHAPE, dtype=np.int16),
+    "chars_crop": dict(shape=CROP_SHAPE, dtype=np.uint8),
+    "colors_crop": dict(shape=CROP_SHAPE, dtype=np.uint8),
 }
 
+# The *_crop observations are the glyphs, chars and colors of the map cells
+# at most crop_radius (default CROP_RADIUS) away from the hero, i.e. centered
+# on blstats[:2]. Cells beyond the edges of the map are blank, as cells
+# nothing was drawn on.
+CROP_KEYS = ("glyphs_crop", "chars_crop", "colors_crop")
+
+TTYREC_CODECS = {
+    "bz2": _pynethack.nethack.NLE_TTYREC_BZ2,
+    "none": _pynethack.nethack.NLE_TTYREC_NONE,
+    "raw": _pynethack.nethack.NLE_TTYREC_RAW,
+    "zstd": _pynethack.nethack.NLE_TTYREC_ZSTD,
+    "keys": _pynethack.nethack.NLE_TTYREC_KEYS,
+}
+
+# Keys logs (ttyrec_codec="keys") start with this, the length of a JSON
+# header as uint32 and the header. Then come the keys, a byte each.
+KEYLOG_MAGIC = b"NLEKEYS1"
+
+# The same observations in smaller or unsigned dtypes the game writes
+# natively, e.g. for replay buffers: blstats fit into 32 bits and glyphs are
+# never negative. specials uses all eight MG_* bits, so it stays as it is.
+COMPACT_OBSERVATION_DESC = dict(
+    OBSERVATION_DESC,
+    glyphs=dict(shape=DUNGEON_SHAPE, dtype=np.uint16),
+    blstats=dict(shape=BLSTATS_SHAPE, dtype=np.int32),
+    inv_glyphs=dict(shape=INV_SIZE, dtype=np.uint16),
+    glyphs_crop=dict(shape=CROP_SHAPE, dtype=np.uint16),
+)
+
+OBSERVATION_PROFILES = {
+    "default": OBSERVATION_DESC,
+    "compact": COMPACT_OBSERVATION_DESC,
+}
+
+# Bit i of the changed_keys observation is set if observation CHANGED_KEYS[i]
+# changed since the previous step. dirty_cells lists the flat indices of the
+# map cells (glyphs, chars, ...) that changed, padded with -1. If there are
+# too many to fit, its first entry is NLE_ALL_CELLS_DIRTY instead.
+CHANGED_KEYS = (
+    "glyphs",
+    "chars",
+    "colors",
+    "specials",
+    "blstats",
+    "message",
+    "program_state",
+    "internal",
+    "inv_glyphs",
+    "inv_letters",
+    "inv_oclasses",
+    "inv_strs",
+    "screen_descriptions",
+    "tty_chars",
+    "tty_colors",
+    "tty_cursor",
+    "screen_description_ids",
+    "inv_str_ids",
+)
+
 
 NETHACKOPTIONS = (
     "color",
@@ -66,6 +141,12 @@ NETHACKOPTIONS = (
 HACKDIR = os.getenv("HACKDIR", pkg_resources.resource_filename("nle", "nethackdir"))
 WIZKIT_FNAME = "wizkit.txt"
 
+# NetHack reads its options from the environment and changes the working
+# directory when a game starts. Both are per process, so starting games (and
+# restoring the working directory on close) is serialized. Stepping games
+# (without the GIL) can happen concurrently.
+_START_LOCK = threading.Lock()
+
 
 def _set_env_vars(options, hackdir, wizkit=None):
     # TODO: Investigate not using environment variables for this.
@@ -76,10 +157,113 @@ def _set_env_vars(options, hackdir, wizkit=None):
         os.environ["WIZKIT"] = wizkit
 
 
-# TODO: Not thread-safe for many reasons.
-# TODO: On Linux, we could use dlmopen to use different linker namespaces,
-# which should allow several instances of this. On MacOS, that seems
-# a tough call.
+def _make_vardir(hackdir):
+    """Creates a temporary HACKDIR for one game."""
+    if not os.path.exists(hackdir) or not os.path.exists(
+        os.path.join(hackdir, "sysconf")
+    ):
+        raise FileNotFoundError("Couldn't find NetHack installation at '%s'." % hackdir)
+
+    tempdir = tempfile.TemporaryDirectory(prefix="nle")
+    vardir = tempdir.name
+
+    # Symlink a few files.
+    for fn in ["nhdat", "sysconf"]:
+        os.symlink(os.path.join(hackdir, fn), os.path.join(vardir, fn))
+    # Touch a few files.
+    for fn in ["perm", "logfile", "xlogfile"]:
+        os.close(os.open(os.path.join(vardir, fn), os.O_CREAT))
+    os.mkdir(os.path.join(vardir, "save"))
+
+    return tempdir
+
+
+def _copy_library(vardir):
+    # Hacky AF: Copy our so into this directory to load several copies ...
+    dlpath = os.path.join(vardir, "libnethack.so")
+    shutil.copyfile(DLPATH, dlpath)
+    return dlpath
+
+
+def observation_desc(observation_profile="default", crop_radius=CROP_RADIUS):
+    """Returns the shapes and dtypes of the observations of a game."""
+    if observation_profile not in OBSERVATION_PROFILES:
+        raise ValueError("Unknown observation_profile '%s'" % observation_profile)
+    desc = dict(OBSERVATION_PROFILES[observation_profile])
+    for key in CROP_KEYS:
+        desc[key] = dict(desc[key], shape=(2 * crop_radius + 1,) * 2)
+    return desc
+
+
+def _ttyrec_codec(ttyrec_codec):
+    if ttyrec_codec not in TTYREC_CODECS:
+        raise ValueError("Unknown ttyrec_codec '%s'" % ttyrec_codec)
+    return TTYREC_CODECS[ttyrec_codec]
+
+
+def set_ttyrec_writer(queue_size=64, block=True):
+    """Configures the thread that writes ttyrecs with ttyrec_async=True.
+
+    Games hand it their ttyrec data in chunks of up to 64KB. When queue_size
+    chunks wait to be written, games wait for the writer if block is True.
+    Otherwise, they drop their chunks, which ends up as missing frames in
+    their ttyrecs. Their `ttyrec_frames_dropped` counts those.
+    """
+    _pynethack.set_ttyrec_writer(queue_size, block)
+
+
+def read_keylog(filename):
+    """Reads a keys log, see `Nethack`.
+
+    Returns:
+        (dict, bytes): the header, with the "seeds" (core, disp, reseed) and
+            the "options", "playername" and "wizard" the game was created
+            with, the "wizkit" items or None and the NLE "version". Then all
+            keys the game read, in order.
+    """
+    with open(filename, "rb") as f:
+        if f.read(len(KEYLOG_MAGIC)) != KEYLOG_MAGIC:
+            raise ValueError("%s is not a keys log" % filename)
+        (length,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(length).decode("utf-8"))
+        return header, f.read()
+
+
+def _as_numpy(buffer):
+    """Returns a numpy array or CPU torch tensor as numpy array."""
+    if isinstance(buffer, np.ndarray):
+        return buffer
+    return buffer.numpy()
+
+
+# Several instances can be stepped concurrently from different threads.
+# Each instance must only be used by one thread at a time.
+# With dlmopen=True (Linux only), each instance loads the same libnethack.so
+# into its own linker namespace. When that's not possible (e.g., glibc
+# supports only 16 namespaces per process), a copy of the library is used.
+# With fork_startup=True (Linux only), episodes after the first two skip
+# NetHack's startup: They continue from a copy of the game taken right
+# before the dungeon is generated, then apply their seeds.
+# With direct_write=True, the game updates the map observations in place as
+# it draws instead of copying them each step. The observation arrays must
+# then not be written to (use copy=True to get copies).
+# With observation_format="torch", observations are CPU torch tensors in
+# shared memory, so other processes can see them without copies. Numpy
+# observations also share their memory with torch via torch.from_numpy or
+# torch.from_dlpack (numpy>=1.22).
+# observation_profile picks the dtypes of the observations from
+# OBSERVATION_PROFILES.
+# ttyrec_codec is how the ttyrec gets written: "bz2" (ttyrec_level 1 to 9,
+# default 9), "raw", "zstd" (if built with libzstd, any zstd level) or
+# "none", which doesn't write one at all. "keys" writes a keys log instead,
+# which is all it takes to replay the episode: A header with the seeds and
+# options, then the keys the game read, including those it answered prompts
+# with (see read_keylog). Unless seeds were set, reset() picks seeds without
+# reseeding then. Each episode needs its own file, passed to reset(). Note
+# that NetHack also depends on the date (e.g. the phase of the moon).
+# With ttyrec_async=True, a thread compresses and writes the ttyrec (see
+# set_ttyrec_writer), also finishing it after reset(). close() waits for it,
+# wait_ttyrec() for the ttyrecs of earlier episodes.
 class Nethack:
     _instances = 0
 
@@ -92,35 +276,38 @@ class Nethack:
         copy=False,
         wizard=False,
         hackdir=HACKDIR,
+        dlmopen=True,
+        fork_startup=False,
+        direct_write=False,
+        observation_format="numpy",
+        observation_profile="default",
+        crop_radius=CROP_RADIUS,
+        ttyrec_codec="bz2",
+        ttyrec_level=None,
+        ttyrec_async=False,
     ):
         self._copy = copy
-
-        if not os.path.exists(hackdir) or not os.path.exists(
-            os.path.join(hackdir, "sysconf")
-        ):
-            raise FileNotFoundError(
-                "Couldn't find NetHack installation at '%s'." % hackdir
-            )
+        codec = _ttyrec_codec(ttyrec_codec)
+        if ttyrec_codec == "none":
+            ttyrec = os.devnull
+        self._observation_desc = observation_desc(observation_profile, crop_radius)
+        if observation_format == "numpy":
+            self._torch = None
+        elif observation_format == "torch":
+            import torch
+
+            self._torch = torch
+        else:
+            raise ValueError("Unknown observation_format '%s'" % observation_format)
 
         # Create a HACKDIR for us.
-        self._tempdir = tempfile.TemporaryDirectory(prefix="nle")
+        self._tempdir = _make_vardir(hackdir)
         self._vardir = self._tempdir.name
 
         # Save cwd and restore later. Currently libnethack changes
         # directory on loading.
-        self._oldcwd = os.getcwd()
-
-        # Symlink a few files.
-        for fn in ["nhdat", "sysconf"]:
-            os.symlink(os.path.join(hackdir, fn), os.path.join(self._vardir, fn))
-        # Touch a few files.
-        for fn in ["perm", "logfile", "xlogfile"]:
-            os.close(os.open(os.path.join(self._vardir, fn), os.O_CREAT))
-        os.mkdir(os.path.join(self._vardir, "save"))
-
-        # Hacky AF: Copy our so into this directory to load several copies ...
-        dlpath = os.path.join(self._vardir, "libnethack.so")
-        shutil.copyfile(DLPATH, dlpath)
+        with _START_LOCK:
+            self._oldcwd = os.getcwd()
 
         if options is None:
             options = NETHACKOPTIONS
@@ -131,28 +318,97 @@ class Nethack:
 
         _set_env_vars(self._options, self._vardir)
         self._ttyrec = ttyrec
-
-        self._pynethack = _pynethack.Nethack(dlpath, ttyrec)
+        self._initial_seeds = None
+        self._keylog = None
+        if ttyrec_codec == "keys":
+            self._keylog = dict(
+                options=list(options), playername=playername, wizard=wizard
+            )
+        self._keylog_started = False
+
+        self._pynethack = None
+        if dlmopen:
+            try:
+                self._pynethack = _pynethack.Nethack(DLPATH, ttyrec, dlmopen=True)
+            except RuntimeError:
+                pass  # Fall back to copying the library.
+        if self._pynethack is None:
+            self._pynethack = _pynethack.Nethack(_copy_library(self._vardir), ttyrec)
+        if fork_startup:
+            self._pynethack.set_fork_startup(True)
+        if direct_write:
+            self._pynethack.set_direct_write(True)
+        self._pynethack.set_crop_radius(crop_radius)
+        self._pynethack.set_ttyrec_codec(codec, ttyrec_level or 0)
+        if ttyrec_async:
+            self._pynethack.set_ttyrec_async(True)
 
         self._obs_buffers = {}
 
         for key in observation_keys:
             if key not in OBSERVATION_DESC:
                 raise ValueError("Unknown observation '%s'" % key)
-            self._obs_buffers[key] = np.zeros(**OBSERVATION_DESC[key])
+            self._obs_buffers[key] = self._zeros(key)
 
-        self._pynethack.set_buffers(**self._obs_buffers)
+        self._pynethack.set_buffers(
+            **{key: _as_numpy(buffer) for key, buffer in self._obs_buffers.items()}
+        )
 
         self._obs = tuple(self._obs_buffers[key] for key in observation_keys)
-        if self._copy:
+        self._back_buffers = None  # See flip_buffers.
+        if self._copy and self._torch is not None:
+            self._step_return = lambda: tuple(o.clone() for o in self._obs)
+        elif self._copy:
             self._step_return = lambda: tuple(o.copy() for o in self._obs)
         else:
             self._step_return = lambda: self._obs
 
-    def step(self, action):
-        self._pynethack.step(action)
+    def _zeros(self, key):
+        buffer = np.zeros(**self._observation_desc[key])
+        if self._torch is not None:
+            buffer = self._torch.from_numpy(buffer).share_memory_()
+        return buffer
+
+    def step(self, action, handle_prompts=False):
+        """Steps the game, see `set_prompt_policy` for `handle_prompts`."""
+        self._pynethack.step(action, handle_prompts)
         return self._step_return(), self._pynethack.done()
 
+    def step_repeat(self, action, repeat, handle_prompts=False):
+        """Steps the game with the same action up to `repeat` times.
+
+        Repeats only while the game comes back to its command prompt without
+        a new message (or a prompt answered due to `handle_prompts`). Returns
+        the observation, whether the game is done, the change of the score
+        (blstats[9]) and how often the action was used.
+        """
+        score_delta, repeats = self._pynethack.step_repeat(
+            action, repeat, handle_prompts
+        )
+        return self._step_return(), self._pynethack.done(), score_delta, repeats
+
+    def step_sequence(self, actions):
+        """Steps the game with several actions, but observes it only once.
+
+        Stops early when the game ends or waits at a --More-- that the next
+        action wouldn't dismiss. Returns the observation, whether the game
+        is done and how many actions were used.
+        """
+        consumed = self._pynethack.step_sequence(actions)
+        return self._step_return(), self._pynethack.done(), consumed
+
+    def set_prompt_policy(self, more=False, getlin=False, yn=False, yn_exceptions=()):
+        """Sets which prompts step(action, handle_prompts=True) answers itself.
+
+        Args:
+            more (bool): press space at --More--.
+            getlin (bool): escape from prompts for a line of text.
+            yn (bool): escape from single-character questions, unless their
+                text contains one of `yn_exceptions` (bytes). After declining a
+                question, the step returns at the next prompt.
+        """
+        self._pynethack.set_prompt_policy(more, getlin, yn, list(yn_exceptions))
+
     def _write_wizkit_file(self, wizkit_items):
         # TODO ideally we need to check the validity of the requested items
         with open(os.path.join(self._vardir, WIZKIT_FNAME), "w") as f:
@@ -160,32 +416,108 @@ class Nethack:
                 f.write("%s\n" % item)
 
     def reset(self, new_ttyrec=None, wizkit_items=None):
+        wizkit = None
         if wizkit_items is not None:
             if not self._wizard:
                 raise ValueError("Set wizard=True to use the wizkit option.")
             self._write_wizkit_file(wizkit_items)
-            _set_env_vars(self._options, self._vardir, wizkit=WIZKIT_FNAME)
-        else:
-            _set_env_vars(self._options, self._vardir)
-        if new_ttyrec is None:
-            self._pynethack.reset()
-        else:
-            self._pynethack.reset(new_ttyrec)
+            wizkit = WIZKIT_FNAME
+        if self._keylog is not None:
+            self._start_keylog(new_ttyrec, wizkit_items)
+        with _START_LOCK:
+            _set_env_vars(self._options, self._vardir, wizkit=wizkit)
+            if new_ttyrec is None:
+                self._pynethack.reset()
+            else:
+                self._pynethack.reset(new_ttyrec)
+        self._initial_seeds = None
+        if new_ttyrec is not None:
             self._ttyrec = new_ttyrec
         # No seeding performed here: If we fixed the seeds, we'd only
         # get one episode.
         return self._step_return()
 
+    def _start_keylog(self, new_ttyrec, wizkit_items):
+        """Writes the header of the keys log of the next episode."""
+        if new_ttyrec is None:
+            if self._keylog_started:
+                raise ValueError("Keys logs hold one episode, pass a new_ttyrec")
+            new_ttyrec = self._ttyrec
+        self._keylog_started = True
+        seeds = self._initial_seeds
+        if seeds is None:
+            rng = random.SystemRandom()
+            seeds = (rng.randrange(sys.maxsize), rng.randrange(sys.maxsize), False)
+            self.set_initial_seeds(*seeds)
+        header = dict(
+            self._keylog, seeds=list(seeds), wizkit=wizkit_items, version=__version__
+        )
+        header = json.dumps(header).encode("utf-8")
+        with open(new_ttyrec, "wb") as f:
+            f.write(KEYLOG_MAGIC + struct.pack("<I", len(header)) + header)
+
+    def set_buffers(self, **buffers):
+        """Makes the game write observations into the given arrays.
+
+        Keyword arguments are observation keys this game was created with,
+        the others keep their arrays. Arrays (or CPU torch tensors) need the
+        shape and a dtype from `observation_desc` (for any profile, but this
+        game's crop_radius) and have to be C contiguous, which views like
+        `storage[t]` of an array of shape [T, *shape] are.
+        Cheap enough to call before each step to write straight into rollout
+        storage.
+        Takes effect from the next step or reset.
+        """
+        for key, buffer in buffers.items():
+            if key not in self._obs_buffers:
+                raise ValueError("Unknown observation '%s'" % key)
+            self._pynethack.set_buffer(key, _as_numpy(buffer))
+            self._obs_buffers[key] = buffer
+        self._obs = tuple(self._obs_buffers.values())
+
+    def flip_buffers(self):
+        """Makes the game write observations into a second set of arrays.
+
+        The arrays of the current observation keep it until the next call
+        flips back to them, so it can be compared with later ones without
+        copying. The second set is allocated on the first call.
+        """
+        self._pynethack.flip_buffers()
+        if self._back_buffers is None:
+            self._back_buffers = {}
+            for key in self._obs_buffers:
+                self._back_buffers[key] = self._zeros(key)
+                self._pynethack.set_buffer(key, _as_numpy(self._back_buffers[key]))
+        self._obs_buffers, self._back_buffers = self._back_buffers, self._obs_buffers
+        self._obs = tuple(self._obs_buffers.values())
+
+    def snapshot(self):
+        """Returns an opaque snapshot of the running game for `restore`.
+
+        Snapshots are kept in memory, not in save files, and can be restored
+        any number of times, also after `reset`. They are only valid for the
+        game they were taken from, until it is closed. Not supported on all
+        platforms (raises RuntimeError).
+        """
+        return self._pynethack.snapshot()
+
+    def restore(self, snapshot):
+        """Continues the game from `snapshot`, see `snapshot`."""
+        self._pynethack.restore(snapshot)
+        return self._step_return()
+
     def close(self):
         self._pynethack.close()
-        try:
-            os.chdir(self._oldcwd)
-        except IOError:
-            os.chdir(os.path.dirname(os.path.realpath(__file__)))
-        self._tempdir.cleanup()
+        with _START_LOCK:
+            try:
+                os.chdir(self._oldcwd)
+            except IOError:
+                os.chdir(os.path.dirname(os.path.realpath(__file__)))
+            self._tempdir.cleanup()
 
     def set_initial_seeds(self, core, disp, reseed=False):
         self._pynethack.set_initial_seeds(core, disp, reseed)
+        self._initial_seeds = (core, disp, reseed)
 
     def set_current_seeds(self, core=None, disp=None, reseed=False):
         """Sets the seeds of NetHack right now.
@@ -224,3 +556,172 @@ class Nethack:
 
     def in_normal_game(self):
         return self._pynethack.in_normal_game()
+
+    def ttyrec_frames_dropped(self):
+        """Frames missing from the ttyrecs as the writer's queue was full."""
+        return self._pynethack.ttyrec_frames_dropped()
+
+    def wait_ttyrec(self):
+        """With ttyrec_async=True, waits until the ttyrecs of earlier episodes
+        are written and closed."""
+        self._pynethack.wait_ttyrec()
+
+    def string_table(self):
+        """Returns the strings added to the string table since the last call.
+
+        The `screen_description_ids` and `inv_str_ids` observations index
+        this table instead of containing the bytes of the strings. It's shared
+        by all games in this process and only grows; ID 0 is the empty string.
+        Extend a list with the result of each call to look up IDs.
+        """
+        return self._pynethack.string_table()
+
+
+class BatchedNethack:
+    """Several NetHack games that are stepped together.
+
+    Observations of game i are in row i of arrays of shape
+    [batch_size, ...]. A single call to `step` advances all games that are
+    not done, without holding the GIL.
+    """
+
+    def __init__(
+        self,
+        batch_size,
+        observation_keys=OBSERVATION_DESC.keys(),
+        playername="Agent-mon-hum-neu-mal",
+        ttyrecs=None,
+        options=None,
+        wizard=False,
+        hackdir=HACKDIR,
+        observation_profile="default",
+        crop_radius=CROP_RADIUS,
+        ttyrec_codec="bz2",
+        ttyrec_level=None,
+        ttyrec_async=False,
+    ):
+        desc = observation_desc(observation_profile, crop_radius)
+        codec = _ttyrec_codec(ttyrec_codec)
+        if ttyrec_codec == "keys":
+            raise ValueError("BatchedNethack doesn't write keys logs")
+        if ttyrec_codec == "none":
+            ttyrecs = [os.devnull] * batch_size
+        elif ttyrecs is None:
+            ttyrecs = ["nle.%i.ttyrec.bz2" % i for i in range(batch_size)]
+        if len(ttyrecs) != batch_size:
+            raise ValueError("Need %i ttyrecs, got %i" % (batch_size, len(ttyrecs)))
+
+        self._tempdirs = [_make_vardir(hackdir) for _ in range(batch_size)]
+        with _START_LOCK:
+            self._oldcwd = os.getcwd()
+
+        if options is None:
+            options = NETHACKOPTIONS
+        self._options = list(options) + ["name:" + playername]
+        if wizard:
+            self._options.append("playmode:debug")
+
+        self._pynethack = _pynethack.BatchedNethack(
+            [_copy_library(d.name) for d in self._tempdirs], list(ttyrecs)
+        )
+        self._pynethack.set_crop_radius(crop_radius)
+        self._pynethack.set_ttyrec_codec(codec, ttyrec_level or 0)
+        if ttyrec_async:
+            self._pynethack.set_ttyrec_async(True)
+
+        self._obs_buffers = {}
+        for key in observation_keys:
+            if key not in OBSERVATION_DESC:
+                raise ValueError("Unknown observation '%s'" % key)
+            self._obs_buffers[key] = np.zeros(
+                (batch_size,) + desc[key]["shape"], dtype=desc[key]["dtype"]
+            )
+        self._done = np.zeros(batch_size, dtype=bool)
+        self._actions = np.zeros(batch_size, dtype=np.int32)
+
+        self._pynethack.set_buffers(done=self._done, **self._obs_buffers)
+        self._obs = tuple(self._obs_buffers[key] for key in observation_keys)
+
+    def __len__(self):
+        return len(self._tempdirs)
+
+    def step(self, actions):
+        """Steps all games that are not done.
+
+        Arguments:
+            actions [array-like of int]: One action per game. Actions of
+                finished games are ignored.
+
+        Returns:
+            [tuple] observations, each of shape [batch_size, ...], and the
+                boolean done array of shape [batch_size].
+        """
+        self._actions[:] = actions
+        self._pynethack.step(self._actions)
+        return self._obs, self._done
+
+    def reset(self, index=None, new_ttyrec=None):
+        """Resets game `index`, or all games if `index` is None."""
+        if index is None:
+            if new_ttyrec is not None:
+                raise ValueError("new_ttyrec requires an index")
+            for i in range(len(self)):
+                self.reset(i)
+            return self._obs
+        with _START_LOCK:
+            _set_env_vars(self._options, self._tempdirs[index].name)
+            if new_ttyrec is None:
+                self._pynethack.reset(index)
+            else:
+                self._pynethack.reset(index, new_ttyrec)
+        return self._obs
+
+    def set_buffers(self, **buffers):
+        """Makes the games write observations into the given arrays.
+
+        Like `Nethack.set_buffers`, with arrays of shape [batch_size, ...]
+        and `done` for the done array. Only the rows need to be C contiguous,
+        so `storage[:, t]` of an array of shape [batch_size, T, *shape] works
+        as well as `storage[t]` of one of shape [T, batch_size, *shape].
+        """
+        for key, buffer in buffers.items():
+            if key == "done":
+                self._pynethack.set_buffer(key, buffer)
+                self._done = buffer
+                continue
+            if key not in self._obs_buffers:
+                raise ValueError("Unknown observation '%s'" % key)
+            self._pynethack.set_buffer(key, buffer)
+            self._obs_buffers[key] = buffer
+        self._obs = tuple(self._obs_buffers.values())
+
+    def close(self):
+        self._pynethack.close()
+        with _START_LOCK:
+            try:
+                os.chdir(self._oldcwd)
+            except IOError:
+                os.chdir(os.path.dirname(os.path.realpath(__file__)))
+            for tempdir in self._tempdirs:
+                tempdir.cleanup()
+
+    def set_initial_seeds(self, index, core, disp, reseed=False):
+        self._pynethack.set_initial_seeds(index, core, disp, reseed)
+
+    def get_current_seeds(self, index):
+        return self._pynethack.get_seeds(index)
+
+    def in_normal_game(self, index):
+        return self._pynethack.in_normal_game(index)
+
+    def ttyrec_frames_dropped(self):
+        """Of all games, see `Nethack.ttyrec_frames_dropped`."""
+        return self._pynethack.ttyrec_frames_dropped()
+
+    def wait_ttyrec(self):
+        """See `Nethack.wait_ttyrec`."""
+        self._pynethack.wait_ttyrec()
+
+    def string_table(self):
+        """See `Nethack.string_table`."""
+        return self._pynethack.string_table()
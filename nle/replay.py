@@ -0,0 +1,181 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+"""Regenerates the observations of recorded episodes.
+
+Episodes are keys logs (see `nle.nethack.Nethack` with ttyrec_codec="keys")
+or (seeds, keys) pairs. `replay` re-runs them in a process pool, with only
+the requested observations and no ttyrecs, and each game writes its
+observations straight into .npy files in an output directory. Row i of these
+files is step t[i] of episode episode_id[i], where t = 0 is the observation
+after reset and t is the observation after the t-th key otherwise. Each
+episode gets len(keys) + 1 rows, in the order the episodes were given.
+
+A CRC32 of each step's glyphs (see `checksum`) goes into checksum.npy. If
+checksums are given as well, `replay` checks the episodes against them, e.g.
+against those of an earlier replay or of the games that were recorded.
+"""
+import concurrent.futures
+import os
+import zlib
+
+import numpy as np
+
+from nle import nethack
+
+
+def checksum(glyphs):
+    """Returns the CRC32 of a glyphs observation, as `replay` computes it."""
+    return zlib.crc32(np.ascontiguousarray(glyphs))
+
+
+def _load(episode):
+    """Returns the header and keys of a keys log or (seeds, keys) pair."""
+    if isinstance(episode, str):
+        return nethack.read_keylog(episode)
+    seeds, keys = episode
+    header = {
+        "seeds": list(seeds),
+        "options": list(nethack.NETHACKOPTIONS),
+        "playername": "Agent-mon-hum-neu-mal",
+        "wizard": False,
+        "wizkit": None,
+    }
+    return header, bytes(keys)
+
+
+def _replay_episode(out_dir, row, header, keys, observation_keys, profile, expected):
+    """Replays an episode into rows row, row + 1, ... of the files in out_dir.
+
+    Returns the first step whose checksum isn't as expected, or None.
+    """
+    outputs = {
+        key: np.load(os.path.join(out_dir, key + ".npy"), mmap_mode="r+")
+        for key in tuple(observation_keys) + ("checksum",)
+    }
+    game_keys = list(observation_keys)
+    if "glyphs" not in game_keys:
+        game_keys.append("glyphs")
+    glyphs_index = game_keys.index("glyphs")
+    game = nethack.Nethack(
+        observation_keys=game_keys,
+        playername=header["playername"],
+        options=header["options"],
+        wizard=header["wizard"],
+        observation_profile=profile,
+        ttyrec_codec="none",
+    )
+    mismatch = None
+    try:
+        game.set_initial_seeds(*header["seeds"])
+        game.set_buffers(**{key: outputs[key][row] for key in observation_keys})
+        observation = game.reset(wizkit_items=header["wizkit"])
+        done = False
+        for t in range(len(keys) + 1):
+            if t > 0:
+                if done:
+                    return t  # The game ended early.
+                game.set_buffers(
+                    **{key: outputs[key][row + t] for key in observation_keys}
+                )
+                observation, done = game.step(keys[t - 1])
+            crc = checksum(observation[glyphs_index])
+            outputs["checksum"][row + t] = crc
+            if mismatch is None and expected is not None and expected[t] != crc:
+                mismatch = t
+    finally:
+        game.close()
+        for output in outputs.values():
+            output.flush()
+    return mismatch
+
+
+def replay(
+    episodes,
+    out_dir,
+    observation_keys=("glyphs",),
+    observation_profile="default",
+    checksums=None,
+    processes=None,
+):
+    """Replays episodes in a process pool into .npy files, see above.
+
+    Args:
+        episodes (list): keys log filenames or (seeds, keys) pairs, where
+            seeds are (core, disp, reseed) and keys a bytes-like object. Those
+            use the default options.
+        out_dir (str): directory for episode_id.npy, t.npy, checksum.npy and
+            <key>.npy for each observation key. Existing files get
+            overwritten.
+        observation_keys (list): observations to generate.
+        observation_profile (str): their dtypes, see
+            ``nle.nethack.OBSERVATION_PROFILES``.
+        checksums (list): for each episode, the expected checksums of its
+            len(keys) + 1 steps, or None to not check that episode.
+        processes (int): size of the pool. Defaults to the number of CPUs.
+
+    Returns:
+        (dict): the files as read-only memmaps, by name without ".npy".
+
+    Raises:
+        RuntimeError: if episodes didn't replay as recorded, i.e. they
+            didn't match their checksums or ended before their last key.
+    """
+    loaded = [_load(episode) for episode in episodes]
+    if checksums is None:
+        checksums = [None] * len(loaded)
+    if len(checksums) != len(loaded):
+        raise ValueError(
+            "Need checksums for %i episodes, got %i" % (len(loaded), len(checksums))
+        )
+    lengths = np.array([len(keys) + 1 for _, keys in loaded], dtype=np.int64)
+    rows = np.concatenate([[0], np.cumsum(lengths)])
+
+    os.makedirs(out_dir, exist_ok=True)
+    desc = nethack.observation_desc(observation_profile)
+    files = {
+        "episode_id": ((), np.int32),
+        "t": ((), np.int32),
+        "checksum": ((), np.uint32),
+    }
+    for key in observation_keys:
+        if key not in desc:
+            raise ValueError("Unknown observation '%s'" % key)
+        files[key] = (desc[key]["shape"], desc[key]["dtype"])
+    for name, (shape, dtype) in files.items():
+        output = np.lib.format.open_memmap(
+            os.path.join(out_dir, name + ".npy"),
+            mode="w+",
+            dtype=dtype,
+            shape=(int(rows[-1]),) + tuple(shape),
+        )
+        if name == "episode_id":
+            output[:] = np.repeat(np.arange(len(loaded)), lengths)
+        elif name == "t":
+            output[:] = np.arange(rows[-1]) - np.repeat(rows[:-1], lengths)
+        output.flush()
+        del output
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        futures = [
+            executor.submit(
+                _replay_episode,
+                out_dir,
+                int(row),
+                header,
+                keys,
+                tuple(observation_keys),
+                observation_profile,
+                expected,
+            )
+            for row, (header, keys), expected in zip(rows, loaded, checksums)
+        ]
+        mismatches = [future.result() for future in futures]
+
+    diverged = [
+        "%i at step %i" % (i, t) for i, t in enumerate(mismatches) if t is not None
+    ]
+    if diverged:
+        raise RuntimeError("Episodes diverged: %s" % ", ".join(diverged))
+    return {
+        name: np.load(os.path.join(out_dir, name + ".npy"), mmap_mode="r")
+        for name in files
+    }
@@ -0,0 +1,72 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+"""Compare memory use and start-up time of many Nethack instances in one
+process, with and without dlmopen.
+
+RSS counts a shared page once per mapping, so it overstates the cost of
+loading the same libraries into several namespaces. USS (pages private to
+this process) is the number that matters when running many games per node.
+
+Usage: python -m nle.scripts.check_nethack_memory [NUM_GAMES] [copy|dlmopen]
+
+Run once per mode; measuring both in one process would let the second run
+reuse memory freed by the first.
+"""
+
+import collections
+import os
+import sys
+import timeit
+
+from nle import nethack
+
+
+def memory():
+    """Returns (RSS, USS) of this process in bytes."""
+    kb = collections.Counter()
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, *value = line.split()
+            if value and value[-1] == "kB":
+                kb[key.rstrip(":")] = int(value[0])
+    return 1024 * kb["Rss"], 1024 * (kb["Private_Clean"] + kb["Private_Dirty"])
+
+
+def measure(num_games, dlmopen):
+    start_rss, start_uss = memory()
+    start_time = timeit.default_timer()
+    games = [nethack.Nethack(dlmopen=dlmopen) for _ in range(num_games)]
+    for game in games:
+        game.reset()
+        game.step(nethack.MiscAction.MORE)
+    elapsed = timeit.default_timer() - start_time
+    rss, uss = memory()
+
+    copies = sum(
+        os.path.exists(os.path.join(game._vardir, "libnethack.so")) for game in games
+    )
+    for game in games:
+        game.close()
+    return rss - start_rss, uss - start_uss, elapsed, copies
+
+
+def main():
+    num_games = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    dlmopen = len(sys.argv) > 2 and sys.argv[2] == "dlmopen"
+
+    rss, uss, elapsed, copies = measure(num_games, dlmopen)
+    print(
+        "dlmopen=%s, %i games, %i library copies: "
+        "RSS %.2f MiB/game, USS %.2f MiB/game, %.1f ms/game"
+        % (
+            dlmopen,
+            num_games,
+            copies,
+            rss / 2**20 / num_games,
+            uss / 2**20 / num_games,
+            1000 * elapsed / num_games,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
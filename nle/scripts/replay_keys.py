@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+"""Replays a keys log (ttyrec_codec="keys") to get its observations or a ttyrec.
+
+Example:
+    python -m nle.scripts.replay_keys nle.1234.0.keys --ttyrec nle.ttyrec.bz2 \\
+        --observations obs.npz --keys glyphs,blstats
+"""
+import argparse
+import warnings
+
+import numpy as np
+
+import nle
+from nle import nethack
+
+
+TTYREC_CODECS = {".bz2": "bz2", ".zst": "zstd"}
+
+
+def replay(filename, observation_keys=(), ttyrec=None):
+    """Replays a keys log.
+
+    Args:
+        filename (str): the keys log.
+        observation_keys (list): observations to generate.
+        ttyrec (str or None): if given, write a ttyrec of the replay there,
+            bzip2- or zstd-compressed if it ends in ".bz2" or ".zst".
+
+    Yields:
+        (tuple) the observation after reset, then the observation after each
+            key, as copies.
+    """
+    header, keys = nethack.read_keylog(filename)
+    if header["version"] != nle.__version__:
+        warnings.warn(
+            "%s was written by NLE %s, replaying with %s"
+            % (filename, header["version"], nle.__version__)
+        )
+    if ttyrec is None:
+        ttyrec_codec = "none"
+    else:
+        ttyrec_codec = TTYREC_CODECS.get(ttyrec[ttyrec.rfind(".") :], "raw")
+    game = nethack.Nethack(
+        observation_keys=observation_keys,
+        playername=header["playername"],
+        ttyrec=ttyrec,
+        options=header["options"],
+        copy=True,
+        wizard=header["wizard"],
+        ttyrec_codec=ttyrec_codec,
+    )
+    try:
+        game.set_initial_seeds(*header["seeds"])
+        yield game.reset(wizkit_items=header["wizkit"])
+        for t, key in enumerate(keys):
+            observation, done = game.step(key)
+            yield observation
+            if done and t + 1 < len(keys):
+                raise RuntimeError(
+                    "Game ended after %i of %i keys of %s"
+                    % (t + 1, len(keys), filename)
+                )
+    finally:
+        game.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("filename", help="keys log")
+    parser.add_argument(
+        "--ttyrec", help="write a ttyrec there (.bz2 and .zst get compressed)"
+    )
+    parser.add_argument(
+        "--observations", help="write the observations into this .npz file"
+    )
+    parser.add_argument(
+        "--keys",
+        default="glyphs,blstats",
+        help="comma separated observation keys for --observations",
+    )
+    flags = parser.parse_args()
+
+    observation_keys = flags.keys.split(",") if flags.observations else ()
+    observations = list(replay(flags.filename, observation_keys, flags.ttyrec))
+    print("Replayed %i keys" % (len(observations) - 1))
+    if flags.observations:
+        np.savez_compressed(
+            flags.observations,
+            **{
+                key: np.stack([o[i] for o in observations])
+                for i, key in enumerate(observation_keys)
+            },
+        )
+
+
+if __name__ == "__main__":
+    main()
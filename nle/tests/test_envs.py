@@ -5,6 +5,7 @@ import os
 import random
 import sys
 import tempfile
+import zipfile
 
 import numpy as np
 import pytest
@@ -13,6 +14,7 @@ import gym
 import nle
 import nle.env
 from nle import nethack
+from nle.env import archive
 
 
 def get_nethack_env_ids():
@@ -346,6 +348,48 @@ class TestGymDynamics:
         assert done
         assert reward == 0.0
 
+    def test_quit_observation(self, env):
+        env.reset()
+
+        # Hack to quit. NLE.step answers the final questions itself.
+        env.env.step(nethack.M("q"))
+        obs, reward, done, _ = env.step(env._actions.index(ord("y")))
+
+        assert done
+        assert reward == 0.0
+        # The game's last frame, not the one from before quitting.
+        assert not obs["blstats"].any()
+        assert not env.env.in_normal_game()
+
+    def test_known_prompts_handled_in_step(self):
+        actions = nethack.ACTIONS
+        env = nle.env.NLE(actions=actions)
+        try:
+            env.reset()
+            # Not in SKIP_EXCEPTIONS, so "Really quit?" gets declined.
+            obs, _, done, _ = env.step(actions.index(nethack.Command.QUIT))
+            assert not done
+            assert not env.last_observation[env._internal_index][1]
+
+            # Directions are left to the agent.
+            obs, _, done, _ = env.step(actions.index(nethack.Command.KICK))
+            assert b"In what direction? " in bytes(obs["message"])
+            assert env.last_observation[env._internal_index][1]
+        finally:
+            env.close()
+
+    def test_action_repeat(self):
+        env = gym.make("NetHackScore-v0", action_repeat=4)
+        try:
+            env.reset()
+            for _ in range(20):
+                _, _, done, info = env.step(env.action_space.sample())
+                assert 1 <= info["action_repeats"] <= 4
+                if done:
+                    break
+        finally:
+            env.close()
+
     def test_final_reward(self, env):
         obs = env.reset()
 
@@ -369,3 +413,240 @@ class TestGymDynamics:
 
         assert done
         assert reward == 0.0
+
+
+class TestResetPool:
+    @pytest.yield_fixture(autouse=True)  # will be applied to all tests in class
+    def make_cwd_tmp(self, tmpdir):
+        """Makes cwd point to the test's tmpdir."""
+        with tmpdir.as_cwd():
+            yield
+
+    def test_rollouts(self):
+        with tempfile.TemporaryDirectory() as savedir:
+            env = gym.make("NetHackScore-v0", savedir=savedir, reset_pool_size=2)
+            for _ in range(4):
+                obs = env.reset()
+                assert env.observation_space.contains(obs)
+                assert env._in_moveloop(env.last_observation)
+                for _ in range(20):
+                    obs, reward, done, info = env.step(env.action_space.sample())
+                    assert env.observation_space.contains(obs)
+                    if done:
+                        break
+            env.close()
+
+            for i in range(4):
+                assert os.path.exists(
+                    os.path.join(savedir, "nle.%i.%i.ttyrec.bz2" % (os.getpid(), i))
+                )
+
+    @pytest.mark.parametrize(
+        "ttyrec_codec,suffix", [("raw", ".ttyrec"), ("none", None)]
+    )
+    def test_ttyrec_codec(self, ttyrec_codec, suffix):
+        with tempfile.TemporaryDirectory() as savedir:
+            env = gym.make(
+                "NetHackScore-v0",
+                savedir=savedir,
+                reset_pool_size=1,
+                ttyrec_codec=ttyrec_codec,
+            )
+            for _ in range(2):
+                env.reset()
+                env.step(0)
+            env.close()
+
+            ttyrecs = sorted(f for f in os.listdir(savedir) if ".ttyrec" in f)
+            if suffix is None:
+                assert ttyrecs == []
+            else:
+                # The pool already started the next game.
+                assert len(ttyrecs) == 3
+                for i in range(2):
+                    ttyrec = "nle.%i.%i%s" % (os.getpid(), i, suffix)
+                    assert os.path.getsize(os.path.join(savedir, ttyrec)) > 0
+
+    def test_pool_seeds(self):
+        env = gym.make(
+            "NetHackScore-v0",
+            reset_pool_size=1,
+            reset_pool_seeds=lambda: (123456, 789012, False),
+        )
+        try:
+            obs0 = env.reset()
+            obs0 = {key: value.copy() for key, value in obs0.items()}
+            obs1 = env.reset()
+            assert env.get_seeds() == (123456, 789012, False)
+            np.testing.assert_equal(obs0, obs1)
+        finally:
+            env.close()
+
+    def test_seed_bypasses_pool(self):
+        env0 = gym.make("NetHackScore-v0", reset_pool_size=1)
+        env1 = gym.make("NetHackScore-v0")
+        try:
+            for env in (env0, env1):
+                env.seed(123456, 789012)
+            np.testing.assert_equal(env0.reset(), env1.reset())
+            compare_rollouts(env0, env1, 50)
+        finally:
+            env0.close()
+            env1.close()
+
+
+class TestArchive:
+    @pytest.yield_fixture(autouse=True)  # will be applied to all tests in class
+    def make_cwd_tmp(self, tmpdir):
+        """Makes cwd point to the test's tmpdir."""
+        with tmpdir.as_cwd():
+            yield
+
+    @pytest.mark.parametrize("ttyrec_async", [False, True], ids=["sync", "async"])
+    @pytest.mark.parametrize("reset_pool_size", [0, 1])
+    def test_archive(self, reset_pool_size, ttyrec_async):
+        with tempfile.TemporaryDirectory() as savedir:
+            env = gym.make(
+                "NetHackScore-v0",
+                savedir=savedir,
+                archivefile="nle.%(pid)i.zip",
+                reset_pool_size=reset_pool_size,
+                ttyrec_async=ttyrec_async,
+            )
+            seeds = []
+            for steps in range(1, 4):
+                env.reset()
+                seeds.append(list(env.get_seeds()))
+                for _ in range(steps):
+                    env.step(0)
+            env.close()
+
+            filename = "nle.%i.zip" % os.getpid()
+            assert os.listdir(savedir) == [filename]
+            episodes = archive.read_episodes(os.path.join(savedir, filename))
+            # The pool already started the next game.
+            assert len(episodes) == 3 + reset_pool_size
+            for i, (name, metadata) in enumerate(episodes[:3]):
+                assert name == "nle.%i.%i.ttyrec.bz2" % (os.getpid(), i)
+                assert metadata == {
+                    "seeds": seeds[i],
+                    "steps": i + 1,
+                    "end_status": int(env.StepStatus.RUNNING),
+                }
+            with zipfile.ZipFile(os.path.join(savedir, filename)) as f:
+                for name, _ in episodes:
+                    assert f.read(name).startswith(b"BZh")
+
+    def test_archive_size(self):
+        with tempfile.TemporaryDirectory() as savedir:
+            env = gym.make(
+                "NetHackScore-v0",
+                savedir=savedir,
+                archivefile="nle.zip",
+                archive_size=1,
+            )
+            for _ in range(3):
+                env.reset()
+                env.step(0)
+            env.close()
+
+            filenames = sorted(os.listdir(savedir))
+            assert filenames == ["nle.1.zip", "nle.2.zip", "nle.zip"]
+            for filename in filenames:
+                episodes = archive.read_episodes(os.path.join(savedir, filename))
+                assert len(episodes) == 1
+                assert episodes[0][1]["steps"] == 1
+
+    def test_no_savedir(self):
+        env = gym.make("NetHackScore-v0", savedir=None, archivefile="nle.zip")
+        try:
+            assert env._archive is None
+        finally:
+            env.close()
+
+
+class TestRolloutStorage:
+    @pytest.yield_fixture(autouse=True)  # will be applied to all tests in class
+    def make_cwd_tmp(self, tmpdir):
+        """Makes cwd point to the test's tmpdir."""
+        with tmpdir.as_cwd():
+            yield
+
+    def test_same_as_copying(self):
+        keys = ("glyphs", "blstats")
+        # Short episodes, to reset like the agent does when one ends.
+        env0 = gym.make("NetHackScore-v0", observation_keys=keys, max_episode_steps=7)
+        env1 = gym.make("NetHackScore-v0", observation_keys=keys, max_episode_steps=7)
+        rng = random.Random(0)
+        try:
+            for env in (env0, env1):
+                env.seed(123456, 789012)
+            obs0 = env0.reset()
+            env1.reset()
+
+            rollout_len = 50
+            storage = {
+                key: np.zeros((rollout_len + 1,) + space.shape, dtype=space.dtype)
+                for key, space in env1.observation_space.spaces.items()
+            }
+            env1.set_buffers(copy=True, **{k: v[0] for k, v in storage.items()})
+
+            expected = [{k: v.copy() for k, v in obs0.items()}]
+            resets = 0
+            for t in range(rollout_len):
+                env1.set_buffers(**{k: v[t + 1] for k, v in storage.items()})
+                action = rng.randrange(env0.action_space.n)
+                obs0, reward0, done0, _ = env0.step(action)
+                obs1, reward1, done1, _ = env1.step(action)
+                assert reward0 == reward1
+                assert done0 == done1
+                if done0:
+                    resets += 1
+                    for env in (env0, env1):
+                        env.seed(t, t + 1)
+                    obs0 = env0.reset()
+                    obs1 = env1.reset()
+                assert np.shares_memory(obs1["glyphs"], storage["glyphs"][t + 1])
+                expected.append({k: v.copy() for k, v in obs0.items()})
+            assert resets > 0
+
+            for t, obs in enumerate(expected):
+                for key in keys:
+                    np.testing.assert_equal(storage[key][t], obs[key])
+        finally:
+            env0.close()
+            env1.close()
+
+    def test_no_reset_pool(self):
+        env = gym.make("NetHackScore-v0", reset_pool_size=1)
+        try:
+            with pytest.raises(ValueError, match="reset pool"):
+                env.set_buffers(glyphs=np.zeros(nethack.DUNGEON_SHAPE, np.int16))
+        finally:
+            env.close()
+
+    def test_compact_profile(self):
+        env = gym.make("NetHackScore-v0", observation_profile="compact")
+        try:
+            spaces = env.observation_space.spaces
+            assert spaces["blstats"].dtype == np.int32
+            assert spaces["glyphs"].dtype == np.uint16
+            obs = env.reset()
+            obs, _, _, _ = env.step(0)
+            assert env.observation_space.contains(obs)
+            for key, space in spaces.items():
+                assert obs[key].dtype == space.dtype
+        finally:
+            env.close()
+
+    def test_crop_radius(self):
+        env = gym.make(
+            "NetHackScore-v0", observation_keys=nethack.CROP_KEYS, crop_radius=1
+        )
+        try:
+            for key in nethack.CROP_KEYS:
+                assert env.observation_space[key].shape == (3, 3)
+            obs = env.reset()
+            assert env.observation_space.contains(obs)
+        finally:
+            env.close()
@@ -1,6 +1,10 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
+import bz2
+import concurrent.futures
+import struct
 import timeit
 import random
+import sys
 import warnings
 
 import numpy as np
@@ -8,6 +12,7 @@ import numpy as np
 import pytest
 
 from nle import nethack, _pynethack
+from nle.scripts import replay_keys
 
 
 # MORE + compass directions + long compass directions.
@@ -139,6 +144,615 @@ class TestNetHack:
         game.set_current_seeds(core=42, disp=666)
         assert game.get_current_seeds() == (42, 666, False)
 
+    def test_reset_same_as_new_game(self, game):
+        actions = [random.choice(ACTIONS) for _ in range(100)]
+
+        def play(nethack_game):
+            nethack_game.set_initial_seeds(core=42, disp=666)
+            observations = [nethack_game.reset()[0].copy()]
+            for action in actions:
+                obs, done = nethack_game.step(action)
+                observations.append(obs[0].copy())
+                if done:
+                    break
+            return observations
+
+        # Abandon a game midway, then reset in place.
+        game.reset()
+        for action in actions[:50]:
+            _, done = game.step(action)
+            if done:
+                break
+        after_reset = play(game)
+
+        fresh_game = nethack.Nethack(observation_keys=("chars", "blstats"))
+        try:
+            np.testing.assert_equal(after_reset, play(fresh_game))
+        finally:
+            fresh_game.close()
+
+    def test_set_buffers_into_storage(self):
+        actions = [random.choice(ACTIONS) for _ in range(50)]
+        game = nethack.Nethack(observation_keys=("chars", "blstats"), copy=True)
+        try:
+            game.set_initial_seeds(core=42, disp=666)
+            expected = [game.reset()[0]]
+            for action in actions:
+                obs, done = game.step(action)
+                expected.append(obs[0])
+                if done:
+                    break
+        finally:
+            game.close()
+
+        storage = np.zeros((len(expected), 21, 79), dtype=np.uint8)
+        game = nethack.Nethack(observation_keys=("chars", "blstats", "tty_chars"))
+        try:
+            game.set_initial_seeds(core=42, disp=666)
+            game.set_buffers(chars=storage[0])
+            game.reset()
+            for t, action in enumerate(actions[: len(expected) - 1], 1):
+                game.set_buffers(chars=storage[t])
+                (chars, _, _), _ = game.step(action)
+                assert np.shares_memory(chars, storage[t])
+            np.testing.assert_equal(list(storage), expected)
+
+            # The terminal only redraws what changed, but new buffers get it all.
+            game.reset()
+            tty_chars = np.zeros((24, 80), dtype=np.uint8)
+            game.set_buffers(tty_chars=tty_chars)
+            game.step(ord("s"))
+            assert tty_chars.all()
+
+            with pytest.raises(RuntimeError, match="C contiguous"):
+                game.set_buffers(chars=np.zeros((79, 21), dtype=np.uint8).T)
+            readonly = np.zeros((21, 79), dtype=np.uint8)
+            readonly.flags.writeable = False
+            with pytest.raises(RuntimeError, match="writeable"):
+                game.set_buffers(chars=readonly)
+        finally:
+            game.close()
+
+    def test_flip_buffers_same_as_copy(self):
+        actions = [random.choice(ACTIONS) for _ in range(200)]
+        observations = []
+        for flip in (True, False):
+            game = nethack.Nethack()
+            try:
+                game.set_initial_seeds(core=42, disp=666)
+                last = game.reset()
+                steps = [[o.copy() for o in last]]
+                for action in actions:
+                    if flip:
+                        game.flip_buffers()
+                    obs, done = game.step(action)
+                    if flip:
+                        # The arrays of the last observation keep it.
+                        assert not any(
+                            np.shares_memory(a, b) for a, b in zip(obs, last)
+                        )
+                        np.testing.assert_equal(last, steps[-1])
+                    steps.append([o.copy() for o in obs])
+                    last = obs
+                    if done:
+                        break
+                observations.append(steps)
+            finally:
+                game.close()
+        np.testing.assert_equal(*observations)
+
+    @pytest.mark.skipif(
+        not hasattr(np.ndarray, "__dlpack__"), reason="Needs numpy>=1.22"
+    )
+    def test_dlpack(self, game):
+        chars, _ = game.reset()
+        exported = np.from_dlpack(chars)
+        assert np.shares_memory(exported, chars)
+        game.step(ord("i"))
+        np.testing.assert_equal(exported, chars)
+
+    def test_torch_observations(self):
+        torch = pytest.importorskip("torch")
+        game = nethack.Nethack(
+            observation_keys=("glyphs", "blstats"), observation_format="torch"
+        )
+        try:
+            glyphs, blstats = game.reset()
+            assert isinstance(glyphs, torch.Tensor)
+            assert glyphs.is_shared()
+            assert glyphs.dtype == torch.int16 and glyphs.shape == (21, 79)
+            x, y = blstats[:2].tolist()
+            assert nethack.glyph_is_monster(int(glyphs[y, x]))
+            game.flip_buffers()
+            (glyphs, _), _ = game.step(ord("s"))
+            assert isinstance(glyphs, torch.Tensor) and glyphs.is_shared()
+        finally:
+            game.close()
+
+    def test_unknown_observation_format(self):
+        with pytest.raises(ValueError, match="observation_format"):
+            nethack.Nethack(observation_format="jax")
+
+    def test_compact_profile(self):
+        actions = [random.choice(ACTIONS) for _ in range(200)]
+        observations = []
+        for profile in ("default", "compact"):
+            game = nethack.Nethack(observation_profile=profile)
+            try:
+                game.set_initial_seeds(core=42, disp=666)
+                steps = [[o.copy() for o in game.reset()]]
+                for action in actions:
+                    game.flip_buffers()
+                    obs, done = game.step(action)
+                    steps.append([o.copy() for o in obs])
+                    if done:
+                        break
+                observations.append(steps)
+            finally:
+                game.close()
+
+        default, compact = observations
+        assert len(default) == len(compact)
+        for default_obs, compact_obs in zip(default, compact):
+            for key, a, b in zip(nethack.OBSERVATION_DESC, default_obs, compact_obs):
+                assert b.dtype == nethack.COMPACT_OBSERVATION_DESC[key]["dtype"]
+                np.testing.assert_array_equal(a, b)
+
+        with pytest.raises(ValueError, match="observation_profile"):
+            nethack.Nethack(observation_profile="tiny")
+
+    def test_blstats_dtype_per_buffer(self, game):
+        game.reset()
+        compact = np.zeros(nethack.BLSTATS_SHAPE, dtype=np.int32)
+        game.set_buffers(blstats=compact)
+        _, blstats = game.step(ord("s"))[0]
+        assert blstats is compact
+        assert compact.any()
+
+        wide = np.zeros(nethack.BLSTATS_SHAPE, dtype=np.int64)
+        game.set_buffers(blstats=wide)
+        before = compact.copy()
+        game.step(ord("s"))
+        np.testing.assert_equal(compact, before)
+        np.testing.assert_equal(wide[:2], before[:2])  # Position.
+
+        with pytest.raises(RuntimeError, match="right type"):
+            game.set_buffers(blstats=np.zeros(nethack.BLSTATS_SHAPE, np.int16))
+
+    @pytest.mark.parametrize("crop_radius", [nethack.CROP_RADIUS, 0, 30])
+    def test_crop_observations(self, crop_radius):
+        keys = ("glyphs", "chars", "colors", "blstats") + nethack.CROP_KEYS
+        game = nethack.Nethack(observation_keys=keys, crop_radius=crop_radius)
+        try:
+            obs = game.reset()
+            for action in [None] + [random.choice(ACTIONS) for _ in range(50)]:
+                if action is not None:
+                    obs, done = game.step(action)
+                    if done:
+                        break
+                glyphs, chars, colors, blstats, *crops = obs
+                x, y = blstats[:2]
+                for crop, full, padding in zip(
+                    crops, (glyphs, chars, colors), (0, ord(" "), 0)
+                ):
+                    assert crop.shape == (2 * crop_radius + 1,) * 2
+                    padded = np.pad(full, crop_radius, constant_values=padding)
+                    np.testing.assert_equal(
+                        crop, padded[y : y + crop.shape[0], x : x + crop.shape[1]]
+                    )
+        finally:
+            game.close()
+
+    def test_dlmopen_same_as_copy(self):
+        actions = [random.choice(ACTIONS) for _ in range(200)]
+        observations = []
+        for dlmopen in (True, False):
+            game = nethack.Nethack(observation_keys=("chars",), dlmopen=dlmopen)
+            try:
+                game.set_initial_seeds(core=42, disp=666)
+                game.reset()
+                steps = []
+                for action in actions:
+                    obs, done = game.step(action)
+                    steps.append(obs[0].copy())
+                    if done:
+                        break
+                observations.append(steps)
+            finally:
+                game.close()
+        np.testing.assert_equal(*observations)
+
+
+class TestNethackThreads:
+    @staticmethod
+    def run_game(actions):
+        game = nethack.Nethack(observation_keys=("chars", "blstats"), copy=True)
+        try:
+            game.set_initial_seeds(core=42, disp=666)
+            game.reset()
+            observations = []
+            for action in actions:
+                obs, done = game.step(action)
+                observations.append(obs)
+                if done:
+                    break
+            return observations
+        finally:
+            game.close()
+
+    def test_threads_match_sequential(self):
+        actions = [random.choice(ACTIONS) for _ in range(300)]
+        expected = self.run_game(actions)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(self.run_game, [actions] * 4))
+
+        for observations in results:
+            assert len(observations) == len(expected)
+            for obs, expected_obs in zip(observations, expected):
+                np.testing.assert_equal(obs, expected_obs)
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Needs glibc")
+class TestNethackSnapshots:
+    @pytest.fixture
+    def game(self):
+        g = nethack.Nethack(observation_keys=("chars", "blstats", "tty_chars"))
+        try:
+            g.set_initial_seeds(core=42, disp=666)
+            g.reset()
+            yield g
+        finally:
+            g.close()
+
+    @staticmethod
+    def play(game, actions):
+        observations = []
+        for action in actions:
+            obs, done = game.step(action)
+            observations.append([o.copy() for o in obs])
+            if done:
+                break
+        return observations
+
+    def test_direct_write_same_as_copy(self):
+        actions = [random.choice(ACTIONS) for _ in range(300)]
+        observations = []
+        for direct_write in (True, False):
+            game = nethack.Nethack(copy=True, direct_write=direct_write)
+            try:
+                game.set_initial_seeds(core=42, disp=666)
+                steps = [game.reset()]
+                snapshot = game.snapshot()
+                for i, action in enumerate(actions):
+                    obs, done = game.step(action)
+                    steps.append(obs)
+                    if done:
+                        break
+                    if i == 100:
+                        steps.append(game.restore(snapshot))
+                observations.append(steps)
+            finally:
+                game.close()
+        np.testing.assert_equal(*observations)
+
+    def test_restore_repeatedly(self, game):
+        self.play(game, [random.choice(ACTIONS) for _ in range(50)])
+        snapshot = game.snapshot()
+        actions = [random.choice(ACTIONS) for _ in range(200)]
+        expected = self.play(game, actions)
+
+        for _ in range(3):
+            game.restore(snapshot)
+            np.testing.assert_equal(self.play(game, actions), expected)
+
+    def test_restore_after_done_and_reset(self, game):
+        (snapshot_obs,) = self.play(game, [ord("l")])
+        snapshot = game.snapshot()
+        actions = [random.choice(ACTIONS) for _ in range(100)]
+        expected = self.play(game, actions)
+
+        done = len(expected) < len(actions)
+        for c in b"#quit\ry":
+            if not done:
+                _, done = game.step(c)
+        while not done:
+            _, done = game.step(13)
+
+        np.testing.assert_equal(list(game.restore(snapshot)), snapshot_obs)
+        np.testing.assert_equal(self.play(game, actions), expected)
+
+        game.reset()
+        game.restore(snapshot)
+        np.testing.assert_equal(self.play(game, actions), expected)
+
+    def test_snapshot_of_other_game(self, game):
+        other = nethack.Nethack(observation_keys=("chars",))
+        try:
+            other.reset()
+            with pytest.raises(ValueError, match="Snapshot isn't from this game"):
+                game.restore(other.snapshot())
+        finally:
+            other.close()
+
+    def test_snapshot_outlives_game(self):
+        game = nethack.Nethack(observation_keys=("chars",))
+        game.reset()
+        snapshot = game.snapshot()
+        game.close()
+        del snapshot
+
+    def test_fork_startup(self):
+        keys = ("chars", "blstats", "tty_chars")
+        forked = nethack.Nethack(observation_keys=keys, fork_startup=True)
+        plain = nethack.Nethack(observation_keys=keys)
+        try:
+            for episode in range(4):
+                actions = [random.choice(ACTIONS) for _ in range(100)]
+                observations = []
+                for game in (forked, plain):
+                    game.set_initial_seeds(core=episode, disp=2 * episode)
+                    obs = [o.copy() for o in game.reset()]
+                    observations.append([obs] + self.play(game, actions))
+                np.testing.assert_equal(*observations)
+        finally:
+            forked.close()
+            plain.close()
+
+
+class TestNethackStepSequence:
+    @pytest.fixture
+    def games(self):
+        games = [nethack.Nethack(observation_keys=("chars", "blstats")) for _ in "ab"]
+        try:
+            for g in games:
+                g.set_initial_seeds(core=42, disp=666)
+                g.reset()
+            yield games
+        finally:
+            for g in games:
+                g.close()
+
+    def test_same_as_steps(self, games):
+        actions = [random.choice(ACTIONS) for _ in range(300)]
+        for action in actions:
+            expected, done = games[0].step(action)
+            if done:
+                break
+
+        remaining = actions
+        while remaining:
+            obs, done, consumed = games[1].step_sequence(remaining)
+            assert 0 < consumed <= len(remaining)
+            remaining = remaining[consumed:]
+            if done:
+                break
+        np.testing.assert_equal(obs, expected)
+
+    def test_stops_when_done(self, games):
+        game = games[0]
+        actions = [nethack.M("q"), ord("y")] + [ord("\033")] * 100
+        _, done, consumed = game.step_sequence(actions)
+        assert done
+        assert consumed < len(actions)
+
+    def test_no_actions(self, games):
+        with pytest.raises(ValueError, match="No actions given"):
+            games[0].step_sequence([])
+
+
+class TestNethackStepRepeat:
+    @pytest.fixture
+    def games(self):
+        games = [nethack.Nethack(observation_keys=("chars", "blstats")) for _ in "ab"]
+        try:
+            for g in games:
+                g.set_initial_seeds(core=42, disp=666)
+                g.reset()
+                g.set_prompt_policy(more=True)
+                g.step(ord(" "), handle_prompts=True)
+            yield games
+        finally:
+            for g in games:
+                g.close()
+
+    # With seeds 1, 15 and 17, the prompt policy presses a --More-- that came
+    # up in the middle of repeating an action.
+    @pytest.mark.parametrize("seed", [0, 1, 15, 17])
+    def test_same_as_steps(self, games, seed):
+        game, other = games
+        rng = random.Random(seed)
+        score = None
+        for _ in range(50):
+            action = rng.choice(ACTIONS[1:])
+            obs, done, score_delta, repeats = game.step_repeat(
+                action, 4, handle_prompts=True
+            )
+            assert 1 <= repeats <= 4
+            for _ in range(repeats):
+                expected, other_done = other.step(action, handle_prompts=True)
+            np.testing.assert_equal(obs, expected)
+            assert done == other_done
+            if done:
+                break
+
+            _, blstats = obs
+            if score is not None:
+                assert score_delta == blstats[9] - score
+            score = blstats[9]
+
+    def test_more_mid_repeat(self, games):
+        game, other = games
+        rng = random.Random(1)
+        for _ in range(43):  # Where seed 1 of test_same_as_steps gets a --More--.
+            action = rng.choice(ACTIONS[1:])
+            _, _, _, repeats = game.step_repeat(action, 4, handle_prompts=True)
+            for _ in range(repeats):
+                other.step(action, handle_prompts=True)
+
+        action = rng.choice(ACTIONS[1:])
+        obs, _, _, repeats = game.step_repeat(action, 4, handle_prompts=True)
+        for steps in range(1, 5):
+            expected, _ = other.step(action, handle_prompts=True)
+            if all(np.array_equal(o, e) for o, e in zip(obs, expected)):
+                break
+        assert repeats == steps < 4
+
+    def test_repeat_at_least_once(self, games):
+        with pytest.raises(ValueError, match="repeat must be at least 1"):
+            games[0].step_repeat(ord("l"), 0)
+
+
+class TestNethackPromptPolicy:
+    @pytest.fixture
+    def game(self):
+        g = nethack.Nethack(observation_keys=("internal", "program_state"))
+        try:
+            _, program_state = g.reset()
+            while not program_state[3]:  # in_moveloop
+                (_, program_state), _ = g.step(ord(" "))
+            yield g
+        finally:
+            g.close()
+
+    def test_decline_question(self, game):
+        game.set_prompt_policy(yn=True)
+        (internal, _), done = game.step(nethack.M("q"), handle_prompts=True)
+        assert not internal[1]  # in_yn_function
+        assert not done
+
+        (internal, _), done = game.step(nethack.M("q"))
+        assert internal[1]
+
+    def test_question_exceptions(self, game):
+        game.set_prompt_policy(yn=True, yn_exceptions=[b"Really quit?"])
+        (internal, _), done = game.step(nethack.M("q"), handle_prompts=True)
+        assert internal[1]
+
+    @pytest.fixture
+    def wizard(self):
+        g = nethack.Nethack(observation_keys=("internal", "program_state"), wizard=True)
+        try:
+            g.reset()
+            yield g
+        finally:
+            g.close()
+
+    def test_press_more(self, wizard):
+        wizard.set_prompt_policy(more=True)
+        # Answering the start-up question leads to a --More--.
+        (internal, program_state), _ = wizard.step(ord("y"), handle_prompts=True)
+        assert not internal[3]  # xwaitforspace
+        assert program_state[3]  # in_moveloop
+
+    def test_more_without_handle_prompts(self, wizard):
+        wizard.set_prompt_policy(more=True)
+        (internal, program_state), _ = wizard.step(ord("y"))
+        assert internal[3]
+        assert not program_state[3]
+
+    def test_escape_getlin(self, wizard):
+        wizard.set_prompt_policy(more=True, getlin=True)
+        for c in b"y ":
+            wizard.step(c)
+        (internal, _), done = wizard.step(nethack.C("w"), handle_prompts=True)
+        assert not internal[2]  # in_getlin
+        assert not done
+
+        (internal, _), done = wizard.step(nethack.C("w"))
+        assert internal[2]  # "For what do you wish?"
+
+
+class TestBatchedNethack:
+    @pytest.fixture
+    def batch(self):
+        b = nethack.BatchedNethack(3, observation_keys=("chars", "blstats"))
+        try:
+            yield b
+        finally:
+            b.close()
+
+    def test_shapes(self, batch):
+        chars, blstats = batch.reset()
+        assert len(batch) == 3
+        assert chars.shape == (3, 21, 79)
+        assert blstats.shape == (3, 25)
+        (chars, blstats), done = batch.step([ord("y")] * 3)
+        assert done.shape == (3,)
+        assert not done.any()
+
+    def test_same_as_single_games(self, batch):
+        game = nethack.Nethack(observation_keys=("chars", "blstats"))
+        try:
+            game.set_initial_seeds(core=42, disp=666)
+            game.reset()
+            for i in range(len(batch)):
+                batch.set_initial_seeds(i, core=42, disp=666)
+            batch.reset()
+
+            for _ in range(200):
+                ch = random.choice(ACTIONS)
+                (chars, blstats), done = game.step(ch)
+                (bchars, bblstats), bdone = batch.step([ch] * len(batch))
+                for i in range(len(batch)):
+                    np.testing.assert_equal(bchars[i], chars)
+                    assert bdone[i] == done
+                if done:
+                    break
+        finally:
+            game.close()
+
+    def test_set_buffers_strided_rows(self, batch):
+        for i in range(len(batch)):
+            batch.set_initial_seeds(i, core=42, disp=666)
+        batch.reset()
+        actions = [random.choice(ACTIONS) for _ in range(20)]
+
+        expected = []
+        for action in actions:
+            (chars, _), done = batch.step([action] * len(batch))
+            expected.append(chars.copy())
+            if done.any():
+                break
+
+        for i in range(len(batch)):
+            batch.set_initial_seeds(i, core=42, disp=666)
+        batch.reset()
+        storage = np.zeros((len(batch), len(expected), 21, 79), dtype=np.uint8)
+        for t, action in enumerate(actions[: len(expected)]):
+            batch.set_buffers(chars=storage[:, t])
+            (chars, _), _ = batch.step([action] * len(batch))
+            assert np.shares_memory(chars, storage)
+        np.testing.assert_equal(storage.swapaxes(0, 1), expected)
+
+        with pytest.raises(RuntimeError, match="rows aren't C contiguous"):
+            batch.set_buffers(chars=storage[:, 0].swapaxes(1, 2).copy().swapaxes(1, 2))
+        with pytest.raises(ValueError, match="Unknown observation"):
+            batch.set_buffers(glyphs=np.zeros((3, 21, 79), dtype=np.int16))
+
+    def test_crop_radius(self):
+        batch = nethack.BatchedNethack(
+            2, observation_keys=("glyphs_crop", "blstats"), crop_radius=2
+        )
+        try:
+            batch.reset()
+            (crop, _), _ = batch.step([ord("s")] * len(batch))
+            assert crop.shape == (2, 5, 5)
+            # The hero is in the middle.
+            assert all(nethack.glyph_is_monster(int(g)) for g in crop[:, 2, 2])
+            with pytest.raises(RuntimeError, match="wrong shape"):
+                batch.set_buffers(glyphs_crop=np.zeros((2, 9, 9), np.int16))
+        finally:
+            batch.close()
+
+    def test_run_until_done(self, batch):
+        batch.reset()
+        done = np.zeros(len(batch), dtype=bool)
+        while not done.all():
+            _, done = batch.step(np.random.choice(ACTIONS, size=len(batch)))
+        batch.reset(0)
+        np.testing.assert_equal(done, [False, True, True])
+
 
 class TestNetHackFurther:
     def test_run(self):
@@ -198,6 +812,213 @@ class TestNetHackFurther:
             game.reset("")
 
 
+def read_ttyrec_frames(data):
+    frames = []
+    while data:
+        _, _, length, channel = struct.unpack("<iiiB", data[:13])
+        frames.append((channel, data[13 : 13 + length]))
+        data = data[13 + length :]
+    return frames
+
+
+class TestNethackTtyrecCodecs:
+    def play(self, path, **kwargs):
+        game = nethack.Nethack(ttyrec=str(path), **kwargs)
+        try:
+            game.set_initial_seeds(1, 2, False)
+            game.reset()
+            for ch in ACTIONS:
+                game.step(ch)
+        finally:
+            game.close()
+
+    def test_raw(self, tmpdir):
+        path = tmpdir.join("nle.ttyrec")
+        self.play(path, ttyrec_codec="raw")
+        frames = read_ttyrec_frames(path.read_binary())
+        assert [f for c, f in frames if c == 1] == [bytes([ch]) for ch in ACTIONS]
+        assert any(c == 0 and f for c, f in frames)
+
+    @pytest.mark.parametrize("ttyrec_level", [None, 1])
+    def test_bz2(self, tmpdir, ttyrec_level):
+        path = tmpdir.join("nle.ttyrec.bz2")
+        self.play(path, ttyrec_codec="bz2", ttyrec_level=ttyrec_level)
+        with bz2.open(str(path)) as f:
+            frames = read_ttyrec_frames(f.read())
+        assert [f for c, f in frames if c == 1] == [bytes([ch]) for ch in ACTIONS]
+
+    def test_none(self, tmpdir):
+        path = tmpdir.join("nle.ttyrec")
+        self.play(path, ttyrec_codec="none")
+        assert not path.exists()
+
+    def test_zstd(self, tmpdir):
+        path = tmpdir.join("nle.ttyrec.zst")
+        try:
+            self.play(path, ttyrec_codec="zstd", ttyrec_level=3)
+        except RuntimeError:
+            pytest.skip("Built without zstd")
+        zstd = pytest.importorskip("zstandard")
+        with open(str(path), "rb") as f:
+            data = zstd.ZstdDecompressor().stream_reader(f).read()
+        frames = read_ttyrec_frames(data)
+        assert [f for c, f in frames if c == 1] == [bytes([ch]) for ch in ACTIONS]
+
+    @pytest.mark.parametrize("ttyrec_codec", ["bz2", "raw"])
+    def test_async(self, tmpdir, ttyrec_codec):
+        opener = bz2.open if ttyrec_codec == "bz2" else open
+
+        def actions_in(path):
+            with opener(str(path), "rb") as f:
+                frames = read_ttyrec_frames(f.read())
+            return [f for c, f in frames if c == 1]
+
+        paths = [tmpdir.join("nle.%i.ttyrec" % i) for i in range(2)]
+        game = nethack.Nethack(
+            ttyrec=str(paths[0]), ttyrec_codec=ttyrec_codec, ttyrec_async=True
+        )
+        try:
+            game.set_initial_seeds(1, 2, False)
+            game.reset()
+            # Many frames, so that the game hands over some chunks.
+            taken = []
+            for ch in 50 * ACTIONS:
+                _, done = game.step(ch)
+                taken.append(bytes([ch]))
+                if done:
+                    break
+            game.set_initial_seeds(1, 2, False)
+            game.reset(str(paths[1]))
+            game.wait_ttyrec()
+            assert actions_in(paths[0]) == taken
+            for ch in ACTIONS:
+                game.step(ch)
+        finally:
+            game.close()
+        assert actions_in(paths[1]) == [bytes([ch]) for ch in ACTIONS]
+        assert game.ttyrec_frames_dropped() == 0
+
+    def test_async_drop(self, tmpdir):
+        def play(path, **kwargs):
+            game = nethack.Nethack(ttyrec=str(path), ttyrec_codec="raw", **kwargs)
+            try:
+                game.set_initial_seeds(1, 2, False)
+                game.reset()
+                for _ in range(50):
+                    for ch in ACTIONS:
+                        game.step(ch)
+            finally:
+                game.close()
+            return read_ttyrec_frames(path.read_binary()), game
+
+        expected, _ = play(tmpdir.join("sync.ttyrec"))
+        nethack.set_ttyrec_writer(queue_size=1, block=False)
+        try:
+            frames, game = play(tmpdir.join("async.ttyrec"), ttyrec_async=True)
+        finally:
+            nethack.set_ttyrec_writer()
+        # Chunks are whole frames, so what's left is a valid ttyrec.
+        assert len(frames) + game.ttyrec_frames_dropped() == len(expected)
+
+    def test_illegal_codec(self):
+        with pytest.raises(ValueError, match="Unknown ttyrec_codec"):
+            nethack.Nethack(ttyrec_codec="lz4")
+        with pytest.raises(ValueError):
+            nethack.Nethack(ttyrec_codec="bz2", ttyrec_level=10)
+
+    def test_batched(self, tmpdir):
+        ttyrecs = [str(tmpdir.join("nle.%i.ttyrec" % i)) for i in range(2)]
+        batch = nethack.BatchedNethack(2, ttyrecs=ttyrecs, ttyrec_codec="raw")
+        try:
+            batch.reset()
+            batch.step(np.array([ACTIONS[0], ACTIONS[1]]))
+        finally:
+            batch.close()
+        for ttyrec, ch in zip(ttyrecs, ACTIONS):
+            with open(ttyrec, "rb") as f:
+                frames = read_ttyrec_frames(f.read())
+            assert [f for c, f in frames if c == 1] == [bytes([ch])]
+
+
+class TestNethackKeylog:
+    def play(self, path, steps=200, seeds=(1, 2, False)):
+        rng = random.Random(1)
+        game = nethack.Nethack(
+            observation_keys=("glyphs", "blstats"),
+            ttyrec=str(path),
+            ttyrec_codec="keys",
+            copy=True,
+        )
+        game.set_prompt_policy(more=True, getlin=True, yn=True)
+        try:
+            if seeds is not None:
+                game.set_initial_seeds(*seeds)
+            observation = game.reset()
+            for _ in range(steps):
+                observation, done = game.step(rng.choice(ACTIONS), handle_prompts=True)
+                if done:
+                    break
+        finally:
+            game.close()
+        return observation
+
+    def test_replay(self, tmpdir):
+        path = tmpdir.join("nle.keys")
+        expected = self.play(path)
+        header, keys = nethack.read_keylog(str(path))
+        assert header["seeds"] == [1, 2, False]
+        assert header["options"] == list(nethack.NETHACKOPTIONS)
+        assert header["wizard"] is False
+        assert len(keys) >= 200  # Plus prompts the policy answered.
+
+        observations = list(replay_keys.replay(str(path), ("glyphs", "blstats")))
+        assert len(observations) == len(keys) + 1
+        np.testing.assert_equal(observations[-1], expected)
+
+    def test_random_seeds(self, tmpdir):
+        path = tmpdir.join("nle.keys")
+        expected = self.play(path, steps=50, seeds=None)
+        header, _ = nethack.read_keylog(str(path))
+        assert header["seeds"][2] is False
+        *_, observation = replay_keys.replay(str(path), ("glyphs", "blstats"))
+        np.testing.assert_equal(observation, expected)
+
+    def test_replay_ttyrec(self, tmpdir):
+        path = tmpdir.join("nle.keys")
+        self.play(path, steps=50)
+        _, keys = nethack.read_keylog(str(path))
+        ttyrec = tmpdir.join("nle.ttyrec")
+        for _ in replay_keys.replay(str(path), ttyrec=str(ttyrec)):
+            pass
+        frames = read_ttyrec_frames(ttyrec.read_binary())
+        assert b"".join(f for c, f in frames if c == 1) == keys
+
+    def test_one_episode_per_log(self, tmpdir):
+        game = nethack.Nethack(
+            ttyrec=str(tmpdir.join("nle.0.keys")), ttyrec_codec="keys"
+        )
+        try:
+            game.reset()
+            with pytest.raises(ValueError, match="one episode"):
+                game.reset()
+            game.reset(str(tmpdir.join("nle.1.keys")))
+            game.step(ACTIONS[0])
+        finally:
+            game.close()
+        _, keys = nethack.read_keylog(str(tmpdir.join("nle.1.keys")))
+        assert keys == bytes([ACTIONS[0]])
+
+    def test_not_a_keylog(self, tmpdir):
+        path = tmpdir.join("nle.ttyrec")
+        path.write_binary(b"\0" * 16)
+        with pytest.raises(ValueError, match="not a keys log"):
+            nethack.read_keylog(str(path))
+
+    def test_batched(self):
+        with pytest.raises(ValueError, match="keys logs"):
+            nethack.BatchedNethack(2, ttyrec_codec="keys")
+
+
 class TestNethackSomeObs:
     @pytest.fixture
     def game(self):  # Make sure we close even on test failure.
@@ -333,6 +1154,52 @@ class TestNethackFunctionsAndConstants:
         assert nethack.objdescr.from_idx(idx) is od
 
 
+class TestNethackChanges:
+    KEYS = ("glyphs", "chars", "colors", "blstats", "message", "tty_chars")
+
+    @pytest.fixture
+    def game(self):
+        g = nethack.Nethack(
+            observation_keys=self.KEYS + ("changed_keys", "dirty_cells")
+        )
+        try:
+            yield g
+        finally:
+            g.close()
+
+    def test_changes_are_reported(self, game):
+        *obs, changed_keys, dirty_cells = game.reset()
+        assert changed_keys[0] == (1 << len(nethack.CHANGED_KEYS)) - 1
+        assert dirty_cells[0] == nethack.NLE_ALL_CELLS_DIRTY
+
+        for _ in range(300):
+            last = [o.copy() for o in obs]
+            (*obs, changed_keys, dirty_cells), done = game.step(random.choice(ACTIONS))
+            if done:
+                *obs, changed_keys, dirty_cells = game.reset()
+
+            for key, o, last_o in zip(self.KEYS, obs, last):
+                bit = 1 << nethack.CHANGED_KEYS.index(key)
+                if (o != last_o).any():
+                    assert changed_keys[0] & bit, key
+
+            if dirty_cells[0] == nethack.NLE_ALL_CELLS_DIRTY:
+                continue
+            dirty = set(dirty_cells[dirty_cells >= 0])
+            assert len(dirty) == (dirty_cells >= 0).sum()
+            for o, last_o in zip(obs[:3], last[:3]):
+                assert set(np.flatnonzero(o != last_o)) <= dirty
+
+    def test_no_changes_without_time_passing(self, game):
+        game.reset()
+        game.step(27)
+        obs, _ = game.step(27)  # Escaping at the command prompt does nothing.
+        changed_keys = obs[-2][0]
+        for key in ("glyphs", "chars", "colors", "blstats"):
+            assert not changed_keys & (1 << nethack.CHANGED_KEYS.index(key))
+        assert (obs[-1] == -1).all()
+
+
 class TestNethackGlanceObservation:
     @pytest.fixture
     def game(self):  # Make sure we close even on test failure.
@@ -390,6 +1257,48 @@ class TestNethackGlanceObservation:
                         elif glyph == 2372:
                             assert glance == "open door"
 
+    def test_descriptions_follow_glyphs(self, game):
+        game.reset()
+
+        glyph_buff = game._obs_buffers["glyphs"]
+        char_buff = game._obs_buffers["chars"]
+        desc_buff = game._obs_buffers["screen_descriptions"]
+
+        floor = nethack.GLYPH_CMAP_OFF + 19  # S_room.
+        for _ in range(300):
+            _, done = game.step(random.choice(ACTIONS))
+            if done:
+                game.reset()
+
+            # Descriptions are only computed when observed; none may be
+            # left over from glyphs that are no longer on the map.
+            assert (desc_buff[char_buff == ord(" ")] == 0).all()
+            for desc in desc_buff[glyph_buff == floor]:
+                assert "".join(chr(c) for c in desc if c) == "floor of a room"
+
+    def test_string_ids(self, game):
+        game.reset()
+
+        desc_buff = game._obs_buffers["screen_descriptions"]
+        desc_ids = game._obs_buffers["screen_description_ids"]
+        inv_buff = game._obs_buffers["inv_strs"]
+        inv_ids = game._obs_buffers["inv_str_ids"]
+
+        table = []
+        for _ in range(100):
+            game.step(random.choice(ACTIONS))
+            table.extend(game.string_table())
+
+            assert table[0] == b""
+            for desc, i in zip(
+                desc_buff.reshape(-1, desc_buff.shape[-1]), desc_ids.flat
+            ):
+                assert table[i] == desc.tobytes().rstrip(b"\0")
+            for inv_str, i in zip(inv_buff, inv_ids):
+                assert table[i] == inv_str.tobytes().rstrip(b"\0")
+        assert inv_ids[0] > 0
+        assert game.string_table() == []
+
 
 class TestNethackTerminalObservation:
     @pytest.fixture
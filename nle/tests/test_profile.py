@@ -59,3 +59,47 @@ class TestProfile:
                     env.reset()
 
         benchmark.pedantic(play_1k_steps, setup=seed, rounds=100, warmup_rounds=10)
+
+    @pytest.mark.benchmark(disable_gc=True, warmup=False)
+    def test_reset(self, observation_keys, make_cwd_tmp, benchmark):
+        env = gym.make("NetHackStaircase-v0", observation_keys=observation_keys)
+        try:
+            env.reset()
+            benchmark.pedantic(env.reset, rounds=100, warmup_rounds=10)
+        finally:
+            env.close()
+
+
+@pytest.mark.parametrize("ttyrec_async", [False, True], ids=["sync", "async"])
+@pytest.mark.parametrize("ttyrec_codec", ["bz2", "raw", "none"])
+class TestProfileTtyrecCodecs:
+    @pytest.yield_fixture(autouse=True)  # will be applied to all tests in class
+    def make_cwd_tmp(self, tmpdir):
+        """Makes cwd point to the test's tmpdir."""
+        with tmpdir.as_cwd():
+            yield
+
+    @pytest.mark.benchmark(disable_gc=True, warmup=False)
+    def test_run_1k_steps(self, ttyrec_codec, ttyrec_async, make_cwd_tmp, benchmark):
+        env = gym.make(
+            "NetHack-v0",
+            observation_keys=BASE_KEYS,
+            ttyrec_codec=ttyrec_codec,
+            ttyrec_async=ttyrec_async,
+        )
+        steps = 1000
+
+        np.random.seed(123456)
+        actions = np.random.choice(len(env._actions), size=steps)
+
+        def play_1k_steps():
+            env.reset()
+            for a in actions:
+                _, _, done, _ = env.step(a)
+                if done:
+                    env.reset()
+
+        try:
+            benchmark.pedantic(play_1k_steps, rounds=20, warmup_rounds=2)
+        finally:
+            env.close()
@@ -0,0 +1,94 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+import random
+
+import numpy as np
+import pytest
+
+from nle import nethack
+from nle import replay
+
+
+ACTIONS = [ord(c) for c in "hjklyubn.s"]
+
+
+def record(path, seeds, steps):
+    """Plays an episode into a keys log, returns its glyphs and checksums."""
+    rng = random.Random(seeds[0])
+    game = nethack.Nethack(
+        observation_keys=("glyphs",), ttyrec=str(path), ttyrec_codec="keys"
+    )
+    try:
+        game.set_initial_seeds(*seeds)
+        (glyphs,) = game.reset()
+        observations = [glyphs.copy()]
+        for _ in range(steps):
+            (glyphs,), done = game.step(rng.choice(ACTIONS))
+            observations.append(glyphs.copy())
+            if done:
+                break
+    finally:
+        game.close()
+    return observations, [replay.checksum(glyphs) for glyphs in observations]
+
+
+class TestReplay:
+    @pytest.fixture
+    def episodes(self, tmpdir):
+        return [
+            (str(tmpdir.join("nle.%i.keys" % i)),)
+            + record(tmpdir.join("nle.%i.keys" % i), (i + 1, i + 2, False), steps)
+            for i, steps in enumerate([30, 50, 20])
+        ]
+
+    def test_replay(self, tmpdir, episodes):
+        outputs = replay.replay(
+            [path for path, _, _ in episodes],
+            str(tmpdir.join("out")),
+            observation_keys=("glyphs", "blstats"),
+            checksums=[checksums for _, _, checksums in episodes],
+            processes=2,
+        )
+        lengths = [len(observations) for _, observations, _ in episodes]
+        assert outputs["glyphs"].shape == (sum(lengths),) + nethack.DUNGEON_SHAPE
+        assert outputs["blstats"].shape == (sum(lengths),) + nethack.BLSTATS_SHAPE
+        np.testing.assert_equal(outputs["episode_id"], np.repeat(np.arange(3), lengths))
+        np.testing.assert_equal(
+            outputs["t"], np.concatenate([np.arange(n) for n in lengths])
+        )
+        np.testing.assert_equal(
+            outputs["glyphs"],
+            np.concatenate([observations for _, observations, _ in episodes]),
+        )
+        np.testing.assert_equal(
+            outputs["checksum"],
+            np.concatenate([checksums for _, _, checksums in episodes]),
+        )
+
+    def test_seeds_and_keys(self, tmpdir, episodes):
+        path, observations, checksums = episodes[0]
+        header, keys = nethack.read_keylog(path)
+        outputs = replay.replay(
+            [(header["seeds"], keys)],
+            str(tmpdir.join("out")),
+            observation_profile="compact",
+            checksums=[checksums],
+        )
+        assert outputs["glyphs"].dtype == np.uint16
+        np.testing.assert_equal(outputs["glyphs"], observations)
+
+    def test_diverged(self, tmpdir, episodes):
+        checksums = [None, list(episodes[1][2]), None]
+        checksums[1][10] += 1
+        with pytest.raises(RuntimeError, match="1 at step 10"):
+            replay.replay(
+                [path for path, _, _ in episodes],
+                str(tmpdir.join("out")),
+                checksums=checksums,
+            )
+
+    def test_illegal_arguments(self, tmpdir, episodes):
+        paths = [path for path, _, _ in episodes]
+        with pytest.raises(ValueError, match="Unknown observation"):
+            replay.replay(paths, str(tmpdir.join("out")), observation_keys=("foo",))
+        with pytest.raises(ValueError, match="Need checksums"):
+            replay.replay(paths, str(tmpdir.join("out")), checksums=[None])
@@ -85,6 +85,7 @@ entry_points = {
         "nle-play = nle.scripts.play:main",
         "nle-ttyrec = nle.scripts.ttyrec:main",
         "nle-ttyplay = nle.scripts.ttyplay:main",
+        "nle-replay-keys = nle.scripts.replay_keys:main",
     ]
 }
 
@@ -65,7 +65,6 @@ extern FILE *FDECL(fopen_datafile, (const char *, const char *, int));
  * into text and binary parts, where the text version could be shared.
  */
 
-#define MAX_LIBS 4
 static library dlb_libs[MAX_LIBS];
 
 STATIC_DCL boolean FDECL(readlibdir, (library * lp));
@@ -482,6 +481,55 @@ dlb_cleanup()
     }
 }
 
+/*
+ * NLE: Restoring a snapshot (see nle_restore in nle.c) overwrites dlb_libs
+ * with its state from back then, when other library files may have been
+ * open. Take the files that are open now before that and give them to the
+ * restored state afterwards, which opens or closes files as needed.
+ */
+void
+dlb_take_files(files)
+FILE **files;
+{
+    int i;
+
+    for (i = 0; i < MAX_LIBS; i++) {
+#ifdef DLBLIB
+        files[i] = dlb_libs[i].fdata;
+        dlb_libs[i].fdata = (FILE *) 0;
+#else
+        files[i] = (FILE *) 0;
+#endif
+    }
+}
+
+void
+dlb_give_files(files)
+FILE **files;
+{
+    int i;
+
+    for (i = 0; i < MAX_LIBS; i++) {
+#ifdef DLBLIB
+        library *lp = &dlb_libs[i];
+
+        if (lp->fdata) {
+            if (!files[i] && i == 0)
+                files[i] = fopen_datafile(DLBFILE, RDBMODE, DATAPREFIX);
+#ifdef DLBFILE2
+            if (!files[i] && i == 1)
+                files[i] = fopen_datafile(DLBFILE2, RDBMODE, DATAPREFIX);
+#endif
+            lp->fdata = files[i];
+            lp->fmark = -1L; /* unknown, lib_dlb_fread() will seek */
+            files[i] = (FILE *) 0;
+        }
+#endif
+        if (files[i])
+            (void) fclose(files[i]);
+    }
+}
+
 dlb *
 dlb_fopen(name, mode)
 const char *name, *mode;
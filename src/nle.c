@@ -1,8 +1,25 @@
 
+#ifndef _GNU_SOURCE
+#define _GNU_SOURCE /* For memfd_create. */
+#endif
+
 #include <assert.h>
 #include <string.h>
 #include <sys/time.h>
 
+#ifdef __linux__
+#include <link.h>
+#endif
+
+#ifdef __GLIBC__
+#if __GLIBC_PREREQ(2, 27) /* For memfd_create. */
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#define NLE_ARENA
+#endif
+#endif
+
 #include <tmt.h>
 
 #define NEED_VARARGS
@@ -15,11 +32,13 @@
 
 #include "nle.h"
 
-#ifdef NLE_BZ2_TTYRECS
 #include <bzlib.h>
+#ifdef NLE_ZSTD_TTYRECS
+#include <zstd.h>
 #endif
 
 #define STACK_SIZE (1 << 15) // 32KiB
+#define TTYREC_BUF_SIZE (1 << 16)
 
 #ifndef __has_feature
 #define __has_feature(x) 0 // Compatibility with non-clang compilers.
@@ -31,6 +50,149 @@
 
 extern int unixmain(int, char **);
 
+int nle_fflush(FILE *);
+
+/* See winrl.cc. */
+extern void rl_free_nhwindows(void);
+extern void *rl_snapshot_nhwindows(void);
+extern void *rl_release_nhwindows(void);
+extern void rl_restore_nhwindows(void *, const void *);
+extern void rl_free_nhwindows_snapshot(void *);
+
+#ifdef NLE_ARENA
+/*
+ * The game's heap. This library's calls to malloc etc. end up here instead
+ * of in libc (the definitions are hidden, other libraries aren't affected).
+ * While the game runs, allocations come from nle->arena, a reserved range
+ * of address space that nle_snapshot copies and nle_restore maps back in.
+ * Freeing goes to wherever the memory came from.
+ */
+#define ARENA_RESERVE ((size_t) 1 << 30) /* Address space, not memory. */
+#define ARENA_HEADER 16                  /* Keeps malloc's alignment. */
+
+extern void *__libc_malloc(size_t);
+extern void *__libc_calloc(size_t, size_t);
+extern void *__libc_realloc(void *, size_t);
+extern void __libc_free(void *);
+
+static size_t
+arena_class_size(int c)
+{
+    return c < 16 ? (size_t) (c + 1) * 16 : (size_t) 256 << (c - 15);
+}
+
+static int
+arena_class(size_t size)
+{
+    int c = 16;
+
+    if (size <= 256)
+        return size ? (int) ((size - 1) / 16) : 0;
+    while (c < NLE_ARENA_CLASSES && arena_class_size(c) < size)
+        ++c;
+    return c;
+}
+
+static nle_arena_t *
+arena_of(void *ptr)
+{
+    nle_ctx_t *nle = current_nle_ctx;
+    if (nle && nle->arena.base <= (char *) ptr
+        && (char *) ptr < nle->arena.end)
+        return &nle->arena;
+    return NULL;
+}
+
+static void *
+arena_alloc(nle_arena_t *arena, size_t size)
+{
+    int c = arena_class(size);
+    char *block;
+
+    if (c >= NLE_ARENA_CLASSES)
+        return NULL;
+    if (arena->free_lists[c]) {
+        block = arena->free_lists[c];
+        arena->free_lists[c] = *(void **) block;
+        return block;
+    }
+    if ((size_t) (arena->end - arena->top)
+        < ARENA_HEADER + arena_class_size(c))
+        return NULL;
+    *(size_t *) arena->top = c;
+    block = arena->top + ARENA_HEADER;
+    arena->top = block + arena_class_size(c);
+    return block;
+}
+
+static void
+arena_free(nle_arena_t *arena, void *ptr)
+{
+    size_t c = *(size_t *) ((char *) ptr - ARENA_HEADER);
+    *(void **) ptr = arena->free_lists[c];
+    arena->free_lists[c] = ptr;
+}
+
+__attribute__((visibility("hidden"))) void *
+malloc(size_t size)
+{
+    nle_ctx_t *nle = current_nle_ctx;
+    if (nle && nle->arena.active)
+        return arena_alloc(&nle->arena, size);
+    return __libc_malloc(size);
+}
+
+__attribute__((visibility("hidden"))) void *
+calloc(size_t n, size_t size)
+{
+    nle_ctx_t *nle = current_nle_ctx;
+    if (nle && nle->arena.active) {
+        if (size && n > (size_t) -1 / size)
+            return NULL;
+        void *ptr = arena_alloc(&nle->arena, n * size);
+        if (ptr)
+            memset(ptr, 0, n * size);
+        return ptr;
+    }
+    return __libc_calloc(n, size);
+}
+
+__attribute__((visibility("hidden"))) void *
+realloc(void *ptr, size_t size)
+{
+    nle_arena_t *arena = arena_of(ptr);
+    if (!ptr)
+        return malloc(size);
+    if (!arena)
+        return __libc_realloc(ptr, size);
+    if (!size) {
+        arena_free(arena, ptr);
+        return NULL;
+    }
+
+    size_t old_size =
+        arena_class_size(*(size_t *) ((char *) ptr - ARENA_HEADER));
+    if (size <= old_size)
+        return ptr;
+    void *new_ptr = arena_alloc(arena, size);
+    if (new_ptr) {
+        memcpy(new_ptr, ptr, old_size);
+        arena_free(arena, ptr);
+    }
+    return new_ptr;
+}
+
+__attribute__((visibility("hidden"))) void
+free(void *ptr)
+{
+    nle_arena_t *arena = arena_of(ptr);
+    if (arena)
+        arena_free(arena, ptr);
+    else
+        __libc_free(ptr);
+}
+#endif /* NLE_ARENA */
+
 signed char
 vt_char_color_extract(TMTCHAR *c)
 {
@@ -103,6 +265,8 @@ nle_vt_callback(tmt_msg_t m, TMT *vt, const void *a, void *p)
                     size_t offset = (r * NLE_TERM_CO) + c;
                     TMTCHAR *tmt_c = &(s->lines[r]->chars[c]);
 
+                    nle->tty_changed |=
+                        NLE_CHANGED_TTY_CHARS | NLE_CHANGED_TTY_COLORS;
                     if (nle->observation->tty_chars) {
                         nle->observation->tty_chars[offset] = tmt_c->c;
                     }
@@ -121,6 +285,7 @@ nle_vt_callback(tmt_msg_t m, TMT *vt, const void *a, void *p)
         break;
 
     case TMT_MSG_MOVED:
+        nle->tty_changed |= NLE_CHANGED_TTY_CURSOR;
         if (nle->observation->tty_cursor) {
             // cast from size_t is safe from overflow, since r,c < 256
             nle->observation->tty_cursor[0] = (unsigned char) cur->r;
@@ -133,25 +298,333 @@ nle_vt_callback(tmt_msg_t m, TMT *vt, const void *a, void *p)
     }
 }
 
-nle_ctx_t *
-init_nle(FILE *ttyrec, nle_obs *obs)
+/* Marks the whole terminal as changed to update the observation. */
+static void
+refresh_terminal(nle_ctx_t *nle)
 {
-    nle_ctx_t *nle = malloc(sizeof(nle_ctx_t));
+    const TMTSCREEN *s = tmt_screen(nle->vterminal);
+    for (size_t r = 0; r < s->nline; r++)
+        s->lines[r]->dirty = true;
+    nle_vt_callback(TMT_MSG_UPDATE, nle->vterminal, NULL, nle);
+    nle_vt_callback(TMT_MSG_MOVED, nle->vterminal, NULL, nle);
+}
+
+/*
+ * A ttyrec being written. Not part of nle_ctx_t, as with a ttyrec_writer,
+ * the game may already write the next one when this one gets finished.
+ */
+struct nle_ttyrec {
+    FILE *file;
+    char codec;
+    void *bz2;
+    void *zstd; /* ZSTD_CCtx *. */
+};
+
+#ifdef NLE_ZSTD_TTYRECS
+/* Outside of the game only: zstd needs more stack than the game's. */
+static void
+compress_ttyrec_zstd(struct nle_ttyrec *ttyrec, const char *data,
+                     size_t size, ZSTD_EndDirective mode)
+{
+    char out[1 << 14];
+    ZSTD_inBuffer input = { data, size, 0 };
+    boolean finished;
+    do {
+        ZSTD_outBuffer output = { out, sizeof(out), 0 };
+        size_t remaining =
+            ZSTD_compressStream2(ttyrec->zstd, &output, &input, mode);
+        assert(!ZSTD_isError(remaining));
+        fwrite(out, 1, output.pos, ttyrec->file);
+        finished = mode == ZSTD_e_end ? remaining == 0
+                                      : input.pos == input.size;
+    } while (!finished);
+}
+#endif
+
+/* Compresses data with the ttyrec's codec and writes it. */
+static void
+write_ttyrec(struct nle_ttyrec *ttyrec, const char *data, size_t size)
+{
+    switch (ttyrec->codec) {
+    case NLE_TTYREC_BZ2: {
+        int bzerror;
+        BZ2_bzWrite(&bzerror, ttyrec->bz2, (void *) data, size);
+        assert(bzerror == BZ_OK);
+        break;
+    }
+    case NLE_TTYREC_RAW:
+    case NLE_TTYREC_KEYS: {
+        size_t written = fwrite(data, 1, size, ttyrec->file);
+        assert(written == size);
+        break;
+    }
+#ifdef NLE_ZSTD_TTYRECS
+    case NLE_TTYREC_ZSTD:
+        compress_ttyrec_zstd(ttyrec, data, size, ZSTD_e_continue);
+        break;
+#endif
+    }
+}
+
+/* Ends the compressed stream, flushes the file and frees ttyrec. */
+static void
+finish_ttyrec(struct nle_ttyrec *ttyrec)
+{
+    switch (ttyrec->codec) {
+    case NLE_TTYREC_BZ2: {
+        int bzerror;
+        BZ2_bzWriteClose(&bzerror, ttyrec->bz2, 0, NULL, NULL);
+        assert(bzerror == BZ_OK);
+        break;
+    }
+#ifdef NLE_ZSTD_TTYRECS
+    case NLE_TTYREC_ZSTD:
+        compress_ttyrec_zstd(ttyrec, NULL, 0, ZSTD_e_end);
+        ZSTD_freeCCtx(ttyrec->zstd);
+        break;
+#endif
+    }
+    fflush(ttyrec->file);
+    free(ttyrec);
+}
 
+/* See nle_ttyrec_chunk. */
+static void
+write_ttyrec_chunk(nle_ttyrec_chunk *chunk)
+{
+    write_ttyrec(chunk->ttyrec, chunk->data, chunk->size);
+    if (chunk->last)
+        finish_ttyrec(chunk->ttyrec);
+    free(chunk->data);
+    free(chunk);
+}
+
+/* Hands ttyrec_buf to ttyrec_writer, or writes it out here. With last, the
+ * ttyrec gets finished as well. Outside of the game only, which would
+ * allocate in its arena. */
+static void
+flush_ttyrec_buf(nle_ctx_t *nle, boolean last)
+{
+    if (nle->ttyrec_writer) {
+        nle_ttyrec_chunk *chunk = malloc(sizeof(nle_ttyrec_chunk));
+        assert(chunk);
+        chunk->frames = nle->ttyrec_buf_frames;
+        chunk->last = last;
+        chunk->write = write_ttyrec_chunk;
+        chunk->ttyrec = nle->ttyrec_out;
+        chunk->data = nle->ttyrec_buf;
+        chunk->size = nle->ttyrec_buf_size;
+        if (nle->ttyrec_writer(nle->ttyrec_writer_arg, chunk)) {
+            nle->ttyrec_buf_capacity = TTYREC_BUF_SIZE;
+            nle->ttyrec_buf = last ? NULL : malloc(nle->ttyrec_buf_capacity);
+            assert(last || nle->ttyrec_buf);
+        } else {
+            assert(!last);
+            free(chunk);
+        }
+    } else {
+        write_ttyrec(nle->ttyrec_out, nle->ttyrec_buf, nle->ttyrec_buf_size);
+        if (last) {
+            finish_ttyrec(nle->ttyrec_out);
+            free(nle->ttyrec_buf);
+            nle->ttyrec_buf = NULL;
+        }
+    }
+    if (last)
+        nle->ttyrec_out = NULL;
+    nle->ttyrec_buf_size = 0;
+    nle->ttyrec_buf_frames = 0;
+}
+
+void
+open_ttyrec(nle_ctx_t *nle, FILE *ttyrec, const nle_obs *obs)
+{
     assert(ttyrec != NULL);
     nle->ttyrec = ttyrec;
+    nle->ttyrec_codec = obs->ttyrec_codec;
+    nle->ttyrec_writer = obs->ttyrec_writer;
+    nle->ttyrec_writer_arg = obs->ttyrec_writer_arg;
+    nle->ttyrec_out = NULL;
+    nle->ttyrec_buf = NULL;
+    nle->ttyrec_buf_size = 0;
+    nle->ttyrec_buf_frames = 0;
+    if (nle->ttyrec_codec == NLE_TTYREC_NONE)
+        return;
 
-#ifdef NLE_BZ2_TTYRECS
-    int bzerror;
-    nle->ttyrec_bz2 = BZ2_bzWriteOpen(&bzerror, ttyrec, 9, 0, 0);
-    assert(bzerror == BZ_OK);
+    /* Not in the game, which would allocate in its arena. */
+    struct nle_ttyrec *out = calloc(1, sizeof(struct nle_ttyrec));
+    assert(out);
+    out->file = ttyrec;
+    out->codec = nle->ttyrec_codec;
+    switch (out->codec) {
+    case NLE_TTYREC_BZ2: {
+        int bzerror;
+        out->bz2 = BZ2_bzWriteOpen(
+            &bzerror, ttyrec, obs->ttyrec_level ? obs->ttyrec_level : 9, 0,
+            0);
+        assert(bzerror == BZ_OK);
+        break;
+    }
+#ifdef NLE_ZSTD_TTYRECS
+    case NLE_TTYREC_ZSTD:
+        out->zstd = ZSTD_createCCtx();
+        assert(out->zstd);
+        ZSTD_CCtx_setParameter(out->zstd, ZSTD_c_compressionLevel,
+                               obs->ttyrec_level);
+        break;
 #endif
+    }
+    nle->ttyrec_out = out;
+    nle->ttyrec_buf_capacity = TTYREC_BUF_SIZE;
+    nle->ttyrec_buf = malloc(nle->ttyrec_buf_capacity);
+    assert(nle->ttyrec_buf);
+}
 
-    nle->observation = obs;
+/* With a ttyrec_writer, the ttyrec may only be finished later unless
+ * wait. */
+void
+close_ttyrec(nle_ctx_t *nle, boolean wait)
+{
+    nle_fflush(stdout);
+    if (nle->ttyrec_codec == NLE_TTYREC_NONE)
+        return;
+
+    flush_ttyrec_buf(nle, TRUE);
+    if (wait && nle->ttyrec_writer)
+        nle->ttyrec_writer(nle->ttyrec_writer_arg, NULL);
+}
+
+#ifdef __linux__
+/*
+ * dl_iterate_phdr callback that records the writable parts of this
+ * library's memory (.data, .bss, .got.plt, ...). RELRO is skipped: It's
+ * read-only after relocation and stays valid as long as the library is
+ * loaded.
+ */
+static int
+find_segments(struct dl_phdr_info *info, size_t size, void *data)
+{
+    nle_ctx_t *nle = (nle_ctx_t *) data;
+    char *self = (char *) &find_segments;
+    char *relro_start = NULL, *relro_end = NULL;
+    boolean found = FALSE;
+
+    for (int i = 0; i < info->dlpi_phnum; ++i) {
+        const ElfW(Phdr) *phdr = &info->dlpi_phdr[i];
+        char *start = (char *) info->dlpi_addr + phdr->p_vaddr;
+        if (phdr->p_type == PT_LOAD && start <= self
+            && self < start + phdr->p_memsz) {
+            found = TRUE;
+        } else if (phdr->p_type == PT_GNU_RELRO) {
+            relro_start = start;
+            relro_end = start + phdr->p_memsz;
+        }
+    }
+    if (!found)
+        return 0; /* Some other library. */
+
+    for (int i = 0; i < info->dlpi_phnum; ++i) {
+        const ElfW(Phdr) *phdr = &info->dlpi_phdr[i];
+        if (phdr->p_type != PT_LOAD || !(phdr->p_flags & PF_W))
+            continue;
+
+        char *start = (char *) info->dlpi_addr + phdr->p_vaddr;
+        char *end = start + phdr->p_memsz;
+        /* The parts before and after RELRO. */
+        char *pieces[2][2] = { { start, end }, { end, end } };
+        if (relro_start < end && start < relro_end) {
+            pieces[0][1] = relro_start > start ? relro_start : start;
+            pieces[1][0] = relro_end < end ? relro_end : end;
+        }
+
+        for (int j = 0; j < 2; ++j) {
+            if (pieces[j][0] >= pieces[j][1])
+                continue;
+            if (nle->num_segments == NLE_MAX_SEGMENTS) {
+                nle->num_segments = 0; /* Unexpected layout, give up. */
+                return 1;
+            }
+            nle_segment_t *segment = &nle->segments[nle->num_segments++];
+            segment->start = pieces[j][0];
+            segment->size = pieces[j][1] - pieces[j][0];
+        }
+    }
+    return 1;
+}
+#endif
+
+/*
+ * Takes a copy of this library's writable memory, which nle_reset restores
+ * to start a new game without reloading the library. Needs to happen
+ * before the first game starts.
+ */
+void
+snapshot_segments(nle_ctx_t *nle)
+{
+    nle->num_segments = 0;
+#ifdef __linux__
+    dl_iterate_phdr(find_segments, nle);
+#endif
+    for (int i = 0; i < nle->num_segments; ++i) {
+        nle_segment_t *segment = &nle->segments[i];
+        segment->pristine = malloc(segment->size);
+        memcpy(segment->pristine, segment->start, segment->size);
+    }
+}
+
+/* Reserves the address space for the game's heap. See malloc above. */
+void
+create_arena(nle_ctx_t *nle)
+{
+    memset(&nle->arena, 0, sizeof(nle->arena));
+#ifdef NLE_ARENA
+    if (!nle->num_segments)
+        return; /* Snapshots need those as well. */
+
+    char *base = mmap(NULL, ARENA_RESERVE, PROT_READ | PROT_WRITE,
+                      MAP_PRIVATE | MAP_ANONYMOUS | MAP_NORESERVE, -1, 0);
+    if (base == MAP_FAILED)
+        return;
+    nle->arena.base = nle->arena.top = base;
+    nle->arena.end = base + ARENA_RESERVE;
+#endif
+}
 
+/* Forgets everything allocated in the arena. */
+void
+reset_arena(nle_ctx_t *nle)
+{
+    nle->arena.top = nle->arena.base;
+    memset(nle->arena.free_lists, 0, sizeof(nle->arena.free_lists));
+}
+
+/* The terminal is part of the game's state, so it lives in the arena. */
+void
+open_terminal(nle_ctx_t *nle)
+{
+    nle->arena.active = nle->arena.base != NULL;
     TMT *vterminal = tmt_open(LI, CO, nle_vt_callback, nle, NULL);
+    nle->arena.active = FALSE;
     assert(!vterminal);
     nle->vterminal = vterminal;
+}
+
+nle_ctx_t *
+init_nle(FILE *ttyrec, nle_obs *obs)
+{
+    nle_ctx_t *nle = malloc(sizeof(nle_ctx_t));
+
+    snapshot_segments(nle);
+    create_arena(nle);
+    nle->fork_startup = FALSE;
+    nle->startup = NULL;
+    nle->tty_changed = NLE_CHANGED_ALL;
+    open_ttyrec(nle, ttyrec, obs);
+
+    nle->observation = obs;
+
+    current_nle_ctx = nle;
+    open_terminal(nle);
 
     nle->outbuf_write_ptr = nle->outbuf;
     nle->outbuf_write_end = nle->outbuf + sizeof(nle->outbuf);
@@ -185,19 +658,28 @@ boolean
 write_data(void *buf, int length)
 {
     nle_ctx_t *nle = current_nle_ctx;
-#ifdef NLE_BZ2_TTYRECS
-    int bzerror;
-    BZ2_bzWrite(&bzerror, nle->ttyrec_bz2, buf, length);
-    assert(bzerror == BZ_OK);
-#else
-    assert(fwrite(buf, 1, length, nle->ttyrec) == length);
-#endif
+    if (nle->ttyrec_codec == NLE_TTYREC_NONE)
+        return TRUE;
+
+    /* Compressed and written out in run_game, where there's more stack,
+     * and in batches: stdio calls from the game are slow. */
+    if (nle->ttyrec_buf_size + length > nle->ttyrec_buf_capacity) {
+        nle->ttyrec_buf_capacity = 2 * (nle->ttyrec_buf_size + length);
+        /* Not in the arena, as ttyrec_buf isn't. */
+        nle->ttyrec_buf = realloc(nle->ttyrec_buf, nle->ttyrec_buf_capacity);
+        assert(nle->ttyrec_buf);
+    }
+    memcpy(nle->ttyrec_buf + nle->ttyrec_buf_size, buf, length);
+    nle->ttyrec_buf_size += length;
     return TRUE;
 }
 
 boolean
 write_header(int length, unsigned char channel)
 {
+    if (current_nle_ctx->ttyrec_codec == NLE_TTYREC_NONE)
+        return TRUE;
+
     struct timeval tv;
     gettimeofday(&tv, NULL);
 
@@ -209,6 +691,7 @@ write_header(int length, unsigned char channel)
     /* Assumes little endianness */
     write_data(buffer, 3 * sizeof(int));
     write_data(&channel, 1);
+    current_nle_ctx->ttyrec_buf_frames++;
 
     return TRUE;
 }
@@ -230,20 +713,17 @@ nle_fflush(FILE *stream)
     if (length == 0)
         return 0;
 
-    write_header(length, 0);
-    write_data(nle->outbuf, length);
+    if (nle->ttyrec_codec != NLE_TTYREC_KEYS) {
+        write_header(length, 0);
+        write_data(nle->outbuf, length);
+    }
 
     nle_obs *obs = nle->observation;
     if (obs->tty_chars || obs->tty_colors || obs->tty_cursor) {
         tmt_write(nle->vterminal, nle->outbuf, length);
     }
     nle->outbuf_write_ptr = nle->outbuf;
-
-#ifdef NLE_BZ2_TTYRECS
     return 0;
-#else
-    return fflush(nle->ttyrec);
-#endif
 }
 
 /*
@@ -301,10 +781,42 @@ nle_get_obs()
     return current_nle_ctx->observation;
 }
 
+/* Records a key the game reads in the ttyrec's channel 1. With
+ * NLE_TTYREC_KEYS, those bytes are all there is. */
+static void
+write_key(unsigned char key)
+{
+    if (current_nle_ctx->ttyrec_codec == NLE_TTYREC_KEYS)
+        current_nle_ctx->ttyrec_buf_frames++;
+    else
+        write_header(1, 1);
+    write_data(&key, 1);
+}
+
+/* Records a key the game answered a prompt with, see winrl.cc. */
+void
+nle_record_key(unsigned char key)
+{
+    nle_fflush(stdout);
+    write_key(key);
+}
+
 void *
 nle_yield(void *notdone)
 {
     nle_fflush(stdout);
+    nle_obs *obs = current_nle_ctx->observation;
+    if (obs && !obs->tty_drawn) {
+        /* Only the buffers are new, the terminal didn't change. */
+        long tty_changed = current_nle_ctx->tty_changed;
+        refresh_terminal(current_nle_ctx);
+        current_nle_ctx->tty_changed = tty_changed;
+        obs->tty_drawn = TRUE;
+    }
+    /* The rest of changed_keys is set by fill_obs in winrl.cc. */
+    if (obs && obs->changed_keys)
+        *obs->changed_keys |= current_nle_ctx->tty_changed;
+    current_nle_ctx->tty_changed = 0;
     fcontext_transfer_t t =
         jump_fcontext(current_nle_ctx->returncontext, notdone);
 #if __has_feature(address_sanitizer) || defined(__SANITIZE_ADDRESS__)
@@ -328,8 +840,6 @@ nethack_exit(int status)
     nle_yield(NULL);
 }
 
-nle_seeds_init_t *nle_seeds_init;
-
 /* See rng.c. */
 extern int FDECL(whichrng, (int FDECL((*fn), (int) )));
 
@@ -347,12 +857,87 @@ extern unsigned long NDECL(sys_random_seed);
 void
 init_random(int FDECL((*fn), (int) ))
 {
-    if (!nle_seeds_init) {
+    nle_seeds_init_t *seeds_init = current_nle_ctx->seeds_init;
+
+    if (!seeds_init) {
         set_random(sys_random_seed(), fn);
         return;
     }
-    set_random(nle_seeds_init->seeds[whichrng(fn)], fn);
-    has_strong_rngseed = nle_seeds_init->reseed;
+    set_random(seeds_init->seeds[whichrng(fn)], fn);
+    has_strong_rngseed = seeds_init->reseed;
+}
+
+/* What nle_fork_point yields. */
+static char fork_point;
+
+/*
+ * Called right before newgame() in unixmain.c, when option parsing, dlb,
+ * the window port and role selection are done but no level exists yet.
+ * With fork_startup, the game yields here so that start_game can take a
+ * snapshot, which nle_reset then restores instead of replaying all that.
+ * Either way, the game continues with the episode's seeds: NetHack seeded
+ * its RNGs from them in initoptions, but startup may have used them since.
+ */
+void
+nle_fork_point()
+{
+    nle_ctx_t *nle = current_nle_ctx;
+    if (!nle->fork_startup || nle->startup)
+        return;
+
+    nle_yield(&fork_point);
+    init_random(rn2);
+    init_random(rn2_on_display_rng);
+}
+
+/*
+ * Runs the game until it yields, with its allocations in the arena.
+ * Returns what it yielded.
+ */
+void *
+run_game(nle_ctx_t *nle, void *data)
+{
+    current_nle_ctx = nle;
+    nle->arena.active = nle->arena.base != NULL;
+    fcontext_transfer_t t = jump_fcontext(nle->generatorcontext, data);
+    nle->arena.active = FALSE;
+    nle->generatorcontext = t.ctx;
+    nle->done = (t.data == NULL);
+    if (nle->ttyrec_buf_size >= TTYREC_BUF_SIZE / 2)
+        flush_ttyrec_buf(nle, FALSE);
+    return t.data;
+}
+
+/* Runs a new game on nle's stack until it first yields. */
+void
+start_game(nle_ctx_t *nle, nle_obs *obs, nle_seeds_init_t *seed_init)
+{
+    nle->seeds_init = seed_init;
+    nle->generatorcontext =
+        make_fcontext(nle->stack.sptr, nle->stack.ssize, mainloop);
+
+    if (run_game(nle, NULL) == &fork_point) {
+        nle->startup = nle_snapshot(nle);
+        run_game(nle, NULL);
+    }
+    obs->done = nle->done;
+    nle->seeds_init =
+        NULL; /* Don't set to *these* seeds on subsequent reseeds, if any. */
+}
+
+/* Frees what a game that's still running holds. See also nh_terminate. */
+void
+abandon_game(nle_ctx_t *nle)
+{
+    if (!nle->done) {
+        /* Reset without closing nethack. Need free memory, etc.
+         * this is what nh_terminate in end.c does. I hope it's enough. */
+        if (!program_state.panicking) {
+            freedynamicdata();
+            dlb_cleanup();
+        }
+        rl_free_nhwindows();
+    }
 }
 
 nle_ctx_t *
@@ -363,61 +948,352 @@ nle_start(nle_obs *obs, FILE *ttyrec, nle_seeds_init_t *seed_init)
     LI = NLE_TERM_LI;
 
     nle_ctx_t *nle = init_nle(ttyrec, obs);
-    nle_seeds_init = seed_init;
-
     nle->stack = create_fcontext_stack(STACK_SIZE);
-    nle->generatorcontext =
-        make_fcontext(nle->stack.sptr, nle->stack.ssize, mainloop);
+    start_game(nle, obs, seed_init);
 
+    return nle;
+}
+
+nle_ctx_t *
+nle_step(nle_ctx_t *nle, nle_obs *obs)
+{
     current_nle_ctx = nle;
-    fcontext_transfer_t t = jump_fcontext(nle->generatorcontext, NULL);
-    nle->generatorcontext = t.ctx;
-    nle->done = (t.data == NULL);
+    nle->observation = obs;
+    write_key(obs->action);
+    run_game(nle, obs);
     obs->done = nle->done;
-    nle_seeds_init =
-        NULL; /* Don't set to *these* seeds on subsequent reseeds, if any. */
 
     return nle;
 }
 
+/*
+ * Starts a new game without reloading this library: Restores its writable
+ * memory to the state after loading and reuses nle's stack and terminal.
+ * With fork_startup, restores the snapshot taken at nle_fork_point instead
+ * (once there is one). Writes to ttyrec if not NULL. Returns NULL (without
+ * changing anything) if that's not supported on this platform.
+ */
 nle_ctx_t *
-nle_step(nle_ctx_t *nle, nle_obs *obs)
+nle_reset(nle_ctx_t *nle, nle_obs *obs, FILE *ttyrec,
+          nle_seeds_init_t *seed_init)
 {
+    if (!nle->num_segments)
+        return NULL;
+
+    current_nle_ctx = nle;
+    if (nle->startup) {
+        close_ttyrec(nle, FALSE);
+        open_ttyrec(nle, ttyrec ? ttyrec : nle->ttyrec, obs);
+        nle->outbuf_write_ptr = nle->outbuf;
+        /* This also takes care of what abandon_game would free. */
+        nle_restore(nle, obs, nle->startup);
+
+        nle->seeds_init = seed_init;
+        run_game(nle, NULL);
+        obs->done = nle->done;
+        nle->seeds_init = NULL;
+        return nle;
+    }
+
+    abandon_game(nle);
+    close_ttyrec(nle, FALSE);
+
+    for (int i = 0; i < nle->num_segments; ++i) {
+        nle_segment_t *segment = &nle->segments[i];
+        memcpy(segment->start, segment->pristine, segment->size);
+    }
     current_nle_ctx = nle;
+
+    CO = NLE_TERM_CO;
+    LI = NLE_TERM_LI;
+
+    open_ttyrec(nle, ttyrec ? ttyrec : nle->ttyrec, obs);
     nle->observation = obs;
-    write_header(1, 1);
-    write_data(&obs->action, 1);
-    fcontext_transfer_t t = jump_fcontext(nle->generatorcontext, obs);
-    nle->generatorcontext = t.ctx;
-    nle->done = (t.data == NULL);
-    obs->done = nle->done;
+    nle->outbuf_write_ptr = nle->outbuf;
+    if (nle->arena.base) {
+        reset_arena(nle);
+        open_terminal(nle);
+    } else {
+        tmt_reset(nle->vterminal);
+    }
 
+    start_game(nle, obs, seed_init);
     return nle;
 }
 
 void
 nle_end(nle_ctx_t *nle)
 {
-    if (!nle->done) {
-        /* Reset without closing nethack. Need free memory, etc.
-         * this is what nh_terminate in end.c does. I hope it's enough. */
-        if (!program_state.panicking) {
-            freedynamicdata();
-            dlb_cleanup();
+    current_nle_ctx = nle;
+    abandon_game(nle);
+    close_ttyrec(nle, TRUE); /* The library may get unloaded next. */
+    if (nle->startup)
+        nle_free_snapshot(nle, nle->startup);
+
+#ifdef NLE_ARENA
+    if (nle->arena.base)
+        munmap(nle->arena.base, ARENA_RESERVE); /* Includes the terminal. */
+    else
+#endif
+        tmt_close(nle->vterminal);
+
+    destroy_fcontext_stack(&nle->stack);
+    for (int i = 0; i < nle->num_segments; ++i)
+        free(nle->segments[i].pristine);
+    free(nle);
+}
+
+#ifdef NLE_ARENA
+/* A level the game isn't on, which NetHack keeps in a file. */
+typedef struct nle_level_file {
+    int ledger;
+    size_t size;
+    char *data;
+} nle_level_file_t;
+
+struct nle_snapshot {
+    nle_ctx_t *nle;
+    char *segments[NLE_MAX_SEGMENTS];
+    char *stack; /* The used part, from generatorcontext up. */
+    size_t stack_size;
+    fcontext_t generatorcontext;
+    nle_arena_t arena;
+    int arena_fd; /* memfd with the arena up to arena_size. */
+    size_t arena_size;
+    TMT *vterminal;
+    void *windows; /* Copy of the window port's state. See winrl.cc. */
+    nle_level_file_t *levels;
+    int num_levels;
+};
+
+static boolean
+save_level_files(nle_snapshot_t *snapshot)
+{
+    for (int lev = 1; lev < MAXLINFO; ++lev) {
+        if (!(level_info[lev].flags & LFILE_EXISTS))
+            continue;
+
+        struct stat st;
+        int fd = open_levelfile(lev, (char *) 0);
+        if (fd < 0 || fstat(fd, &st)) {
+            if (fd >= 0)
+                close(fd);
+            return FALSE;
+        }
+
+        nle_level_file_t *levels = realloc(
+            snapshot->levels, (snapshot->num_levels + 1) * sizeof(*levels));
+        if (!levels) {
+            close(fd);
+            return FALSE;
         }
+        snapshot->levels = levels;
+        nle_level_file_t *level = &levels[snapshot->num_levels++];
+        level->ledger = lev;
+        level->size = st.st_size;
+        level->data = malloc(level->size);
+        boolean ok = level->data
+                     && read(fd, level->data, level->size) == level->size;
+        close(fd);
+        if (!ok)
+            return FALSE;
     }
-    nle_fflush(stdout);
+    return TRUE;
+}
 
-#ifdef NLE_BZ2_TTYRECS
-    int bzerror;
-    BZ2_bzWriteClose(&bzerror, nle->ttyrec_bz2, 0, NULL, NULL);
-    assert(bzerror == BZ_OK);
-#endif
+/* Needs level_info and lock from before restoring the snapshot's. */
+static void
+delete_level_files(nle_snapshot_t *snapshot)
+{
+    boolean keep[MAXLINFO] = { 0 };
+    for (int i = 0; i < snapshot->num_levels; ++i)
+        keep[snapshot->levels[i].ledger] = TRUE;
+    for (int lev = 1; lev < MAXLINFO; ++lev) {
+        if (!keep[lev])
+            delete_levelfile(lev);
+    }
+}
 
-    tmt_close(nle->vterminal);
+static void
+restore_level_files(nle_snapshot_t *snapshot)
+{
+    for (int i = 0; i < snapshot->num_levels; ++i) {
+        nle_level_file_t *level = &snapshot->levels[i];
+        int fd = create_levelfile(level->ledger, (char *) 0);
+        if (fd < 0)
+            continue;
+        if (write(fd, level->data, level->size) != level->size)
+            fprintf(stderr, "Error restoring level file %d\n",
+                    level->ledger);
+        close(fd);
+    }
+}
 
-    destroy_fcontext_stack(&nle->stack);
-    free(nle);
+static boolean
+save_arena(nle_snapshot_t *snapshot)
+{
+    nle_arena_t *arena = &snapshot->nle->arena;
+    size_t page = sysconf(_SC_PAGESIZE);
+
+    snapshot->arena = *arena;
+    snapshot->arena_size =
+        (arena->top - arena->base + page - 1) / page * page;
+    snapshot->arena_fd = memfd_create("nle_snapshot", MFD_CLOEXEC);
+    if (snapshot->arena_fd < 0
+        || ftruncate(snapshot->arena_fd, snapshot->arena_size))
+        return FALSE;
+
+    for (size_t done = 0; done < snapshot->arena_size;) {
+        ssize_t n = pwrite(snapshot->arena_fd, arena->base + done,
+                           snapshot->arena_size - done, done);
+        if (n <= 0)
+            return FALSE;
+        done += n;
+    }
+    return TRUE;
+}
+
+/*
+ * Takes a snapshot of a running game for nle_restore, without a save file:
+ * Copies this library's writable memory (which includes the RNG state), the
+ * game's heap, the used part of its stack, the files of other levels and
+ * the window port's state. The heap goes into a memfd that nle_restore maps
+ * copy-on-write, so restoring the same snapshot again and again only copies
+ * the pages the game changes. Returns NULL if the game is done or if
+ * snapshots aren't supported on this platform.
+ */
+nle_snapshot_t *
+nle_snapshot(nle_ctx_t *nle)
+{
+    if (!nle->arena.base || nle->done)
+        return NULL;
+    current_nle_ctx = nle;
+
+    nle_snapshot_t *snapshot = calloc(1, sizeof(nle_snapshot_t));
+    if (!snapshot)
+        return NULL;
+    snapshot->nle = nle;
+    snapshot->arena_fd = -1;
+
+    for (int i = 0; i < nle->num_segments; ++i) {
+        nle_segment_t *segment = &nle->segments[i];
+        snapshot->segments[i] = malloc(segment->size);
+        if (!snapshot->segments[i]) {
+            nle_free_snapshot(nle, snapshot);
+            return NULL;
+        }
+        memcpy(snapshot->segments[i], segment->start, segment->size);
+    }
+
+    snapshot->generatorcontext = nle->generatorcontext;
+    snapshot->stack_size =
+        (char *) nle->stack.sptr - (char *) nle->generatorcontext;
+    snapshot->stack = malloc(snapshot->stack_size);
+    if (!snapshot->stack || !save_arena(snapshot)
+        || !save_level_files(snapshot)) {
+        nle_free_snapshot(nle, snapshot);
+        return NULL;
+    }
+    memcpy(snapshot->stack, nle->generatorcontext, snapshot->stack_size);
+
+    snapshot->vterminal = nle->vterminal;
+    snapshot->windows = rl_snapshot_nhwindows();
+    return snapshot;
+}
+
+/*
+ * Continues the game from snapshot, which must be from the same nle. Works
+ * whether the current game is running or done, and after nle_reset.
+ * Updates obs. Returns NULL (without changing anything) on failure.
+ */
+nle_ctx_t *
+nle_restore(nle_ctx_t *nle, nle_obs *obs, nle_snapshot_t *snapshot)
+{
+    if (snapshot->nle != nle)
+        return NULL;
+    current_nle_ctx = nle;
+
+    char *base = mmap(nle->arena.base, snapshot->arena_size,
+                      PROT_READ | PROT_WRITE, MAP_PRIVATE | MAP_FIXED,
+                      snapshot->arena_fd, 0);
+    if (base == MAP_FAILED)
+        return NULL;
+
+    /* Parts of the current state that the snapshot's state replaces. */
+    FILE *dlb_files[MAX_LIBS];
+    delete_level_files(snapshot);
+    dlb_take_files(dlb_files);
+    void *windows = rl_release_nhwindows();
+
+    for (int i = 0; i < nle->num_segments; ++i) {
+        nle_segment_t *segment = &nle->segments[i];
+        memcpy(segment->start, snapshot->segments[i], segment->size);
+    }
+    current_nle_ctx = nle;
+    memcpy(snapshot->generatorcontext, snapshot->stack, snapshot->stack_size);
+    nle->generatorcontext = snapshot->generatorcontext;
+    nle->arena = snapshot->arena;
+    nle->vterminal = snapshot->vterminal;
+    nle->done = FALSE;
+    nle->observation = obs;
+    obs->done = FALSE;
+
+    dlb_give_files(dlb_files);
+    restore_level_files(snapshot);
+    rl_restore_nhwindows(windows, snapshot->windows);
+    refresh_terminal(nle);
+    return nle;
+}
+
+void
+nle_free_snapshot(nle_ctx_t *nle, nle_snapshot_t *snapshot)
+{
+    for (int i = 0; i < nle->num_segments; ++i)
+        free(snapshot->segments[i]);
+    free(snapshot->stack);
+    if (snapshot->arena_fd >= 0)
+        close(snapshot->arena_fd);
+    rl_free_nhwindows_snapshot(snapshot->windows);
+    for (int i = 0; i < snapshot->num_levels; ++i)
+        free(snapshot->levels[i].data);
+    free(snapshot->levels);
+    free(snapshot);
+}
+#else
+nle_snapshot_t *
+nle_snapshot(nle_ctx_t *nle)
+{
+    return NULL;
+}
+
+nle_ctx_t *
+nle_restore(nle_ctx_t *nle, nle_obs *obs, nle_snapshot_t *snapshot)
+{
+    return NULL;
+}
+
+void
+nle_free_snapshot(nle_ctx_t *nle, nle_snapshot_t *snapshot)
+{
+}
+#endif /* NLE_ARENA */
+
+/*
+ * Lets new episodes start from a snapshot taken at nle_fork_point, from the
+ * next nle_reset on. Returns FALSE if that's not supported here.
+ */
+boolean
+nle_set_fork_startup(nle_ctx_t *nle, boolean fork_startup)
+{
+    if (fork_startup && !nle->arena.base)
+        return FALSE;
+
+    nle->fork_startup = fork_startup;
+    if (!fork_startup && nle->startup) {
+        nle_free_snapshot(nle, nle->startup);
+        nle->startup = NULL;
+    }
+    return TRUE;
 }
 
 void
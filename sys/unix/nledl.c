@@ -1,17 +1,77 @@
 
+#ifndef _GNU_SOURCE
+#define _GNU_SOURCE /* For dlmopen. */
+#endif
+
 #include <dlfcn.h>
+#include <locale.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
 
 #include "nledl.h"
 
+extern char **environ;
+
+#ifdef LM_ID_NEWLM
+/*
+ * glibc doesn't free a linker namespace (or the static TLS of the libc
+ * loaded into it) on dlclose. Keep the namespaces of ended games around
+ * for reuse by new ones.
+ */
+#define NLEDL_MAX_NAMESPACES 16
+static Lmid_t free_namespaces[NLEDL_MAX_NAMESPACES];
+static int num_free_namespaces = 0;
+#endif
+
+/*
+ * The libc of a namespace only sets up its thread-local ctype tables on
+ * the thread that loaded it; threads created by the base libc don't know
+ * about it. Using the global locale (again) sets them up on this thread.
+ * This is cheap enough to do before each call into the game.
+ */
+static void
+nledl_enter(nle_ctx_t *nledl)
+{
+    if (nledl->uselocale)
+        nledl->uselocale(LC_GLOBAL_LOCALE);
+}
+
+/* NetHack reads its options etc. from the environment when starting. */
+static void
+nledl_sync_environ(nle_ctx_t *nledl)
+{
+    if (nledl->environ)
+        *nledl->environ = environ;
+}
+
+static void *
+nledl_load(nle_ctx_t *nledl)
+{
+#ifdef LM_ID_NEWLM
+    if (nledl->use_dlmopen) {
+        Lmid_t lmid = nledl->lmid;
+        nledl->dlhandle = dlmopen(lmid, nledl->dlpath, RTLD_LAZY);
+        if (!nledl->dlhandle)
+            return NULL;
+        if (lmid == LM_ID_NEWLM && dlinfo(nledl->dlhandle, RTLD_DI_LMID,
+                                          &nledl->lmid)) {
+            dlclose(nledl->dlhandle);
+            return nledl->dlhandle = NULL;
+        }
+        /* The namespace has its own libc, with its own environ. */
+        nledl->environ = dlsym(nledl->dlhandle, "environ");
+        nledl->uselocale = dlsym(nledl->dlhandle, "uselocale");
+        return nledl->dlhandle;
+    }
+#endif
+    return nledl->dlhandle = dlopen(nledl->dlpath, RTLD_LAZY);
+}
+
 void
 nledl_init(nle_ctx_t *nledl, nle_obs *obs, nle_seeds_init_t *seed_init)
 {
-    nledl->dlhandle = dlopen(nledl->dlpath, RTLD_LAZY);
-
-    if (!nledl->dlhandle) {
+    if (!nledl->dlhandle && !nledl_load(nledl)) {
         fprintf(stderr, "%s\n", dlerror());
         exit(EXIT_FAILURE);
     }
@@ -20,6 +80,8 @@ nledl_init(nle_ctx_t *nledl, nle_obs *obs, nle_seeds_init_t *seed_init)
 
     void *(*start)(nle_obs *, FILE *, nle_seeds_init_t *);
     start = dlsym(nledl->dlhandle, "nle_start");
+    nledl_sync_environ(nledl);
+    nledl_enter(nledl);
     nledl->nle_ctx = start(obs, nledl->ttyrec, seed_init);
 
     char *error = dlerror();
@@ -42,30 +104,62 @@ nledl_close(nle_ctx_t *nledl)
 {
     void (*end)(void *);
 
-    end = dlsym(nledl->dlhandle, "nle_end");
-    end(nledl->nle_ctx);
+    if (nledl->nle_ctx) {
+        end = dlsym(nledl->dlhandle, "nle_end");
+        nledl_enter(nledl);
+        end(nledl->nle_ctx);
+        nledl->nle_ctx = NULL;
+    }
 
     if (dlclose(nledl->dlhandle)) {
         fprintf(stderr, "Error in dlclose: %s\n", dlerror());
         exit(EXIT_FAILURE);
     }
+    nledl->dlhandle = NULL;
 
     dlerror();
 }
 
-nle_ctx_t *
-nle_start(const char *dlpath, nle_obs *obs, FILE *ttyrec,
-          nle_seeds_init_t *seed_init)
+static nle_ctx_t *
+nledl_new(const char *dlpath, FILE *ttyrec)
 {
     /* TODO: Consider getting ttyrec path from caller? */
-    struct nledl_ctx *nledl = malloc(sizeof(struct nledl_ctx));
+    struct nledl_ctx *nledl = calloc(1, sizeof(struct nledl_ctx));
     nledl->ttyrec = ttyrec;
-    strncpy(nledl->dlpath, dlpath, sizeof(nledl->dlpath));
+    strncpy(nledl->dlpath, dlpath, sizeof(nledl->dlpath) - 1);
+    return nledl;
+}
 
+nle_ctx_t *
+nle_start(const char *dlpath, nle_obs *obs, FILE *ttyrec,
+          nle_seeds_init_t *seed_init)
+{
+    struct nledl_ctx *nledl = nledl_new(dlpath, ttyrec);
     nledl_init(nledl, obs, seed_init);
     return nledl;
 };
 
+nle_ctx_t *
+nle_load_dlmopen(const char *dlpath, FILE *ttyrec)
+{
+#ifdef LM_ID_NEWLM
+    struct nledl_ctx *nledl = nledl_new(dlpath, ttyrec);
+    nledl->use_dlmopen = 1;
+    nledl->lmid = num_free_namespaces ? free_namespaces[--num_free_namespaces]
+                                      : LM_ID_NEWLM;
+
+    if (!nledl_load(nledl)) {
+        if (nledl->lmid != LM_ID_NEWLM)
+            free_namespaces[num_free_namespaces++] = nledl->lmid;
+        free(nledl);
+        return NULL;
+    }
+    return nledl;
+#else
+    return NULL;
+#endif
+}
+
 nle_ctx_t *
 nle_step(nle_ctx_t *nledl, nle_obs *obs)
 {
@@ -74,22 +168,35 @@ nle_step(nle_ctx_t *nledl, nle_obs *obs)
         exit(EXIT_FAILURE);
     }
 
+    nledl_enter(nledl);
     nledl->step(nledl->nle_ctx, obs);
 
     return nledl;
 }
 
-/* TODO: For a standard reset, we don't need the full close in nle.c.
- * E.g., we could re-use the stack buffer and the nle_ctx_t. */
 void
 nle_reset(nle_ctx_t *nledl, nle_obs *obs, FILE *ttyrec,
           nle_seeds_init_t *seed_init)
 {
-    nledl_close(nledl);
     /* Reset file only if not-NULL. */
     if (ttyrec)
         nledl->ttyrec = ttyrec;
 
+    /* Libraries loaded with nle_load_dlmopen haven't started yet. */
+    if (nledl->nle_ctx) {
+        /* Prefer restarting the game in place over reloading the library.
+         * This returns NULL if not supported. */
+        void *(*reset)(void *, nle_obs *, FILE *, nle_seeds_init_t *);
+        reset = dlsym(nledl->dlhandle, "nle_reset");
+        if (reset) {
+            nledl_sync_environ(nledl);
+            nledl_enter(nledl);
+            if (reset(nledl->nle_ctx, obs, nledl->ttyrec, seed_init))
+                return;
+        }
+        nledl_close(nledl);
+    }
+
     // TODO: Consider refactoring nledl.h such that we expose this init
     // function but drop reset.
     nledl_init(nledl, obs, seed_init);
@@ -99,9 +206,63 @@ void
 nle_end(nle_ctx_t *nledl)
 {
     nledl_close(nledl);
+#ifdef LM_ID_NEWLM
+    if (nledl->use_dlmopen && num_free_namespaces < NLEDL_MAX_NAMESPACES)
+        free_namespaces[num_free_namespaces++] = nledl->lmid;
+#endif
     free(nledl);
 }
 
+void *
+nle_snapshot(nle_ctx_t *nledl)
+{
+    void *(*snapshot)(void *);
+
+    if (!nledl->nle_ctx)
+        return NULL;
+    snapshot = dlsym(nledl->dlhandle, "nle_snapshot");
+    if (!snapshot)
+        return NULL;
+    nledl_enter(nledl);
+    return snapshot(nledl->nle_ctx);
+}
+
+int
+nle_restore(nle_ctx_t *nledl, nle_obs *obs, void *snapshot)
+{
+    void *(*restore)(void *, nle_obs *, void *);
+
+    if (!nledl->nle_ctx)
+        return 0;
+    restore = dlsym(nledl->dlhandle, "nle_restore");
+    if (!restore)
+        return 0;
+    nledl_enter(nledl);
+    return restore(nledl->nle_ctx, obs, snapshot) != NULL;
+}
+
+void
+nle_free_snapshot(nle_ctx_t *nledl, void *snapshot)
+{
+    void (*free_snapshot)(void *, void *);
+
+    free_snapshot = dlsym(nledl->dlhandle, "nle_free_snapshot");
+    free_snapshot(nledl->nle_ctx, snapshot);
+}
+
+int
+nle_set_fork_startup(nle_ctx_t *nledl, char fork_startup)
+{
+    char (*set_fork_startup)(void *, char);
+
+    if (!nledl->nle_ctx)
+        return 0;
+    set_fork_startup = dlsym(nledl->dlhandle, "nle_set_fork_startup");
+    if (!set_fork_startup)
+        return 0;
+    return set_fork_startup(nledl->nle_ctx, fork_startup);
+}
+
 void
 nle_set_seed(nle_ctx_t *nledl, unsigned long core, unsigned long disp,
              char reseed)
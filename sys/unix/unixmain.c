@@ -28,6 +28,9 @@ extern struct passwd *FDECL(getpwuid, (int));
 extern struct passwd *FDECL(getpwnam, (const char *));
 #ifdef CHDIR
 static void FDECL(chdirx, (const char *, BOOLEAN_P));
+#ifdef NLE_PLAYGROUND
+void FDECL(append_slash, (char *)); /* NLE: Used in chdirx. */
+#endif
 #endif /* CHDIR */
 static boolean NDECL(whoami);
 static void FDECL(process_options, (int, char **));
@@ -43,6 +46,9 @@ extern void NDECL(init_linux_cons);
 
 static void NDECL(wd_message);
 static boolean wiz_error_flag = FALSE;
+
+/* NLE: See nle.c. */
+extern void NDECL(nle_fork_point);
 static struct passwd *NDECL(get_unix_pw);
 
 int
@@ -346,6 +352,7 @@ char *argv[];
                 goto attempt_restore;
             }
         }
+        nle_fork_point(); /* NLE: New episodes may start here. */
         newgame();
         wd_message();
     }
@@ -531,6 +538,21 @@ boolean wr;
         fqn_prefix[BONESPREFIX] = fqn_prefix[SCOREPREFIX];
         fqn_prefix[LOCKPREFIX] = fqn_prefix[SCOREPREFIX];
         fqn_prefix[TROUBLEPREFIX] = fqn_prefix[SCOREPREFIX];
+#endif
+#ifdef NLE_PLAYGROUND
+        {
+            char cwd[FQN_MAX_FILENAME];
+
+            if (getcwd(cwd, sizeof cwd - 1)) {
+                append_slash(cwd);
+                fqn_prefix[SCOREPREFIX] = dupstr(cwd);
+                fqn_prefix[LEVELPREFIX] = fqn_prefix[SCOREPREFIX];
+                fqn_prefix[SAVEPREFIX] = fqn_prefix[SCOREPREFIX];
+                fqn_prefix[BONESPREFIX] = fqn_prefix[SCOREPREFIX];
+                fqn_prefix[LOCKPREFIX] = fqn_prefix[SCOREPREFIX];
+                fqn_prefix[TROUBLEPREFIX] = fqn_prefix[SCOREPREFIX];
+            }
+        }
 #endif
         check_recordfile(dir);
     }
@@ -1,10 +1,20 @@
 /* Copyright (c) Facebook, Inc. and its affiliates. */
+#include <algorithm>
 #include <atomic>
+#include <condition_variable>
 #include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <deque>
 #include <memory>
+#include <mutex>
+#include <thread>
+#include <unordered_map>
+#include <unordered_set>
 
 #include <pybind11/numpy.h>
 #include <pybind11/pybind11.h>
+#include <pybind11/stl.h>
 
 // "digit" is declared in both Python's longintrepr.h and NetHack's extern.h.
 #define digit nethack_digit
@@ -28,12 +38,11 @@ extern "C" {
 namespace py = pybind11;
 using namespace py::literals;
 
+// Checks h is a writeable numpy array of type T and the given shape.
 template <typename T>
-T *
-checked_conversion(py::handle h, const std::vector<ssize_t> &shape)
+py::buffer_info
+checked_buffer(py::handle h, const std::vector<ssize_t> &shape)
 {
-    if (h.is_none())
-        return nullptr;
     py::array array = py::array::ensure(h);
     if (!array)
         throw std::runtime_error("Numpy array required");
@@ -42,8 +51,14 @@ checked_conversion(py::handle h, const std::vector<ssize_t> &shape)
     // causes conversions to "larger" types.
 
     // TODO: Better error messages here and below.
-    if (!array.dtype().is(py::dtype::of<T>()))
+    // int16 can also be uint16 with the same bits, e.g. for glyphs, which
+    // are never negative.
+    if (!array.dtype().is(py::dtype::of<T>())
+        && !(std::is_same<T, int16_t>::value
+             && array.dtype().is(py::dtype::of<uint16_t>())))
         throw std::runtime_error("Numpy array of right type required");
+    if (!array.writeable())
+        throw std::runtime_error("Array isn't writeable");
 
     py::buffer_info buf = array.request();
 
@@ -51,38 +66,410 @@ checked_conversion(py::handle h, const std::vector<ssize_t> &shape)
         throw std::runtime_error("array has wrong number of dims");
     if (!std::equal(shape.begin(), shape.end(), buf.shape.begin()))
         throw std::runtime_error("Array has wrong shape");
-    if (!(array.flags() & py::array::c_style))
+    return buf;
+}
+
+// Whether dimensions first, first + 1, ... of buf are laid out as in a C
+// array, i.e. each index into the ones before is a single block of memory.
+bool
+is_c_contiguous(const py::buffer_info &buf, ssize_t first)
+{
+    ssize_t stride = buf.itemsize;
+    for (ssize_t i = buf.ndim - 1; i >= first; --i) {
+        if (buf.shape[i] != 1 && buf.strides[i] != stride)
+            return false;
+        stride *= buf.shape[i];
+    }
+    return true;
+}
+
+template <typename T>
+T *
+checked_conversion(py::handle h, const std::vector<ssize_t> &shape)
+{
+    if (h.is_none())
+        return nullptr;
+    py::buffer_info buf = checked_buffer<T>(h, shape);
+    if (!is_c_contiguous(buf, 0))
         throw std::runtime_error("Array isn't C contiguous");
 
     return static_cast<T *>(buf.ptr);
 }
 
+template <typename T>
+bool
+has_dtype(py::handle h)
+{
+    return py::isinstance<py::array>(h)
+           && py::reinterpret_borrow<py::array>(h).dtype().is(
+               py::dtype::of<T>());
+}
+
+// Calls f(index, field, shape) for the observation called key, with its
+// position in set_buffers(), its nle_obs member and its shape. Returns false
+// for unknown keys. int32 blstats buffers go to blstats_int32.
+template <typename F>
+bool
+visit_obs_field(const std::string &key, py::handle buffer, int crop_radius,
+                F &&f)
+{
+    const std::vector<ssize_t> dungeon{ ROWNO, COLNO - 1 };
+    const std::vector<ssize_t> crop{ 2 * crop_radius + 1,
+                                     2 * crop_radius + 1 };
+    if (key == "glyphs")
+        f(0, &nle_obs::glyphs, dungeon);
+    else if (key == "chars")
+        f(1, &nle_obs::chars, dungeon);
+    else if (key == "colors")
+        f(2, &nle_obs::colors, dungeon);
+    else if (key == "specials")
+        f(3, &nle_obs::specials, dungeon);
+    else if (key == "blstats" && has_dtype<int>(buffer))
+        f(4, &nle_obs::blstats_int32, { NLE_BLSTATS_SIZE });
+    else if (key == "blstats")
+        f(4, &nle_obs::blstats, { NLE_BLSTATS_SIZE });
+    else if (key == "message")
+        f(5, &nle_obs::message, { NLE_MESSAGE_SIZE });
+    else if (key == "program_state")
+        f(6, &nle_obs::program_state, { NLE_PROGRAM_STATE_SIZE });
+    else if (key == "internal")
+        f(7, &nle_obs::internal, { NLE_INTERNAL_SIZE });
+    else if (key == "inv_glyphs")
+        f(8, &nle_obs::inv_glyphs, { NLE_INVENTORY_SIZE });
+    else if (key == "inv_letters")
+        f(9, &nle_obs::inv_letters, { NLE_INVENTORY_SIZE });
+    else if (key == "inv_oclasses")
+        f(10, &nle_obs::inv_oclasses, { NLE_INVENTORY_SIZE });
+    else if (key == "inv_strs")
+        f(11, &nle_obs::inv_strs,
+          { NLE_INVENTORY_SIZE, NLE_INVENTORY_STR_LENGTH });
+    else if (key == "screen_descriptions")
+        f(12, &nle_obs::screen_descriptions,
+          { ROWNO, COLNO - 1, NLE_SCREEN_DESCRIPTION_LENGTH });
+    else if (key == "tty_chars")
+        f(13, &nle_obs::tty_chars, { NLE_TERM_LI, NLE_TERM_CO });
+    else if (key == "tty_colors")
+        f(14, &nle_obs::tty_colors, { NLE_TERM_LI, NLE_TERM_CO });
+    else if (key == "tty_cursor")
+        f(15, &nle_obs::tty_cursor, { 2 });
+    else if (key == "screen_description_ids")
+        f(16, &nle_obs::screen_description_ids, dungeon);
+    else if (key == "inv_str_ids")
+        f(17, &nle_obs::inv_str_ids, { NLE_INVENTORY_SIZE });
+    else if (key == "changed_keys")
+        f(18, &nle_obs::changed_keys, { 1 });
+    else if (key == "dirty_cells")
+        f(19, &nle_obs::dirty_cells, { NLE_DIRTY_CELLS_SIZE });
+    else if (key == "glyphs_crop")
+        f(20, &nle_obs::glyphs_crop, crop);
+    else if (key == "chars_crop")
+        f(21, &nle_obs::chars_crop, crop);
+    else if (key == "colors_crop")
+        f(22, &nle_obs::colors_crop, crop);
+    else
+        return false;
+    return true;
+}
+
+// After pointing field at a buffer: The game writes blstats into only one
+// of blstats and blstats_int32.
+template <typename T>
+void
+unset_other_blstats(nle_obs &, T *nle_obs::*)
+{
+}
+
+void
+unset_other_blstats(nle_obs &obs, long *nle_obs::*field)
+{
+    if (field == &nle_obs::blstats)
+        obs.blstats_int32 = nullptr;
+}
+
+void
+unset_other_blstats(nle_obs &obs, int *nle_obs::*field)
+{
+    if (field == &nle_obs::blstats_int32)
+        obs.blstats = nullptr;
+}
+
+// Copies n elements from from to to if there is a to. Returns false if
+// there was nothing to copy from.
+template <typename T>
+bool
+copy_buffer(T *to, const T *from, size_t n)
+{
+    if (!to)
+        return true;
+    if (!from)
+        return false;
+    std::memcpy(to, from, n * sizeof(T));
+    return true;
+}
+
+// The strings behind the screen_description_ids and inv_str_ids
+// observations. Shared by all games in this process, and kept out of
+// libnethack.so as nle_reset and nle_restore rewind its memory. IDs only get
+// added, 0 is the empty string.
+class StringTable
+{
+  public:
+    static int
+    intern(const char *str, unsigned long len)
+    {
+        StringTable &table = instance();
+        std::lock_guard<std::mutex> lock(table.mutex_);
+        auto result = table.ids_.emplace(std::string(str, len),
+                                         table.strings_.size());
+        if (result.second)
+            table.strings_.push_back(result.first->first);
+        return result.first->second;
+    }
+
+    // Returns the strings with IDs from *next on, and updates *next.
+    static std::vector<std::string>
+    since(size_t *next)
+    {
+        StringTable &table = instance();
+        std::lock_guard<std::mutex> lock(table.mutex_);
+        size_t begin = std::min(*next, table.strings_.size());
+        *next = table.strings_.size();
+        return std::vector<std::string>(table.strings_.begin() + begin,
+                                        table.strings_.end());
+    }
+
+  private:
+    StringTable()
+    {
+        ids_.emplace("", 0);
+        strings_.emplace_back();
+    }
+
+    static StringTable &
+    instance()
+    {
+        static StringTable table;
+        return table;
+    }
+
+    std::mutex mutex_;
+    std::unordered_map<std::string, int> ids_;
+    std::vector<std::string> strings_;
+};
+
+// Compresses and writes the ttyrecs of games that hand it their ttyrec data
+// (see Nethack::set_ttyrec_async) on a background thread, so that neither
+// step() nor reset() wait for that. Shared by all games in this process.
+// Keeps a bounded queue of chunks of whole frames, which it writes in the
+// order games hand them in.
+class TtyrecWriter
+{
+  public:
+    // A game's state in the writer.
+    struct Sink {
+        size_t pending = 0; // Jobs queued or being done.
+        std::atomic<long> frames_dropped{ 0 };
+    };
+
+    // When queue_size chunks are waiting to be written, games wait for the
+    // writer if block, or otherwise drop their new chunks (and count their
+    // frames in frames_dropped).
+    static void
+    configure(size_t queue_size, bool block)
+    {
+        if (queue_size < 1)
+            throw std::invalid_argument("queue_size must be at least 1");
+        TtyrecWriter &writer = instance();
+        std::lock_guard<std::mutex> lock(writer.mutex_);
+        writer.queue_size_ = queue_size;
+        writer.block_ = block;
+        writer.written_.notify_all();
+    }
+
+    // The nle_obs::ttyrec_writer, with the game's Sink as arg.
+    static int
+    take(void *arg, nle_ttyrec_chunk *chunk)
+    {
+        Sink *sink = static_cast<Sink *>(arg);
+        if (!chunk) {
+            wait(sink);
+            return 1;
+        }
+        return instance().push({ sink, chunk, nullptr }, !chunk->last);
+    }
+
+    // Closes file once the chunks sink handed in so far are written.
+    static void
+    close_file(Sink *sink, std::FILE *file)
+    {
+        instance().push({ sink, nullptr, file }, false);
+    }
+
+    // Returns once the writer is done with what sink handed in so far.
+    static void
+    wait(Sink *sink)
+    {
+        TtyrecWriter &writer = instance();
+        std::unique_lock<std::mutex> lock(writer.mutex_);
+        writer.written_.wait(lock, [sink] { return !sink->pending; });
+    }
+
+  private:
+    struct Job {
+        Sink *sink;
+        nle_ttyrec_chunk *chunk;
+        std::FILE *file; // To close, if no chunk.
+    };
+
+    TtyrecWriter()
+    {
+        std::thread(&TtyrecWriter::run, this).detach();
+    }
+
+    static TtyrecWriter &
+    instance()
+    {
+        // Never destroyed, as games may still be closed (and wait for
+        // their ttyrecs) after static objects are destroyed at exit.
+        static TtyrecWriter *writer = new TtyrecWriter();
+        return *writer;
+    }
+
+    int
+    push(Job job, bool droppable)
+    {
+        std::unique_lock<std::mutex> lock(mutex_);
+        if (queue_.size() >= queue_size_) {
+            if (droppable && !block_) {
+                job.sink->frames_dropped += job.chunk->frames;
+                return 0;
+            }
+            written_.wait(lock,
+                          [this] { return queue_.size() < queue_size_; });
+        }
+        queue_.push_back(job);
+        ++job.sink->pending;
+        queued_.notify_one();
+        return 1;
+    }
+
+    void
+    run()
+    {
+        std::unique_lock<std::mutex> lock(mutex_);
+        while (true) {
+            queued_.wait(lock, [this] { return !queue_.empty(); });
+            Job job = queue_.front();
+            queue_.pop_front();
+            lock.unlock();
+            if (job.chunk)
+                job.chunk->write(job.chunk);
+            else
+                std::fclose(job.file);
+            lock.lock();
+            --job.sink->pending;
+            written_.notify_all();
+        }
+    }
+
+    std::mutex mutex_;
+    std::condition_variable queued_;
+    std::condition_variable written_;
+    std::deque<Job> queue_;
+    size_t queue_size_ = 64;
+    bool block_ = true;
+};
+
+class Nethack;
+
+// A snapshot of a game, see Nethack::snapshot(). Opaque to Python.
+class Snapshot
+{
+  public:
+    ~Snapshot();
+
+  private:
+    friend class Nethack;
+
+    Nethack *nethack_ = nullptr; // Null once the game is closed.
+    void *snapshot_ = nullptr;
+};
+
 class Nethack
 {
   public:
-    Nethack(std::string dlpath, std::string ttyrec)
-        : dlpath_(std::move(dlpath)), obs_{},
+    Nethack(std::string dlpath, std::string ttyrec, bool dlmopen)
+        : dlpath_(std::move(dlpath)), obs_{}, dlmopen_(dlmopen),
           ttyrec_(std::fopen(ttyrec.c_str(), "a"), std::fclose)
     {
         if (!ttyrec_) {
             PyErr_SetFromErrnoWithFilename(PyExc_OSError, ttyrec.c_str());
             throw py::error_already_set();
         }
+        obs_.intern_string = &StringTable::intern;
+        obs_.crop_radius = NLE_CROP_RADIUS;
+        if (dlmopen_)
+            load_dlmopen();
     }
     ~Nethack()
     {
         close();
     }
     void
-    step(int action)
+    step(int action, bool handle_prompts)
     {
-        if (!nle_)
+        if (!started_)
             throw std::runtime_error("step called without reset()");
         if (obs_.done)
             throw std::runtime_error("Called step on finished NetHack");
         obs_.action = action;
+        obs_.prompt_policy = handle_prompts ? &prompt_policy_ : nullptr;
         nle_ = nle_step(nle_, &obs_);
     }
+
+    // Steps with action up to repeat times, as long as the game comes back
+    // to its command prompt without a message. Returns the change of the
+    // score and how often action was used.
+    std::tuple<long, int>
+    step_repeat(int action, int repeat, bool handle_prompts)
+    {
+        if (repeat < 1)
+            throw std::invalid_argument("repeat must be at least 1");
+        obs_.num_repeats = repeat - 1;
+        obs_.num_repeated = 0;
+        try {
+            step(action, handle_prompts);
+        } catch (...) {
+            obs_.num_repeats = 0;
+            throw;
+        }
+        // Not repeat - num_repeats, which prompts reset to stop early.
+        int repeats = 1 + obs_.num_repeated;
+        obs_.num_repeats = 0;
+        return std::make_tuple(obs_.score_delta, repeats);
+    }
+    // Feeds actions to the game until it ends or it waits at a --More--
+    // the next action wouldn't dismiss. Returns how many were used.
+    size_t
+    step_sequence(std::vector<int> actions)
+    {
+        if (actions.empty())
+            throw std::invalid_argument("No actions given");
+        obs_.queued_actions = actions.data() + 1;
+        obs_.num_queued_actions = actions.size() - 1;
+        try {
+            step(actions[0], false);
+        } catch (...) {
+            obs_.queued_actions = nullptr;
+            obs_.num_queued_actions = 0;
+            throw;
+        }
+        size_t consumed = actions.size() - obs_.num_queued_actions;
+        obs_.queued_actions = nullptr;
+        obs_.num_queued_actions = 0;
+        return consumed;
+    }
+
     bool
     done()
     {
@@ -106,7 +493,10 @@ class Nethack
         // Reset environment, then close original FILE. Cannot use freopen
         // as the game may still need to write to the original but reset()
         // wants to get the new one already.
+        bool async = ttyrec_async_; // How the original was written.
         reset(f);
+        if (async) // TtyrecWriter may still be finishing it.
+            TtyrecWriter::close_file(&ttyrec_sink_, ttyrec_.release());
         ttyrec_.reset(f);
     }
 
@@ -117,15 +507,25 @@ class Nethack
                 py::object inv_glyphs, py::object inv_letters,
                 py::object inv_oclasses, py::object inv_strs,
                 py::object screen_descriptions, py::object tty_chars,
-                py::object tty_colors, py::object tty_cursor)
+                py::object tty_colors, py::object tty_cursor,
+                py::object screen_description_ids, py::object inv_str_ids,
+                py::object changed_keys, py::object dirty_cells,
+                py::object glyphs_crop, py::object chars_crop,
+                py::object colors_crop)
     {
         std::vector<ssize_t> dungeon{ ROWNO, COLNO - 1 };
         obs_.glyphs = checked_conversion<int16_t>(glyphs, dungeon);
         obs_.chars = checked_conversion<uint8_t>(chars, dungeon);
         obs_.colors = checked_conversion<uint8_t>(colors, dungeon);
         obs_.specials = checked_conversion<uint8_t>(specials, dungeon);
-        obs_.blstats =
-            checked_conversion<long>(blstats, { NLE_BLSTATS_SIZE });
+        obs_.blstats = nullptr;
+        obs_.blstats_int32 = nullptr;
+        if (has_dtype<int>(blstats))
+            obs_.blstats_int32 =
+                checked_conversion<int>(blstats, { NLE_BLSTATS_SIZE });
+        else
+            obs_.blstats =
+                checked_conversion<long>(blstats, { NLE_BLSTATS_SIZE });
         obs_.message = checked_conversion<uint8_t>(message, { 256 });
         obs_.program_state = checked_conversion<int>(
             std::move(program_state), { NLE_PROGRAM_STATE_SIZE });
@@ -147,6 +547,20 @@ class Nethack
         obs_.tty_colors = checked_conversion<int8_t>(
             tty_colors, { NLE_TERM_LI, NLE_TERM_CO });
         obs_.tty_cursor = checked_conversion<uint8_t>(tty_cursor, { 2 });
+        obs_.screen_description_ids =
+            checked_conversion<int>(screen_description_ids, dungeon);
+        obs_.inv_str_ids =
+            checked_conversion<int>(inv_str_ids, { NLE_INVENTORY_SIZE });
+        obs_.changed_keys = checked_conversion<long>(changed_keys, { 1 });
+        obs_.dirty_cells = checked_conversion<int16_t>(
+            dirty_cells, { NLE_DIRTY_CELLS_SIZE });
+        std::vector<ssize_t> crop{ 2 * obs_.crop_radius + 1,
+                                   2 * obs_.crop_radius + 1 };
+        obs_.glyphs_crop = checked_conversion<int16_t>(glyphs_crop, crop);
+        obs_.chars_crop = checked_conversion<uint8_t>(chars_crop, crop);
+        obs_.colors_crop = checked_conversion<uint8_t>(colors_crop, crop);
+        obs_.buffers_state = NLE_BUFFERS_UNKNOWN;
+        obs_.tty_drawn = false;
 
         py_buffers_ = { std::move(glyphs),
                         std::move(chars),
@@ -163,16 +577,132 @@ class Nethack
                         std::move(screen_descriptions),
                         std::move(tty_chars),
                         std::move(tty_colors),
-                        std::move(tty_cursor) };
+                        std::move(tty_cursor),
+                        std::move(screen_description_ids),
+                        std::move(inv_str_ids),
+                        std::move(changed_keys),
+                        std::move(dirty_cells),
+                        std::move(glyphs_crop),
+                        std::move(chars_crop),
+                        std::move(colors_crop) };
+    }
+
+    // Points the observation key at buffer and leaves the others alone.
+    // Much cheaper than set_buffers(), e.g. to write each step into the
+    // next slot of a rollout.
+    void
+    set_buffer(const std::string &key, py::object buffer)
+    {
+        auto point = [&](size_t index, auto field,
+                         const std::vector<ssize_t> &shape) {
+            point_buffer(index, field, shape, std::move(buffer));
+        };
+        if (!visit_obs_field(key, buffer, obs_.crop_radius, point))
+            throw std::invalid_argument("Unknown observation " + key);
+        if (key.compare(0, 4, "tty_") == 0)
+            obs_.tty_drawn = false;
+    }
+
+    // Swaps the buffers with the ones from before the previous flip, which
+    // start out as none. The buffers from before this flip keep their
+    // contents until the next one.
+    void
+    flip_buffers()
+    {
+        std::swap(obs_.glyphs, back_.glyphs);
+        std::swap(obs_.chars, back_.chars);
+        std::swap(obs_.colors, back_.colors);
+        std::swap(obs_.specials, back_.specials);
+        std::swap(obs_.blstats, back_.blstats);
+        std::swap(obs_.blstats_int32, back_.blstats_int32);
+        std::swap(obs_.message, back_.message);
+        std::swap(obs_.program_state, back_.program_state);
+        std::swap(obs_.internal, back_.internal);
+        std::swap(obs_.inv_glyphs, back_.inv_glyphs);
+        std::swap(obs_.inv_letters, back_.inv_letters);
+        std::swap(obs_.inv_oclasses, back_.inv_oclasses);
+        std::swap(obs_.inv_strs, back_.inv_strs);
+        std::swap(obs_.screen_descriptions, back_.screen_descriptions);
+        std::swap(obs_.tty_chars, back_.tty_chars);
+        std::swap(obs_.tty_colors, back_.tty_colors);
+        std::swap(obs_.tty_cursor, back_.tty_cursor);
+        std::swap(obs_.screen_description_ids, back_.screen_description_ids);
+        std::swap(obs_.inv_str_ids, back_.inv_str_ids);
+        std::swap(obs_.changed_keys, back_.changed_keys);
+        std::swap(obs_.dirty_cells, back_.dirty_cells);
+        std::swap(obs_.glyphs_crop, back_.glyphs_crop);
+        std::swap(obs_.chars_crop, back_.chars_crop);
+        std::swap(obs_.colors_crop, back_.colors_crop);
+        std::swap(py_buffers_, back_py_buffers_);
+        obs_.buffers_state = NLE_BUFFERS_UNKNOWN;
+
+        // The terminal only writes changed lines, so start from the old ones.
+        const size_t tty_size = NLE_TERM_LI * NLE_TERM_CO;
+        bool drawn = copy_buffer(obs_.tty_chars, back_.tty_chars, tty_size);
+        drawn &= copy_buffer(obs_.tty_colors, back_.tty_colors, tty_size);
+        drawn &= copy_buffer(obs_.tty_cursor, back_.tty_cursor, 2);
+        if (!drawn)
+            obs_.tty_drawn = false;
+    }
+
+    // Strings added to the string table since the last call, see
+    // StringTable.
+    std::vector<py::bytes>
+    string_table()
+    {
+        std::vector<py::bytes> result;
+        for (const std::string &str : StringTable::since(&string_table_next_))
+            result.emplace_back(str);
+        return result;
+    }
+
+    std::unique_ptr<Snapshot>
+    snapshot()
+    {
+        if (!started_)
+            throw std::runtime_error("snapshot called without reset()");
+        if (obs_.done)
+            throw std::runtime_error("Called snapshot on finished NetHack");
+        std::unique_ptr<Snapshot> snapshot(new Snapshot);
+        snapshot->snapshot_ = nle_snapshot(nle_);
+        if (!snapshot->snapshot_)
+            throw std::runtime_error(
+                "Snapshots aren't supported on this platform");
+        snapshot->nethack_ = this;
+        snapshots_.insert(snapshot.get());
+        return snapshot;
+    }
+
+    void
+    restore(const Snapshot &snapshot)
+    {
+        if (snapshot.nethack_ != this)
+            throw std::invalid_argument("Snapshot isn't from this game");
+        if (!nle_restore(nle_, &obs_, snapshot.snapshot_))
+            throw std::runtime_error("Couldn't restore snapshot");
+    }
+
+    void
+    free_snapshot(Snapshot *snapshot)
+    {
+        nle_free_snapshot(nle_, snapshot->snapshot_);
+        snapshots_.erase(snapshot);
     }
 
     void
     close()
     {
         if (nle_) {
+            for (Snapshot *snapshot : snapshots_) {
+                nle_free_snapshot(nle_, snapshot->snapshot_);
+                snapshot->nethack_ = nullptr;
+            }
+            snapshots_.clear();
             nle_end(nle_);
             nle_ = nullptr;
+            started_ = false;
         }
+        wait_ttyrec(); // For ttyrecs of earlier resets.
     }
 
     void
@@ -184,10 +714,115 @@ class Nethack
         use_seed_init = true;
     }
 
+    // Which prompts step(action, true) answers without returning.
+    void
+    set_prompt_policy(bool press_more, bool escape_getlin, bool escape_yn,
+                      std::vector<std::string> yn_exceptions)
+    {
+        yn_exceptions_ = std::move(yn_exceptions);
+        yn_exception_ptrs_.clear();
+        for (const std::string &e : yn_exceptions_)
+            yn_exception_ptrs_.push_back(e.c_str());
+        yn_exception_ptrs_.push_back(nullptr);
+
+        prompt_policy_.press_more = press_more;
+        prompt_policy_.escape_getlin = escape_getlin;
+        prompt_policy_.escape_yn = escape_yn;
+        prompt_policy_.yn_exceptions = yn_exception_ptrs_.data();
+    }
+
+    // Let the game write map changes into the buffers as they happen
+    // instead of copying the whole map each step. The buffers must then
+    // only be read between steps.
+    void
+    set_direct_write(bool direct_write)
+    {
+        obs_.direct_write = direct_write;
+        obs_.buffers_state = NLE_BUFFERS_UNKNOWN;
+    }
+
+    // Makes the *_crop observations the map cells at most radius away from
+    // the hero. Unsets their buffers, which need to be of the new size.
+    void
+    set_crop_radius(int radius)
+    {
+        if (radius < 0)
+            throw std::invalid_argument("crop_radius can't be negative");
+        obs_.crop_radius = radius;
+        for (nle_obs *obs : { &obs_, &back_ }) {
+            obs->glyphs_crop = nullptr;
+            obs->chars_crop = nullptr;
+            obs->colors_crop = nullptr;
+        }
+    }
+
+    // How to write the ttyrec, from the next reset() on. Level 0 is the
+    // codec's default.
+    void
+    set_ttyrec_codec(int codec, int level)
+    {
+        switch (codec) {
+        case NLE_TTYREC_BZ2:
+            if (level < 0 || level > 9)
+                throw std::invalid_argument("bz2 level must be 1 to 9");
+            break;
+        case NLE_TTYREC_ZSTD:
+#ifdef NLE_ZSTD_TTYRECS
+            break;
+#else
+            throw std::runtime_error(
+                "zstd ttyrecs aren't supported in this build");
+#endif
+        case NLE_TTYREC_NONE:
+        case NLE_TTYREC_RAW:
+        case NLE_TTYREC_KEYS:
+            break;
+        default:
+            throw std::invalid_argument("Unknown ttyrec codec");
+        }
+        obs_.ttyrec_codec = codec;
+        obs_.ttyrec_level = level;
+    }
+
+    // Compress and write the ttyrec on TtyrecWriter's thread instead of in
+    // step() and reset(), from the next reset() on. close() waits for it.
+    void
+    set_ttyrec_async(bool ttyrec_async)
+    {
+        obs_.ttyrec_writer = ttyrec_async ? &TtyrecWriter::take : nullptr;
+        obs_.ttyrec_writer_arg = ttyrec_async ? &ttyrec_sink_ : nullptr;
+    }
+
+    // Frames TtyrecWriter dropped as its queue was full.
+    long
+    ttyrec_frames_dropped()
+    {
+        return ttyrec_sink_.frames_dropped;
+    }
+
+    // Waits until TtyrecWriter wrote what this game handed it so far, e.g.
+    // to read the ttyrecs finished by reset().
+    void
+    wait_ttyrec()
+    {
+        if (ttyrec_async_)
+            TtyrecWriter::wait(&ttyrec_sink_);
+    }
+
+    // Start later episodes from a copy of the game taken just before the
+    // dungeon is generated. Takes effect from the next reset() on.
+    void
+    set_fork_startup(bool fork_startup)
+    {
+        fork_startup_ = fork_startup;
+        if (started_)
+            apply_fork_startup();
+    }
+
     void
     set_seeds(unsigned long core, unsigned long disp, bool reseed)
     {
-        if (!nle_)
+        if (!started_)
             throw std::runtime_error("set_seed called without reset()");
         nle_set_seed(nle_, core, disp, reseed);
     }
@@ -195,7 +830,7 @@ class Nethack
     std::tuple<unsigned long, unsigned long, bool>
     get_seeds()
     {
-        if (!nle_)
+        if (!started_)
             throw std::runtime_error("get_seed called without reset()");
         std::tuple<unsigned long, unsigned long, bool> result;
         char
@@ -213,40 +848,479 @@ class Nethack
     }
 
   private:
+    void
+    load_dlmopen()
+    {
+        nle_ = nle_load_dlmopen(dlpath_.c_str(), ttyrec_.get());
+        if (!nle_)
+            throw std::runtime_error("Couldn't load " + dlpath_
+                                     + " with dlmopen");
+    }
+
     void
     reset(FILE *ttyrec)
     {
-        if (!nle_) {
-            nle_ = nle_start(dlpath_.c_str(), &obs_,
-                             ttyrec ? ttyrec : ttyrec_.get(),
-                             use_seed_init ? &seed_init_ : nullptr);
-        } else
-            nle_reset(nle_, &obs_, ttyrec,
-                      use_seed_init ? &seed_init_ : nullptr);
+        if (!nle_ && dlmopen_)
+            load_dlmopen();
+        obs_.prompt_policy = nullptr;
+        {
+            // Let other threads run while the game generates its first level.
+            py::gil_scoped_release gil_released;
+            if (!nle_) {
+                nle_ = nle_start(dlpath_.c_str(), &obs_,
+                                 ttyrec ? ttyrec : ttyrec_.get(),
+                                 use_seed_init ? &seed_init_ : nullptr);
+            } else
+                nle_reset(nle_, &obs_, ttyrec,
+                          use_seed_init ? &seed_init_ : nullptr);
+        }
 
+        started_ = true;
+        ttyrec_async_ = obs_.ttyrec_writer != nullptr;
         use_seed_init = false;
+        if (fork_startup_)
+            apply_fork_startup();
 
         if (obs_.done)
             throw std::runtime_error("NetHack done right after reset");
     }
 
+    template <typename T>
+    void
+    point_buffer(size_t index, T *nle_obs::*field,
+                 const std::vector<ssize_t> &shape, py::object buffer)
+    {
+        obs_.*field = checked_conversion<T>(buffer, shape);
+        unset_other_blstats(obs_, field);
+        obs_.buffers_state = NLE_BUFFERS_UNKNOWN;
+        if (py_buffers_.size() <= index)
+            py_buffers_.resize(index + 1);
+        py_buffers_[index] = std::move(buffer);
+    }
+
+    void
+    apply_fork_startup()
+    {
+        // Also needed after nle_reset had to reload the library.
+        if (!nle_set_fork_startup(nle_, fork_startup_) && fork_startup_)
+            throw std::runtime_error(
+                "fork_startup isn't supported on this platform");
+    }
+
+    friend class BatchedNethack;
+
     std::string dlpath_;
     nle_obs obs_;
     std::vector<py::object> py_buffers_;
+    nle_obs back_ = {}; // Only the buffers, see flip_buffers().
+    std::vector<py::object> back_py_buffers_;
+    size_t string_table_next_ = 0;
     nle_seeds_init_t seed_init_;
     bool use_seed_init = false;
+    bool dlmopen_;
+    bool fork_startup_ = false;
+    nle_prompt_policy prompt_policy_ = {};
+    std::vector<std::string> yn_exceptions_;
+    std::vector<const char *> yn_exception_ptrs_;
     nle_ctx_t *nle_ = nullptr;
+    bool started_ = false;
     std::unique_ptr<std::FILE, int (*)(std::FILE *)> ttyrec_;
+    TtyrecWriter::Sink ttyrec_sink_;
+    bool ttyrec_async_ = false; // Whether TtyrecWriter writes ttyrec_.
+    std::unordered_set<Snapshot *> snapshots_;
+};
+
+Snapshot::~Snapshot()
+{
+    if (nethack_)
+        nethack_->free_snapshot(this);
+}
+
+// Splits a [N, *shape] array into N pointers to its rows. The rows need to
+// be C contiguous but can be any distance apart, e.g. for arr[:, t] of an
+// array of shape [N, T, *shape].
+template <typename T>
+std::vector<T *>
+checked_rows(py::handle h, ssize_t n, std::vector<ssize_t> shape)
+{
+    std::vector<T *> rows(n, nullptr);
+    if (h.is_none())
+        return rows;
+
+    ssize_t row_size = sizeof(T);
+    for (ssize_t s : shape)
+        row_size *= s;
+    shape.insert(shape.begin(), n);
+
+    py::buffer_info buf = checked_buffer<T>(h, shape);
+    if (!is_c_contiguous(buf, 1))
+        throw std::runtime_error("Array rows aren't C contiguous");
+    if (n > 1 && std::abs(buf.strides[0]) < row_size)
+        throw std::runtime_error("Array rows overlap");
+
+    for (ssize_t i = 0; i < n; ++i)
+        rows[i] = reinterpret_cast<T *>(static_cast<char *>(buf.ptr)
+                                        + i * buf.strides[0]);
+    return rows;
+}
+
+// N games stepped together in a single call. The NetHack context switches
+// run without the GIL. Observations of game i are written into row i of
+// [N, ...] arrays.
+class BatchedNethack
+{
+  public:
+    BatchedNethack(std::vector<std::string> dlpaths,
+                   std::vector<std::string> ttyrecs)
+    {
+        if (dlpaths.size() != ttyrecs.size())
+            throw std::invalid_argument(
+                "Need as many ttyrecs as dlpaths");
+        for (size_t i = 0; i < dlpaths.size(); ++i)
+            games_.emplace_back(new Nethack(dlpaths[i], ttyrecs[i], false));
+    }
+
+    size_t
+    size()
+    {
+        return games_.size();
+    }
+
+    void
+    step(py::object actions)
+    {
+        const ssize_t n = games_.size();
+        int *a = checked_conversion<int>(actions, { n });
+        if (!a)
+            throw std::invalid_argument("actions required");
+        for (auto &game : games_) {
+            if (!game->started_)
+                throw std::runtime_error("step called without reset()");
+        }
+
+        {
+            py::gil_scoped_release release;
+            for (ssize_t i = 0; i < n; ++i) {
+                Nethack &game = *games_[i];
+                if (game.obs_.done)
+                    continue;
+                game.obs_.action = a[i];
+                game.nle_ = nle_step(game.nle_, &game.obs_);
+            }
+        }
+        update_done();
+    }
+
+    void
+    reset(size_t i)
+    {
+        game(i).reset();
+        update_done();
+    }
+
+    void
+    reset(size_t i, std::string ttyrec)
+    {
+        game(i).reset(std::move(ttyrec));
+        update_done();
+    }
+
+    void
+    set_buffers(py::object glyphs, py::object chars, py::object colors,
+                py::object specials, py::object blstats, py::object message,
+                py::object program_state, py::object internal,
+                py::object inv_glyphs, py::object inv_letters,
+                py::object inv_oclasses, py::object inv_strs,
+                py::object screen_descriptions, py::object tty_chars,
+                py::object tty_colors, py::object tty_cursor,
+                py::object screen_description_ids, py::object inv_str_ids,
+                py::object changed_keys, py::object dirty_cells,
+                py::object glyphs_crop, py::object chars_crop,
+                py::object colors_crop, py::object done)
+    {
+        const ssize_t n = games_.size();
+        std::vector<ssize_t> dungeon{ ROWNO, COLNO - 1 };
+
+        auto glyphs_rows = checked_rows<int16_t>(glyphs, n, dungeon);
+        auto chars_rows = checked_rows<uint8_t>(chars, n, dungeon);
+        auto colors_rows = checked_rows<uint8_t>(colors, n, dungeon);
+        auto specials_rows = checked_rows<uint8_t>(specials, n, dungeon);
+        std::vector<long *> blstats_rows(n, nullptr);
+        std::vector<int *> blstats_int32_rows(n, nullptr);
+        if (has_dtype<int>(blstats))
+            blstats_int32_rows =
+                checked_rows<int>(blstats, n, { NLE_BLSTATS_SIZE });
+        else
+            blstats_rows =
+                checked_rows<long>(blstats, n, { NLE_BLSTATS_SIZE });
+        auto message_rows =
+            checked_rows<uint8_t>(message, n, { NLE_MESSAGE_SIZE });
+        auto program_state_rows = checked_rows<int>(
+            program_state, n, { NLE_PROGRAM_STATE_SIZE });
+        auto internal_rows =
+            checked_rows<int>(internal, n, { NLE_INTERNAL_SIZE });
+        auto inv_glyphs_rows =
+            checked_rows<int16_t>(inv_glyphs, n, { NLE_INVENTORY_SIZE });
+        auto inv_letters_rows =
+            checked_rows<uint8_t>(inv_letters, n, { NLE_INVENTORY_SIZE });
+        auto inv_oclasses_rows =
+            checked_rows<uint8_t>(inv_oclasses, n, { NLE_INVENTORY_SIZE });
+        auto inv_strs_rows = checked_rows<uint8_t>(
+            inv_strs, n, { NLE_INVENTORY_SIZE, NLE_INVENTORY_STR_LENGTH });
+        auto screen_descriptions_rows = checked_rows<uint8_t>(
+            screen_descriptions, n,
+            { ROWNO, COLNO - 1, NLE_SCREEN_DESCRIPTION_LENGTH });
+        auto tty_chars_rows = checked_rows<uint8_t>(
+            tty_chars, n, { NLE_TERM_LI, NLE_TERM_CO });
+        auto tty_colors_rows = checked_rows<int8_t>(
+            tty_colors, n, { NLE_TERM_LI, NLE_TERM_CO });
+        auto tty_cursor_rows = checked_rows<uint8_t>(tty_cursor, n, { 2 });
+        auto screen_description_ids_rows =
+            checked_rows<int>(screen_description_ids, n, dungeon);
+        auto inv_str_ids_rows =
+            checked_rows<int>(inv_str_ids, n, { NLE_INVENTORY_SIZE });
+        auto changed_keys_rows = checked_rows<long>(changed_keys, n, { 1 });
+        auto dirty_cells_rows =
+            checked_rows<int16_t>(dirty_cells, n, { NLE_DIRTY_CELLS_SIZE });
+        std::vector<ssize_t> crop{ 2 * crop_radius_ + 1,
+                                   2 * crop_radius_ + 1 };
+        auto glyphs_crop_rows = checked_rows<int16_t>(glyphs_crop, n, crop);
+        auto chars_crop_rows = checked_rows<uint8_t>(chars_crop, n, crop);
+        auto colors_crop_rows = checked_rows<uint8_t>(colors_crop, n, crop);
+        done_ = checked_conversion<bool>(done, { n });
+
+        for (ssize_t i = 0; i < n; ++i) {
+            nle_obs &obs = games_[i]->obs_;
+            obs.glyphs = glyphs_rows[i];
+            obs.chars = chars_rows[i];
+            obs.colors = colors_rows[i];
+            obs.specials = specials_rows[i];
+            obs.blstats = blstats_rows[i];
+            obs.blstats_int32 = blstats_int32_rows[i];
+            obs.message = message_rows[i];
+            obs.program_state = program_state_rows[i];
+            obs.internal = internal_rows[i];
+            obs.inv_glyphs = inv_glyphs_rows[i];
+            obs.inv_letters = inv_letters_rows[i];
+            obs.inv_oclasses = inv_oclasses_rows[i];
+            obs.inv_strs = inv_strs_rows[i];
+            obs.screen_descriptions = screen_descriptions_rows[i];
+            obs.tty_chars = tty_chars_rows[i];
+            obs.tty_colors = tty_colors_rows[i];
+            obs.tty_cursor = tty_cursor_rows[i];
+            obs.screen_description_ids = screen_description_ids_rows[i];
+            obs.inv_str_ids = inv_str_ids_rows[i];
+            obs.changed_keys = changed_keys_rows[i];
+            obs.dirty_cells = dirty_cells_rows[i];
+            obs.glyphs_crop = glyphs_crop_rows[i];
+            obs.chars_crop = chars_crop_rows[i];
+            obs.colors_crop = colors_crop_rows[i];
+            obs.buffers_state = NLE_BUFFERS_UNKNOWN;
+            obs.tty_drawn = false;
+        }
+
+        py_buffers_ = { std::move(glyphs),
+                        std::move(chars),
+                        std::move(colors),
+                        std::move(specials),
+                        std::move(blstats),
+                        std::move(message),
+                        std::move(program_state),
+                        std::move(internal),
+                        std::move(inv_glyphs),
+                        std::move(inv_letters),
+                        std::move(inv_oclasses),
+                        std::move(inv_strs),
+                        std::move(screen_descriptions),
+                        std::move(tty_chars),
+                        std::move(tty_colors),
+                        std::move(tty_cursor),
+                        std::move(screen_description_ids),
+                        std::move(inv_str_ids),
+                        std::move(changed_keys),
+                        std::move(dirty_cells),
+                        std::move(glyphs_crop),
+                        std::move(chars_crop),
+                        std::move(colors_crop),
+                        std::move(done) };
+        update_done();
+    }
+
+    // See Nethack::set_buffer(). Also takes "done".
+    void
+    set_buffer(const std::string &key, py::object buffer)
+    {
+        if (key == "done") {
+            done_ = checked_conversion<bool>(buffer, { ssize_t(size()) });
+            store_buffer(NUM_BUFFERS - 1, std::move(buffer));
+            update_done();
+            return;
+        }
+        auto point = [&](size_t index, auto field,
+                         const std::vector<ssize_t> &shape) {
+            point_rows(index, field, shape, std::move(buffer));
+        };
+        if (!visit_obs_field(key, buffer, crop_radius_, point))
+            throw std::invalid_argument("Unknown observation " + key);
+        if (key.compare(0, 4, "tty_") == 0) {
+            for (auto &game : games_)
+                game->obs_.tty_drawn = false;
+        }
+    }
+
+    // See Nethack::set_ttyrec_codec().
+    void
+    set_ttyrec_codec(int codec, int level)
+    {
+        for (auto &game : games_)
+            game->set_ttyrec_codec(codec, level);
+    }
+
+    // See Nethack::set_crop_radius().
+    void
+    set_crop_radius(int radius)
+    {
+        for (auto &game : games_)
+            game->set_crop_radius(radius);
+        crop_radius_ = radius;
+    }
+
+    // See Nethack::set_ttyrec_async().
+    void
+    set_ttyrec_async(bool ttyrec_async)
+    {
+        for (auto &game : games_)
+            game->set_ttyrec_async(ttyrec_async);
+    }
+
+    // See Nethack::wait_ttyrec().
+    void
+    wait_ttyrec()
+    {
+        for (auto &game : games_)
+            game->wait_ttyrec();
+    }
+
+    // Of all games, see Nethack::ttyrec_frames_dropped().
+    long
+    ttyrec_frames_dropped()
+    {
+        long frames_dropped = 0;
+        for (auto &game : games_)
+            frames_dropped += game->ttyrec_frames_dropped();
+        return frames_dropped;
+    }
+
+    std::vector<py::bytes>
+    string_table()
+    {
+        std::vector<py::bytes> result;
+        for (const std::string &str : StringTable::since(&string_table_next_))
+            result.emplace_back(str);
+        return result;
+    }
+
+    void
+    close()
+    {
+        for (auto &game : games_)
+            game->close();
+    }
+
+    void
+    set_initial_seeds(size_t i, unsigned long core, unsigned long disp,
+                      bool reseed)
+    {
+        game(i).set_initial_seeds(core, disp, reseed);
+    }
+
+    void
+    set_seeds(size_t i, unsigned long core, unsigned long disp, bool reseed)
+    {
+        game(i).set_seeds(core, disp, reseed);
+    }
+
+    std::tuple<unsigned long, unsigned long, bool>
+    get_seeds(size_t i)
+    {
+        return game(i).get_seeds();
+    }
+
+    boolean
+    in_normal_game(size_t i)
+    {
+        return game(i).in_normal_game();
+    }
+
+  private:
+    Nethack &
+    game(size_t i)
+    {
+        if (i >= games_.size())
+            throw py::index_error("game index out of range");
+        return *games_[i];
+    }
+
+    template <typename T>
+    void
+    point_rows(size_t index, T *nle_obs::*field,
+               const std::vector<ssize_t> &shape, py::object buffer)
+    {
+        std::vector<T *> rows = checked_rows<T>(buffer, size(), shape);
+        for (size_t i = 0; i < games_.size(); ++i) {
+            games_[i]->obs_.*field = rows[i];
+            unset_other_blstats(games_[i]->obs_, field);
+            games_[i]->obs_.buffers_state = NLE_BUFFERS_UNKNOWN;
+        }
+        store_buffer(index, std::move(buffer));
+    }
+
+    void
+    store_buffer(size_t index, py::object buffer)
+    {
+        py_buffers_.resize(NUM_BUFFERS);
+        py_buffers_[index] = std::move(buffer);
+    }
+
+    void
+    update_done()
+    {
+        if (!done_)
+            return;
+        for (size_t i = 0; i < games_.size(); ++i)
+            done_[i] = games_[i]->obs_.done;
+    }
+
+    // The observations in set_buffers() order, then done.
+    static constexpr size_t NUM_BUFFERS = 24;
+
+    std::vector<std::unique_ptr<Nethack> > games_;
+    std::vector<py::object> py_buffers_;
+    size_t string_table_next_ = 0;
+    bool *done_ = nullptr;
+    int crop_radius_ = NLE_CROP_RADIUS;
 };
 
 PYBIND11_MODULE(_pynethack, m)
 {
     m.doc() = "The NetHack Learning Environment";
 
+    m.def("set_ttyrec_writer", &TtyrecWriter::configure,
+          py::arg("queue_size"), py::arg("block"));
+
+    py::class_<Snapshot>(m, "Snapshot");
+
     py::class_<Nethack>(m, "Nethack")
-        .def(py::init<std::string, std::string>(), py::arg("dlpath"),
-             py::arg("ttyrec"))
-        .def("step", &Nethack::step, py::arg("action"))
+        .def(py::init<std::string, std::string, bool>(), py::arg("dlpath"),
+             py::arg("ttyrec"), py::arg("dlmopen") = false)
+        .def("step", &Nethack::step, py::arg("action"),
+             py::arg("handle_prompts") = false,
+             py::call_guard<py::gil_scoped_release>())
+        .def("step_repeat", &Nethack::step_repeat, py::arg("action"),
+             py::arg("repeat"), py::arg("handle_prompts") = false,
+             py::call_guard<py::gil_scoped_release>())
+        .def("step_sequence", &Nethack::step_sequence, py::arg("actions"),
+             py::call_guard<py::gil_scoped_release>())
         .def("done", &Nethack::done)
         .def("reset", py::overload_cast<>(&Nethack::reset))
         .def("reset", py::overload_cast<std::string>(&Nethack::reset))
@@ -263,12 +1337,90 @@ PYBIND11_MODULE(_pynethack, m)
              py::arg("screen_descriptions") = py::none(),
              py::arg("tty_chars") = py::none(),
              py::arg("tty_colors") = py::none(),
-             py::arg("tty_cursor") = py::none())
+             py::arg("tty_cursor") = py::none(),
+             py::arg("screen_description_ids") = py::none(),
+             py::arg("inv_str_ids") = py::none(),
+             py::arg("changed_keys") = py::none(),
+             py::arg("dirty_cells") = py::none(),
+             py::arg("glyphs_crop") = py::none(),
+             py::arg("chars_crop") = py::none(),
+             py::arg("colors_crop") = py::none())
+        .def("set_buffer", &Nethack::set_buffer, py::arg("key"),
+             py::arg("buffer"))
+        .def("flip_buffers", &Nethack::flip_buffers)
+        .def("string_table", &Nethack::string_table)
         .def("close", &Nethack::close)
         .def("set_initial_seeds", &Nethack::set_initial_seeds)
+        .def("set_prompt_policy", &Nethack::set_prompt_policy,
+             py::arg("press_more"), py::arg("escape_getlin"),
+             py::arg("escape_yn"), py::arg("yn_exceptions"))
+        .def("set_fork_startup", &Nethack::set_fork_startup,
+             py::arg("fork_startup"))
+        .def("set_direct_write", &Nethack::set_direct_write,
+             py::arg("direct_write"))
+        .def("set_crop_radius", &Nethack::set_crop_radius,
+             py::arg("crop_radius"))
+        .def("set_ttyrec_codec", &Nethack::set_ttyrec_codec,
+             py::arg("codec"), py::arg("level") = 0)
+        .def("set_ttyrec_async", &Nethack::set_ttyrec_async,
+             py::arg("ttyrec_async"))
+        .def("ttyrec_frames_dropped", &Nethack::ttyrec_frames_dropped)
+        .def("wait_ttyrec", &Nethack::wait_ttyrec,
+             py::call_guard<py::gil_scoped_release>())
         .def("set_seeds", &Nethack::set_seeds)
         .def("get_seeds", &Nethack::get_seeds)
-        .def("in_normal_game", &Nethack::in_normal_game);
+        .def("in_normal_game", &Nethack::in_normal_game)
+        .def("snapshot", &Nethack::snapshot)
+        .def("restore", &Nethack::restore, py::arg("snapshot"));
+    py::class_<BatchedNethack>(m, "BatchedNethack")
+        .def(py::init<std::vector<std::string>, std::vector<std::string> >(),
+             py::arg("dlpaths"), py::arg("ttyrecs"))
+        .def("__len__", &BatchedNethack::size)
+        .def("step", &BatchedNethack::step, py::arg("actions"))
+        .def("reset", py::overload_cast<size_t>(&BatchedNethack::reset),
+             py::arg("index"))
+        .def("reset",
+             py::overload_cast<size_t, std::string>(&BatchedNethack::reset),
+             py::arg("index"), py::arg("ttyrec"))
+        .def("set_buffers", &BatchedNethack::set_buffers,
+             py::arg("glyphs") = py::none(), py::arg("chars") = py::none(),
+             py::arg("colors") = py::none(), py::arg("specials") = py::none(),
+             py::arg("blstats") = py::none(), py::arg("message") = py::none(),
+             py::arg("program_state") = py::none(),
+             py::arg("internal") = py::none(),
+             py::arg("inv_glyphs") = py::none(),
+             py::arg("inv_letters") = py::none(),
+             py::arg("inv_oclasses") = py::none(),
+             py::arg("inv_strs") = py::none(),
+             py::arg("screen_descriptions") = py::none(),
+             py::arg("tty_chars") = py::none(),
+             py::arg("tty_colors") = py::none(),
+             py::arg("tty_cursor") = py::none(),
+             py::arg("screen_description_ids") = py::none(),
+             py::arg("inv_str_ids") = py::none(),
+             py::arg("changed_keys") = py::none(),
+             py::arg("dirty_cells") = py::none(),
+             py::arg("glyphs_crop") = py::none(),
+             py::arg("chars_crop") = py::none(),
+             py::arg("colors_crop") = py::none(),
+             py::arg("done") = py::none())
+        .def("set_buffer", &BatchedNethack::set_buffer, py::arg("key"),
+             py::arg("buffer"))
+        .def("set_crop_radius", &BatchedNethack::set_crop_radius,
+             py::arg("crop_radius"))
+        .def("set_ttyrec_codec", &BatchedNethack::set_ttyrec_codec,
+             py::arg("codec"), py::arg("level") = 0)
+        .def("set_ttyrec_async", &BatchedNethack::set_ttyrec_async,
+             py::arg("ttyrec_async"))
+        .def("ttyrec_frames_dropped", &BatchedNethack::ttyrec_frames_dropped)
+        .def("wait_ttyrec", &BatchedNethack::wait_ttyrec,
+             py::call_guard<py::gil_scoped_release>())
+        .def("string_table", &BatchedNethack::string_table)
+        .def("close", &BatchedNethack::close)
+        .def("set_initial_seeds", &BatchedNethack::set_initial_seeds)
+        .def("set_seeds", &BatchedNethack::set_seeds)
+        .def("get_seeds", &BatchedNethack::get_seeds)
+        .def("in_normal_game", &BatchedNethack::in_normal_game);
 
     py::module mn = m.def_submodule(
         "nethack", "Collection of NetHack constants and functions");
@@ -282,6 +1434,14 @@ PYBIND11_MODULE(_pynethack, m)
     mn.attr("NLE_INVENTORY_STR_LENGTH") = py::int_(NLE_INVENTORY_STR_LENGTH);
     mn.attr("NLE_SCREEN_DESCRIPTION_LENGTH") =
         py::int_(NLE_SCREEN_DESCRIPTION_LENGTH);
+    mn.attr("NLE_DIRTY_CELLS_SIZE") = py::int_(NLE_DIRTY_CELLS_SIZE);
+    mn.attr("NLE_ALL_CELLS_DIRTY") = py::int_(NLE_ALL_CELLS_DIRTY);
+    mn.attr("NLE_CROP_RADIUS") = py::int_(NLE_CROP_RADIUS);
+    mn.attr("NLE_TTYREC_BZ2") = py::int_(NLE_TTYREC_BZ2);
+    mn.attr("NLE_TTYREC_NONE") = py::int_(NLE_TTYREC_NONE);
+    mn.attr("NLE_TTYREC_RAW") = py::int_(NLE_TTYREC_RAW);
+    mn.attr("NLE_TTYREC_ZSTD") = py::int_(NLE_TTYREC_ZSTD);
+    mn.attr("NLE_TTYREC_KEYS") = py::int_(NLE_TTYREC_KEYS);
 
     /* NetHack constants. */
     mn.attr("ROWNO") = py::int_(ROWNO);
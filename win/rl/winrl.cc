@@ -1,8 +1,8 @@
 /* Copyright (c) Facebook, Inc. and its affiliates. */
 #include <array>
+#include <bitset>
 #include <cassert>
 #include <cstring>
-#include <deque>
 #include <iostream>
 #include <map>
 #include <memory>
@@ -10,6 +10,7 @@
 #include <string>
 #include <cstring>
 #include <unistd.h>
+#include <unordered_map>
 #include <vector>
 
 extern "C" {
@@ -56,36 +57,63 @@ extern unsigned long nle_seeds[];
 extern "C" {
 extern void *nle_yield(boolean);
 extern nle_obs *nle_get_obs();
+extern void nle_record_key(unsigned char);
 }
 
 namespace nethack_rl
 {
-std::deque<std::string> win_proc_calls;
+/*
+ * Plain data without heap allocations, as nle_reset in nle.c resets this
+ * library's data by overwriting it with a copy taken after loading.
+ */
+struct CallStack {
+    std::array<const char *, 16> calls;
+    size_t size;
+};
+
+CallStack win_proc_calls = {};
 bool in_yn_function = false;
 bool in_getlin = false;
+long action_score = -1; /* When the agent last acted, see observe(). */
+
+/*
+ * ID of the string (up to len chars) in the *_ids observations. The string
+ * table can't live here for the reason above, it's kept by our caller.
+ */
+int
+string_id(const char *str, size_t len)
+{
+    nle_obs *obs = nle_get_obs();
+    if (!obs->intern_string)
+        return 0;
+    return obs->intern_string(str, strnlen(str, len));
+}
 
 class ScopedStack
 {
   public:
-    ScopedStack(std::deque<std::string> &deque, std::string &&s)
-        : deque_(deque)
+    ScopedStack(CallStack &stack, const char *s) : stack_(stack)
     {
-        deque_.push_back(s);
+        if (stack_.size < stack_.calls.size())
+            stack_.calls[stack_.size] = s;
+        ++stack_.size;
     }
 
     ~ScopedStack()
     {
-        deque_.pop_back();
+        --stack_.size;
     }
 
   private:
-    std::deque<std::string> &deque_;
+    CallStack &stack_;
 };
 
 class NetHackRL
 {
   public:
     NetHackRL(int &argc, char **argv);
+    NetHackRL(const NetHackRL &);
+    NetHackRL &operator=(const NetHackRL &);
 
     static void rl_init_nhwindows(int *argc, char **argv);
     static void rl_player_selection();
@@ -139,6 +167,12 @@ class NetHackRL
                                  int percent, int color,
                                  unsigned long *colormasks);
 
+    static void rl_free_instance();
+    static void *rl_snapshot_instance();
+    static void *rl_release_instance();
+    static void rl_restore_instance(void *, const void *);
+    static void rl_free_snapshot(void *);
+
   private:
     struct rl_menu_item {
         int glyph;           /* character glyph */
@@ -165,6 +199,7 @@ class NetHackRL
         char object_class;
         // TODO: Don't heap allocate this stuff.
         std::string object_class_name;
+        int str_id; /* -1 until needed. */
     };
 
     static std::unique_ptr<NetHackRL> instance;
@@ -181,12 +216,53 @@ class NetHackRL
 
     std::array<char, (COLNO - 1) * ROWNO * NLE_SCREEN_DESCRIPTION_LENGTH> screen_descriptions_;
 
+    std::array<int, (COLNO - 1) * ROWNO> screen_description_ids_;
+
+    /* Cells printed to since their screen description was last computed. */
+    std::bitset<(COLNO - 1) * ROWNO> stale_descriptions_;
+
+    /* LRU cache for descriptions that only depend on the glyph. */
+    static const size_t DESCRIPTION_CACHE_SIZE = 512;
+    struct rl_description {
+        unsigned long last_used;
+        std::array<char, NLE_SCREEN_DESCRIPTION_LENGTH> text;
+        int id; /* -1 until needed. */
+    };
+    std::unordered_map<int, rl_description> description_cache_;
+    unsigned long description_clock_ = 0;
+
+    /* What changed since the agent's last step, see nle_obs. */
+    long changed_keys_ = NLE_CHANGED_ALL;
+    std::bitset<(COLNO - 1) * ROWNO> dirty_cells_;
+    std::array<long, NLE_BLSTATS_SIZE> last_blstats_;
+    std::array<unsigned char, NLE_MESSAGE_SIZE> last_message_;
+    std::array<int, NLE_PROGRAM_STATE_SIZE> last_program_state_;
+    std::array<int, NLE_INTERNAL_SIZE> last_internal_;
+
+    template <typename T, typename U, size_t N>
+    void note_change(long key, const T *data, std::array<U, N> &last);
+    template <typename T, size_t N>
+    void store_crop(T *crop, const std::array<T, N> &map, T padding,
+                    int radius);
+    void mark_all_changed();
+    void publish_changes(nle_obs *);
+    static nle_obs *direct_obs();
+    static void forget_buffers();
+
     void store_glyph(XCHAR_P x, XCHAR_P y, int glyph);
     void store_mapped_glyph(int ch, int color, int special, XCHAR_P x,
                             XCHAR_P y);
-    void store_screen_description(XCHAR_P x, XCHAR_P y, int glyph);
+    void store_screen_description(XCHAR_P x, XCHAR_P y);
+    void update_screen_descriptions();
+    static bool wants_screen_descriptions(nle_obs *);
+    int description_cache_key(XCHAR_P x, XCHAR_P y, int glyph);
 
+    bool in_normal_game();
     void fill_obs(nle_obs *);
+    int prompt_policy_key(nle_obs *);
+    int queued_key(nle_obs *);
+    int repeated_key(nle_obs *);
+    void observe(nle_obs *);
     int getch_method();
 
     std::array<std::string, MAXBLSTATS> status_;
@@ -215,20 +291,68 @@ class NetHackRL
 std::unique_ptr<NetHackRL> NetHackRL::instance =
     std::unique_ptr<NetHackRL>(nullptr);
 
-NetHackRL::NetHackRL(int &argc, char **argv) : glyphs_()
+NetHackRL::NetHackRL(int &argc, char **argv)
+    : glyphs_(), screen_description_ids_(), last_blstats_(),
+      last_message_(), last_program_state_(), last_internal_()
 {
+    mark_all_changed();
+    forget_buffers();
     // create base window
     // (done in tty_init_nhwindows before this NetHackRL object got created).
     assert(BASE_WINDOW == 0);
     windows_.emplace_back(new rl_window({ NHW_BASE }));
 }
 
+/* For snapshots, see nle_snapshot in nle.c. */
+NetHackRL::NetHackRL(const NetHackRL &other)
+{
+    *this = other;
+}
+
+NetHackRL &
+NetHackRL::operator=(const NetHackRL &other)
+{
+    windows_.clear();
+    for (const auto &window : other.windows_)
+        windows_.emplace_back(window ? new rl_window(*window) : nullptr);
+    glyphs_ = other.glyphs_;
+    chars_ = other.chars_;
+    colors_ = other.colors_;
+    specials_ = other.specials_;
+    screen_descriptions_ = other.screen_descriptions_;
+    screen_description_ids_ = other.screen_description_ids_;
+    stale_descriptions_ = other.stale_descriptions_;
+    description_cache_ = other.description_cache_;
+    description_clock_ = other.description_clock_;
+    changed_keys_ = other.changed_keys_;
+    dirty_cells_ = other.dirty_cells_;
+    last_blstats_ = other.last_blstats_;
+    last_message_ = other.last_message_;
+    last_program_state_ = other.last_program_state_;
+    last_internal_ = other.last_internal_;
+    status_ = other.status_;
+    condition_bits_ = other.condition_bits_;
+    inventory_ = other.inventory_;
+    return *this;
+}
+
 void
 NetHackRL::player_selection_method()
 {
     windows_[BASE_WINDOW]->strings.clear();
 }
 
+bool
+NetHackRL::in_normal_game()
+{
+    // Game not yet started (!something_worth_saving && !in_moveloop -- we
+    // need both as something_worth_saving also becomes false in
+    // really_done(), but we still want to see the "Do you want..."
+    // questions) or windows have already been destroyed.
+    return (program_state.something_worth_saving || program_state.in_moveloop)
+           && iflags.window_inited;
+}
+
 void
 NetHackRL::fill_obs(nle_obs *obs)
 {
@@ -257,15 +381,19 @@ NetHackRL::fill_obs(nle_obs *obs)
         obs->internal[6] = nle_seeds[1]; /* disp */
         obs->internal[7] = u.uhunger;
     }
+    note_change(NLE_CHANGED_PROGRAM_STATE, obs->program_state,
+                last_program_state_);
+    note_change(NLE_CHANGED_INTERNAL, obs->internal, last_internal_);
 
-    if ((!program_state.something_worth_saving && !program_state.in_moveloop)
-        || !iflags.window_inited) {
-        // Game not yet started (!something_worth_saving && !in_moveloop -- we
-        // need both as something_worth_saving also becomes false in
-        // really_done(), but we still want to see the "Do you want..."
-        // questions) or windows have already been destroyed. Return zero
-        // observations.
+    if (!in_normal_game()) {
+        // Return zero observations.
         obs->in_normal_game = false;
+        if (obs->buffers_state == NLE_BUFFERS_ZEROED) {
+            // Still zero from last time, see direct_write.
+            mark_all_changed();
+            publish_changes(obs);
+            return;
+        }
         if (obs->glyphs)
             std::memset(obs->glyphs, 0, sizeof(int16_t) * glyphs_.size());
         if (obs->chars)
@@ -278,26 +406,57 @@ NetHackRL::fill_obs(nle_obs *obs)
             std::memset(obs->message, 0, NLE_MESSAGE_SIZE);
         if (obs->blstats)
             std::memset(obs->blstats, 0, sizeof(long) * NLE_BLSTATS_SIZE);
+        if (obs->blstats_int32)
+            std::memset(obs->blstats_int32, 0,
+                        sizeof(int) * NLE_BLSTATS_SIZE);
         if (obs->screen_descriptions)
             std::memset(obs->screen_descriptions, 0,
                         screen_descriptions_.size());
+        if (obs->screen_description_ids)
+            std::memset(obs->screen_description_ids, 0,
+                        sizeof(int) * screen_description_ids_.size());
+        if (obs->inv_str_ids)
+            std::memset(obs->inv_str_ids, 0,
+                        sizeof(int) * NLE_INVENTORY_SIZE);
+        size_t crop_size = (2 * obs->crop_radius + 1)
+                           * (2 * obs->crop_radius + 1);
+        if (obs->glyphs_crop)
+            std::memset(obs->glyphs_crop, 0, sizeof(int16_t) * crop_size);
+        if (obs->chars_crop)
+            std::memset(obs->chars_crop, 0, crop_size);
+        if (obs->colors_crop)
+            std::memset(obs->colors_crop, 0, crop_size);
+        if (obs->direct_write)
+            obs->buffers_state = NLE_BUFFERS_ZEROED;
+        mark_all_changed();
+        publish_changes(obs);
         return;
     }
     obs->in_normal_game = true;
 
-    if (obs->glyphs) {
+    // With direct_write, the map observations are updated as they change
+    // (see direct_obs) once they have been copied here.
+    bool copy_map = obs->buffers_state != NLE_BUFFERS_MAP;
+    if (obs->glyphs && copy_map) {
         std::memcpy(obs->glyphs, glyphs_.data(),
                     sizeof(int16_t) * glyphs_.size());
     }
-    if (obs->chars) {
+    if (obs->chars && copy_map) {
         std::memcpy(obs->chars, chars_.data(), chars_.size());
     }
-    if (obs->colors) {
+    if (obs->colors && copy_map) {
         std::memcpy(obs->colors, colors_.data(), colors_.size());
     }
-    if (obs->specials) {
+    if (obs->specials && copy_map) {
         std::memcpy(obs->specials, specials_.data(), specials_.size());
     }
+    // Padded with what clear_nhwindow_method fills the map with.
+    if (obs->glyphs_crop)
+        store_crop(obs->glyphs_crop, glyphs_, (int16_t) 0, obs->crop_radius);
+    if (obs->chars_crop)
+        store_crop(obs->chars_crop, chars_, (uint8_t) ' ', obs->crop_radius);
+    if (obs->colors_crop)
+        store_crop(obs->colors_crop, colors_, (uint8_t) 0, obs->crop_radius);
     if (obs->message) {
         // TODO: This doesn't show anything in situations where there's too
         // many items at one tile, which will get displayed in a new window.
@@ -319,7 +478,7 @@ NetHackRL::fill_obs(nle_obs *obs)
             std::memset(obs->message, 0, NLE_MESSAGE_SIZE);
         }
     }
-    if (obs->blstats) {
+    if (obs->blstats || obs->blstats_int32) {
         // Blstats
         int hitpoints;
 
@@ -365,7 +524,11 @@ NetHackRL::fill_obs(nle_obs *obs)
 
         assert(sizeof(blstats) == NLE_BLSTATS_SIZE * sizeof(long));
 
-        std::memcpy(obs->blstats, &blstats[0], sizeof(blstats));
+        if (obs->blstats)
+            std::memcpy(obs->blstats, &blstats[0], sizeof(blstats));
+        if (obs->blstats_int32)
+            std::copy(std::begin(blstats), std::end(blstats),
+                      obs->blstats_int32);
     }
     if (obs->inv_glyphs) {
         /* This iterates over the inventory_ vector list once per inv
@@ -393,6 +556,17 @@ NetHackRL::fill_obs(nle_obs *obs)
             obs->inv_strs[i] = 0;
         }
     }
+    if (obs->inv_str_ids) {
+        int i = 0;
+        for (rl_inventory_item &item : inventory_) {
+            if (item.str_id < 0)
+                item.str_id = string_id(item.str.c_str(), item.str.size());
+            obs->inv_str_ids[i++] = item.str_id;
+        }
+        for (; i < NLE_INVENTORY_SIZE; ++i) {
+            obs->inv_str_ids[i] = 0;
+        }
+    }
     if (obs->inv_letters) {
         int i = 0;
         for (const rl_inventory_item &item : inventory_) {
@@ -411,16 +585,155 @@ NetHackRL::fill_obs(nle_obs *obs)
             obs->inv_oclasses[i] = MAXOCLASSES;
         }
     }
-    if (obs->screen_descriptions) {
+    if (wants_screen_descriptions(obs))
+        update_screen_descriptions();
+    if (obs->screen_descriptions && copy_map) {
         memcpy(obs->screen_descriptions, &screen_descriptions_, screen_descriptions_.size());
     }
+    if (obs->screen_description_ids && copy_map) {
+        std::memcpy(obs->screen_description_ids,
+                    screen_description_ids_.data(),
+                    sizeof(int) * screen_description_ids_.size());
+    }
+    note_change(NLE_CHANGED_BLSTATS, obs->blstats, last_blstats_);
+    note_change(NLE_CHANGED_BLSTATS, obs->blstats_int32, last_blstats_);
+    note_change(NLE_CHANGED_MESSAGE, obs->message, last_message_);
+    publish_changes(obs);
+    if (obs->direct_write)
+        obs->buffers_state = NLE_BUFFERS_MAP;
+}
+
+// The observation to write map changes to right away, see fill_obs.
+nle_obs *
+NetHackRL::direct_obs()
+{
+    nle_obs *obs = nle_get_obs();
+    return obs && obs->buffers_state == NLE_BUFFERS_MAP ? obs : nullptr;
+}
+
+// Makes the next fill_obs copy everything, e.g. after the map got replaced.
+void
+NetHackRL::forget_buffers()
+{
+    nle_obs *obs = nle_get_obs();
+    if (obs)
+        obs->buffers_state = NLE_BUFFERS_UNKNOWN;
+}
+
+// Sets changed_keys and dirty_cells. The tty_* bits get added by nle_yield
+// in nle.c, as the terminal is only updated there.
+void
+NetHackRL::publish_changes(nle_obs *obs)
+{
+    if (obs->changed_keys)
+        *obs->changed_keys = changed_keys_;
+    if (obs->dirty_cells) {
+        int n = 0;
+        if (dirty_cells_.count() > NLE_DIRTY_CELLS_SIZE) {
+            obs->dirty_cells[n++] = NLE_ALL_CELLS_DIRTY;
+        } else {
+            for (size_t i = 0; i < dirty_cells_.size(); ++i) {
+                if (dirty_cells_.test(i))
+                    obs->dirty_cells[n++] = i;
+            }
+        }
+        for (; n < NLE_DIRTY_CELLS_SIZE; ++n) {
+            obs->dirty_cells[n] = -1;
+        }
+    }
+}
+
+// Returns the key to answer the current prompt with according to
+// obs->prompt_policy, or 0 if the agent should answer it.
+int
+NetHackRL::prompt_policy_key(nle_obs *obs)
+{
+    const nle_prompt_policy *policy = obs->prompt_policy;
+    if (!policy)
+        return 0;
+    if (xwaitingforspace && policy->press_more)
+        return ' ';
+    if (in_getlin && policy->escape_getlin)
+        return '\033';
+    if (!in_yn_function || !policy->escape_yn)
+        return 0;
+
+    if (in_normal_game()) {
+        // The question as the message observation would show it.
+        std::string question =
+            windows_[WIN_MESSAGE]->strings.back().substr(0, NLE_MESSAGE_SIZE);
+        for (const char **e = policy->yn_exceptions; e && *e; ++e) {
+            if (question.find(*e) != std::string::npos)
+                return 0;
+        }
+    }
+    // Like NLE, leave whatever comes after a declined question to the agent.
+    obs->prompt_policy = nullptr;
+    return '\033';
+}
+
+// Returns the next of obs->queued_actions, or 0 if there is none or the
+// game waits at a --More-- that it wouldn't dismiss.
+int
+NetHackRL::queued_key(nle_obs *obs)
+{
+    if (obs->num_queued_actions <= 0)
+        return 0;
+    int i = obs->queued_actions[0];
+    if (xwaitingforspace && !std::strchr(" \r\n\033", i))
+        return 0;
+    ++obs->queued_actions;
+    --obs->num_queued_actions;
+    return i ? i : '\033'; /* See below. */
+}
+
+// Returns obs->action if it should be repeated, i.e., if the game is back
+// at its command prompt and there's no new message.
+int
+NetHackRL::repeated_key(nle_obs *obs)
+{
+    if (obs->num_repeats <= 0 || !iflags.in_parse || program_state.gameover
+        || xwaitingforspace || (ttyDisplay && ttyDisplay->toplin == 1))
+        return 0;
+    --obs->num_repeats;
+    ++obs->num_repeated;
+    return obs->action ? obs->action : '\033';
+}
+
+void
+NetHackRL::observe(nle_obs *obs)
+{
+    fill_obs(obs);
+    if (in_normal_game() && action_score >= 0)
+        obs->score_delta = botl_score() - action_score;
 }
 
 int
 NetHackRL::getch_method()
 {
-    fill_obs(nle_get_obs());
-    int i = ((nle_obs *) nle_yield(TRUE))->action;
+    nle_obs *obs = nle_get_obs();
+    int i = prompt_policy_key(obs);
+    if (i)
+        obs->num_repeats = 0; /* Something happened, let the agent see. */
+    else
+        i = queued_key(obs);
+    if (!i)
+        i = repeated_key(obs);
+    if (i) {
+        // The game may end before yielding again. Its last frame should
+        // still be what it would have shown here.
+        if (program_state.gameover)
+            observe(obs);
+        nle_record_key(i);
+    } else {
+        observe(obs);
+        obs = (nle_obs *) nle_yield(TRUE);
+        changed_keys_ = 0;
+        dirty_cells_.reset();
+        i = obs->action;
+        obs->score_delta = 0;
+        action_score = in_normal_game() ? botl_score() : -1;
+    }
 
     /* NOT calling tty_nhgetch() but instead getting the input from
        the context switch. No stdin required. The following code is from
@@ -454,8 +767,12 @@ NetHackRL::update_inventory_method()
         inventory_.emplace_back(
             rl_inventory_item{ obj_to_glyph(otmp, rn2_on_display_rng),
                                doname(otmp), otmp->invlet, otmp->oclass,
-                               let_to_name(otmp->oclass, false, false) });
+                               let_to_name(otmp->oclass, false, false),
+                               -1 });
     }
+    changed_keys_ |= NLE_CHANGED_INV_GLYPHS | NLE_CHANGED_INV_STRS
+                     | NLE_CHANGED_INV_LETTERS | NLE_CHANGED_INV_OCLASSES
+                     | NLE_CHANGED_INV_STR_IDS;
 }
 
 void
@@ -467,7 +784,14 @@ NetHackRL::store_glyph(XCHAR_P x, XCHAR_P y, int glyph)
     size_t offset = j * (COLNO - 1) + i;
 
     // TODO: Glyphs might be taken from gbuf[y][x].glyph.
-    glyphs_[offset] = glyph;
+    if (glyphs_[offset] != glyph) {
+        glyphs_[offset] = glyph;
+        changed_keys_ |= NLE_CHANGED_GLYPHS;
+        dirty_cells_.set(offset);
+        nle_obs *obs = direct_obs();
+        if (obs && obs->glyphs)
+            obs->glyphs[offset] = glyph;
+    }
 }
 
 void
@@ -479,35 +803,188 @@ NetHackRL::store_mapped_glyph(int ch, int color, int special, XCHAR_P x,
     size_t j = y % ROWNO;
     size_t offset = j * (COLNO - 1) + i;
 
-    chars_[offset] = ch;
-    colors_[offset] = color;
-    specials_[offset] = special;
+    nle_obs *obs = direct_obs();
+    if (chars_[offset] != ch) {
+        chars_[offset] = ch;
+        changed_keys_ |= NLE_CHANGED_CHARS;
+        dirty_cells_.set(offset);
+        if (obs && obs->chars)
+            obs->chars[offset] = ch;
+    }
+    if (colors_[offset] != color) {
+        colors_[offset] = color;
+        changed_keys_ |= NLE_CHANGED_COLORS;
+        dirty_cells_.set(offset);
+        if (obs && obs->colors)
+            obs->colors[offset] = color;
+    }
+    if (specials_[offset] != special) {
+        specials_[offset] = special;
+        changed_keys_ |= NLE_CHANGED_SPECIALS;
+        dirty_cells_.set(offset);
+        if (obs && obs->specials)
+            obs->specials[offset] = special;
+    }
+}
+
+// Returns the key for glyph's description in description_cache_, or -1 if
+// the description at (x, y) depends on more than the glyph. That's the case
+// for monsters and objects, but also for some map features (see lookat() in
+// pager.c).
+int
+NetHackRL::description_cache_key(XCHAR_P x, XCHAR_P y, int glyph)
+{
+    if (!glyph_is_cmap(glyph) || glyph_is_trap(glyph))
+        return -1;
+    switch (glyph_to_cmap(glyph)) {
+    case S_stone:
+    case S_altar:
+    case S_ndoor:
+    case S_cloud:
+        return -1;
+    }
+    if ((x == u.ux && y == u.uy) || u.uswallow || Underwater
+        || iflags.terrainmode)
+        return -1;
+    // The symbol set (e.g. on the Rogue level) changes how glyphs map to
+    // symbols, which changes the description.
+    return glyph * 2 + (currentgraphics == ROGUESET);
 }
 
 void
-NetHackRL::store_screen_description(XCHAR_P x, XCHAR_P y, int glyph)
+NetHackRL::store_screen_description(XCHAR_P x, XCHAR_P y)
 {
     // 1 <= x < cols, 0 <= y < rows (!)
     size_t i = (x - 1) % (COLNO - 1);
     size_t j = y % ROWNO;
     size_t offset = j * (COLNO - 1) + i;
+
+    bool want_id = nle_get_obs()->screen_description_ids != nullptr;
+    std::array<char, NLE_SCREEN_DESCRIPTION_LENGTH> description;
+    int id = -1;
+
+    int key = description_cache_key(x, y, glyph_at(x, y));
+    auto it = key >= 0 ? description_cache_.find(key)
+                       : description_cache_.end();
+    if (it != description_cache_.end()) {
+        rl_description &entry = it->second;
+        entry.last_used = ++description_clock_;
+        description = entry.text;
+        if (want_id && entry.id < 0)
+            entry.id = string_id(description.data(), description.size());
+        id = entry.id;
+    } else {
+        // see code in src/do_name.c:538 auto_describe
+        coord cc;
+        int sym = 0;
+        char tmpbuf[BUFSZ];
+        const char *firstmatch = "unknown";
+
+        cc.x = x;
+        cc.y = y;
+
+        if (do_screen_description(cc, TRUE, sym, tmpbuf, &firstmatch,
+                                  (struct permonst **) 0)) {
+            strncpy(description.data(), firstmatch, description.size());
+        } else {
+            strncpy(description.data(), "", description.size());
+        }
+        if (want_id)
+            id = string_id(description.data(), description.size());
+
+        if (key >= 0) {
+            if (description_cache_.size() >= DESCRIPTION_CACHE_SIZE) {
+                auto lru = description_cache_.begin();
+                for (it = lru; it != description_cache_.end(); ++it) {
+                    if (it->second.last_used < lru->second.last_used)
+                        lru = it;
+                }
+                description_cache_.erase(lru);
+            }
+            description_cache_[key] = { ++description_clock_, description,
+                                        id };
+        }
+    }
+
+    nle_obs *obs = direct_obs();
     size_t start = offset * NLE_SCREEN_DESCRIPTION_LENGTH;
+    if (std::memcmp(&screen_descriptions_[start], description.data(),
+                    description.size())) {
+        std::memcpy(&screen_descriptions_[start], description.data(),
+                    description.size());
+        changed_keys_ |= NLE_CHANGED_SCREEN_DESCRIPTIONS;
+        dirty_cells_.set(offset);
+        if (obs && obs->screen_descriptions)
+            std::memcpy(&obs->screen_descriptions[start], description.data(),
+                        description.size());
+    }
+    if (!want_id)
+        id = 0;
+    if (screen_description_ids_[offset] != id) {
+        screen_description_ids_[offset] = id;
+        changed_keys_ |= NLE_CHANGED_SCREEN_DESCRIPTION_IDS;
+        dirty_cells_.set(offset);
+        if (obs && obs->screen_description_ids)
+            obs->screen_description_ids[offset] = id;
+    }
+}
+
+bool
+NetHackRL::wants_screen_descriptions(nle_obs *obs)
+{
+    return obs->screen_descriptions || obs->screen_description_ids;
+}
 
-    // see code in src/do_name.c:538 auto_describe
-    coord cc;
-    int sym = 0;
-    char tmpbuf[BUFSZ];
-    const char *firstmatch = "unknown";
+// Marks key as changed if data, an observation of size N, differs from
+// last, its value at the previous fill_obs.
+// Copies the square of map cells at most radius away from the hero into crop,
+// with padding for the cells beyond the map's edges.
+template <typename T, size_t N>
+void
+NetHackRL::store_crop(T *crop, const std::array<T, N> &map, T padding,
+                      int radius)
+{
+    // See store_glyph.
+    int x0 = u.ux - 1 - radius;
+    int y0 = u.uy - radius;
+    for (int y = y0; y <= y0 + 2 * radius; ++y) {
+        for (int x = x0; x <= x0 + 2 * radius; ++x) {
+            if (y < 0 || y >= ROWNO || x < 0 || x >= COLNO - 1)
+                *crop++ = padding;
+            else
+                *crop++ = map[y * (COLNO - 1) + x];
+        }
+    }
+}
+
+template <typename T, typename U, size_t N>
+void
+NetHackRL::note_change(long key, const T *data, std::array<U, N> &last)
+{
+    if (!data || std::equal(last.begin(), last.end(), data))
+        return;
+    std::copy(data, data + N, last.begin());
+    changed_keys_ |= key;
+}
 
-    cc.x = x;
-    cc.y = y;
+void
+NetHackRL::mark_all_changed()
+{
+    changed_keys_ = NLE_CHANGED_ALL;
+    dirty_cells_.set();
+}
 
-    if (do_screen_description(cc, TRUE, sym, tmpbuf, &firstmatch,
-                              (struct permonst **) 0)) {
-        strncpy((char *) &screen_descriptions_ + start, firstmatch, NLE_SCREEN_DESCRIPTION_LENGTH);
-    } else {
-        strncpy((char *) &screen_descriptions_ + start, "", NLE_SCREEN_DESCRIPTION_LENGTH);
+void
+NetHackRL::update_screen_descriptions()
+{
+    if (stale_descriptions_.none())
+        return;
+    for (size_t offset = 0; offset < stale_descriptions_.size(); ++offset) {
+        if (stale_descriptions_.test(offset))
+            store_screen_description(offset % (COLNO - 1) + 1,
+                                     offset / (COLNO - 1));
     }
+    stale_descriptions_.reset();
 }
 
 void
@@ -593,8 +1070,16 @@ NetHackRL::clear_nhwindow_method(winid wid)
         chars_.fill(' ');
         colors_.fill(0);
         specials_.fill(0);
-        if (nle_get_obs()->screen_descriptions) {
+        changed_keys_ |= NLE_CHANGED_GLYPHS | NLE_CHANGED_CHARS
+                         | NLE_CHANGED_COLORS | NLE_CHANGED_SPECIALS
+                         | NLE_CHANGED_SCREEN_DESCRIPTIONS
+                         | NLE_CHANGED_SCREEN_DESCRIPTION_IDS;
+        dirty_cells_.set();
+        forget_buffers();
+        if (wants_screen_descriptions(nle_get_obs())) {
             screen_descriptions_.fill(0);
+            screen_description_ids_.fill(0);
+            stale_descriptions_.reset();
         }
     }
 
@@ -693,6 +1178,53 @@ NetHackRL::rl_exit_nhwindows(const char *c)
     tty_exit_nhwindows(c);
 }
 
+void
+NetHackRL::rl_free_instance()
+{
+    instance.reset(nullptr);
+}
+
+void *
+NetHackRL::rl_snapshot_instance()
+{
+    return instance ? new NetHackRL(*instance) : nullptr;
+}
+
+void *
+NetHackRL::rl_release_instance()
+{
+    return instance.release();
+}
+
+/* Called after nle_restore overwrote instance with its old value. */
+void
+NetHackRL::rl_restore_instance(void *current, const void *snapshot)
+{
+    instance.release();
+    std::unique_ptr<NetHackRL> window(static_cast<NetHackRL *>(current));
+    auto saved = static_cast<const NetHackRL *>(snapshot);
+    if (saved) {
+        // Keep the current object if there is one: Its address may still
+        // be on the game's stack.
+        if (window)
+            *window = *saved;
+        else
+            window.reset(new NetHackRL(*saved));
+        window->mark_all_changed();
+        forget_buffers();
+        window->fill_obs(nle_get_obs());
+    } else {
+        window.reset(nullptr);
+    }
+    instance = std::move(window);
+}
+
+void
+NetHackRL::rl_free_snapshot(void *snapshot)
+{
+    delete static_cast<NetHackRL *>(snapshot);
+}
+
 void
 NetHackRL::rl_suspend_nhwindows(const char *c)
 {
@@ -878,8 +1410,10 @@ NetHackRL::rl_print_glyph(winid wid, XCHAR_P x, XCHAR_P y, int glyph,
     if (wid == WIN_MAP) {
         instance->store_glyph(x, y, glyph);
         instance->store_mapped_glyph(ch, color, special, x, y);
-        if (nle_get_obs()->screen_descriptions) {
-            instance->store_screen_description(x, y, glyph);
+        if (wants_screen_descriptions(nle_get_obs())) {
+            // Computed lazily in fill_obs.
+            instance->stale_descriptions_.set(
+                (y % ROWNO) * (COLNO - 1) + (x - 1) % (COLNO - 1));
         }
     } else {
         DEBUG_API("Window id is " << wid << ". This shouldn't happen."
@@ -1072,6 +1606,38 @@ rl_update_positionbar(char *chrs)
 
 } // namespace nethack_rl
 
+/* For games that end without exit_nhwindows, e.g. when reset early. */
+extern "C" void
+rl_free_nhwindows()
+{
+    nethack_rl::NetHackRL::rl_free_instance();
+}
+
+/* See nle_snapshot and nle_restore in nle.c. */
+extern "C" void *
+rl_snapshot_nhwindows()
+{
+    return nethack_rl::NetHackRL::rl_snapshot_instance();
+}
+
+extern "C" void *
+rl_release_nhwindows()
+{
+    return nethack_rl::NetHackRL::rl_release_instance();
+}
+
+extern "C" void
+rl_restore_nhwindows(void *current, const void *snapshot)
+{
+    nethack_rl::NetHackRL::rl_restore_instance(current, snapshot);
+}
+
+extern "C" void
+rl_free_nhwindows_snapshot(void *snapshot)
+{
+    nethack_rl::NetHackRL::rl_free_snapshot(snapshot);
+}
+
 struct window_procs rl_procs = {
     "rl",
     (WC_COLOR | WC_HILITE_PET | WC_INVERSE | WC_EIGHT_BIT_IN